@@ -0,0 +1,90 @@
+"""
+Login throughput and latency vs number of concurrent clients.
+
+Each client logs in repeatedly from its own thread. Reports the number of
+successful logins per second, the p50 / p99 latency of all requests, and
+how many requests were rejected with 429 because the hashing pool was full.
+
+    python benchmarks/bench_login.py --concurrency 1,4,16 --hashing-threads 4
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import click
+from predicTCR_server import create_app
+from predicTCR_server.logger import get_logger
+from predicTCR_server.model import db, User, hash_password
+
+
+def _client_logins(app, n_logins: int) -> list[tuple[float, int]]:
+    client = app.test_client()
+    results = []
+    for _ in range(n_logins):
+        start = time.perf_counter()
+        response = client.post(
+            "/api/login", json={"email": "user@abc.xy", "password": "user"}
+        )
+        results.append((time.perf_counter() - start, response.status_code))
+    return results
+
+
+@click.command()
+@click.option("--concurrency", default="1,2,4,8,16", show_default=True)
+@click.option("--logins-per-client", default=10, show_default=True)
+@click.option("--hashing-threads", default=4, show_default=True)
+@click.option("--hashing-queue", default=2, show_default=True)
+def main(
+    concurrency: str, logins_per_client: int, hashing_threads: int, hashing_queue: int
+):
+    get_logger().setLevel(logging.ERROR)
+    os.environ["PREDICTCR_REAPER_INTERVAL_SECS"] = "0"
+    os.environ["PREDICTCR_HASHING_THREADS"] = str(hashing_threads)
+    os.environ["PREDICTCR_HASHING_QUEUE"] = str(hashing_queue)
+    with tempfile.TemporaryDirectory() as data_path:
+        app = create_app(data_path=data_path)
+        with app.app_context():
+            db.session.add(
+                User(
+                    id=None,
+                    email="user@abc.xy",
+                    password_hash=hash_password("user"),
+                    activated=True,
+                    enabled=True,
+                    quota=1,
+                    submission_interval_minutes=1,
+                    last_submission_timestamp=0,
+                    is_admin=False,
+                    is_runner=False,
+                    full_results=False,
+                )
+            )
+            db.session.commit()
+        click.echo(
+            f"{'clients':>8} {'logins/s':>10} {'p50 [ms]':>10} {'p99 [ms]':>10} {'rejected':>10}"
+        )
+        for n_clients in [int(n) for n in concurrency.split(",")]:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=n_clients) as executor:
+                futures = [
+                    executor.submit(_client_logins, app, logins_per_client)
+                    for _ in range(n_clients)
+                ]
+                results = [result for f in futures for result in f.result()]
+            elapsed_secs = time.perf_counter() - start
+            latencies = sorted(1000 * secs for secs, _ in results)
+            n_ok = sum(1 for _, code in results if code == 200)
+            n_rejected = sum(1 for _, code in results if code == 429)
+            p99 = statistics.quantiles(latencies, n=100)[98]
+            click.echo(
+                f"{n_clients:>8} {n_ok / elapsed_secs:>10.1f} {statistics.median(latencies):>10.1f} {p99:>10.1f} {n_rejected:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
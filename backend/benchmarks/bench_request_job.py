@@ -0,0 +1,67 @@
+"""
+Runner poll latency vs sample table size.
+
+Seeds a database with an increasing number of finished samples, plus a few
+queued ones, and reports the mean time taken by `request_job` to claim the
+next queued sample.
+
+    python benchmarks/bench_request_job.py --max-samples 100000
+"""
+
+from __future__ import annotations
+
+import logging
+import tempfile
+import timeit
+import click
+from predicTCR_server import create_app
+from predicTCR_server.logger import get_logger
+from predicTCR_server.model import db, Sample, Status, request_job
+
+
+def _seed_samples(n_samples: int, first_timestamp: int, status: Status) -> None:
+    db.session.execute(
+        db.insert(Sample),
+        [
+            {
+                "email": f"user{n % 100}@abc.xy",
+                "name": f"sample{n}",
+                "tumor_type": "Lung",
+                "source": "TIL",
+                "platform": "Illumina",
+                "timestamp": first_timestamp + n,
+                "timestamp_job_start": first_timestamp + n,
+                "timestamp_job_end": first_timestamp + n + 1,
+                "status": status,
+                "has_results_zip": status == Status.COMPLETED,
+                "error_message": "",
+            }
+            for n in range(n_samples)
+        ],
+    )
+    db.session.commit()
+
+
+@click.command()
+@click.option("--max-samples", default=100_000, show_default=True)
+@click.option("--polls", default=200, show_default=True)
+def main(max_samples: int, polls: int):
+    get_logger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as data_path:
+        app = create_app(data_path=data_path)
+        with app.app_context():
+            n_samples = 0
+            table_size = 1_000
+            click.echo(f"{'samples':>10} {'mean poll latency [ms]':>24}")
+            while n_samples < max_samples:
+                table_size = min(table_size, max_samples)
+                _seed_samples(table_size - n_samples, n_samples, Status.COMPLETED)
+                n_samples = table_size
+                _seed_samples(polls, 10 * max_samples, Status.QUEUED)
+                mean_secs = timeit.timeit(request_job, number=polls) / polls
+                click.echo(f"{n_samples:>10} {1000 * mean_secs:>24.3f}")
+                table_size *= 10
+
+
+if __name__ == "__main__":
+    main()
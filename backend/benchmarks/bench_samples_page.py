@@ -0,0 +1,83 @@
+"""
+Sample listing latency vs sample table size.
+
+Seeds a database with an increasing number of samples and reports the mean
+time taken to fetch the first and a deep page of samples, for all samples
+(admin view) and for a single user's samples.
+
+    python benchmarks/bench_samples_page.py --max-samples 100000
+"""
+
+from __future__ import annotations
+
+import logging
+import tempfile
+import timeit
+import click
+from predicTCR_server import create_app
+from predicTCR_server.logger import get_logger
+from predicTCR_server.model import db, Sample, Status, get_samples_page
+
+
+def _seed_samples(n_samples: int, first_timestamp: int) -> None:
+    db.session.execute(
+        db.insert(Sample),
+        [
+            {
+                "email": f"user{n % 100}@abc.xy",
+                "name": f"sample{n}",
+                "tumor_type": "Lung",
+                "source": "TIL",
+                "platform": "Illumina",
+                "timestamp": first_timestamp + n,
+                "timestamp_job_start": first_timestamp + n,
+                "timestamp_job_end": first_timestamp + n + 1,
+                "status": Status.COMPLETED,
+                "has_results_zip": True,
+                "error_message": "",
+            }
+            for n in range(n_samples)
+        ],
+    )
+    db.session.commit()
+
+
+@click.command()
+@click.option("--max-samples", default=100_000, show_default=True)
+@click.option("--page-size", default=100, show_default=True)
+@click.option("--repeats", default=50, show_default=True)
+def main(max_samples: int, page_size: int, repeats: int):
+    get_logger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as data_path:
+        app = create_app(data_path=data_path)
+        with app.app_context():
+            n_samples = 0
+            table_size = 1_000
+            click.echo(
+                f"{'samples':>10} {'email':>14} {'first page [ms]':>16} {'deep page [ms]':>16}"
+            )
+            while n_samples < max_samples:
+                table_size = min(table_size, max_samples)
+                _seed_samples(table_size - n_samples, n_samples)
+                n_samples = table_size
+                # cursor pointing half way into the table
+                deep_cursor = f"{n_samples // 2}:{n_samples // 2}"
+                for email in [None, "user0@abc.xy"]:
+                    timings = [
+                        timeit.timeit(
+                            lambda: get_samples_page(
+                                email=email, limit=page_size, cursor=cursor
+                            ),
+                            number=repeats,
+                        )
+                        / repeats
+                        for cursor in [None, deep_cursor]
+                    ]
+                    click.echo(
+                        f"{n_samples:>10} {email or 'all':>14} {1000 * timings[0]:>16.3f} {1000 * timings[1]:>16.3f}"
+                    )
+                table_size *= 10
+
+
+if __name__ == "__main__":
+    main()
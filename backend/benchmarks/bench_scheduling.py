@@ -0,0 +1,147 @@
+"""
+Queue wait times of each user with each scheduling policy.
+
+Replays a synthetic submission trace against the backend's job queue, using
+the same query that gives samples to runners, with a simulated clock: one user
+submits a burst of samples at the start, while the other users each submit a
+sample at random times. A fraction of the samples are given a higher priority,
+as an admin would. Each runner takes a random time to run a job. Reports the
+p50 / p95 / max time each user's samples wait in the queue for each policy.
+
+    python benchmarks/bench_scheduling.py --users 8 --burst-size 20 --runners 2
+"""
+
+from __future__ import annotations
+
+import heapq
+import logging
+import os
+import random
+import tempfile
+import click
+from predicTCR_server import create_app
+from predicTCR_server.logger import get_logger
+from predicTCR_server.model import (
+    db,
+    Sample,
+    Status,
+    scheduling_policies,
+    _claim_queued_sample,
+)
+
+_start_time = 1_000_000
+
+
+def _make_trace(
+    n_users: int, burst_size: int, duration_hours: float, priority_fraction: float
+) -> list[tuple[int, str, int]]:
+    rng = random.Random(42)
+    duration_secs = int(duration_hours * 3600)
+    trace = [(_start_time, "burst@abc.xy") for _ in range(burst_size)]
+    for n in range(n_users):
+        trace += [
+            (_start_time + rng.randrange(duration_secs), f"user{n}@abc.xy")
+            for _ in range(rng.randint(1, 4))
+        ]
+    return [
+        (timestamp, email, 1 if rng.random() < priority_fraction else 0)
+        for timestamp, email in sorted(trace)
+    ]
+
+
+def _simulate(
+    trace: list[tuple[int, str, int]], n_runners: int, job_mins: tuple[int, int]
+) -> dict[str, list[int]]:
+    rng = random.Random(7)
+    db.session.execute(db.delete(Sample))
+    db.session.commit()
+    waits: dict[str, list[int]] = {}
+    submissions = list(trace)
+    running: list[tuple[int, int]] = []
+    now = _start_time
+    while submissions or running:
+        # advance the clock to the next submission or finished job
+        now = min(events[0][0] for events in [submissions, running] if events)
+        while submissions and submissions[0][0] <= now:
+            timestamp, email, priority = submissions.pop(0)
+            db.session.add(
+                Sample(
+                    id=None,
+                    email=email,
+                    name="sample",
+                    tumor_type="Lung",
+                    source="TIL",
+                    platform="Illumina",
+                    timestamp=timestamp,
+                    timestamp_job_start=0,
+                    timestamp_job_end=0,
+                    status=Status.QUEUED,
+                    has_results_zip=False,
+                    error_message="",
+                    priority=priority,
+                )
+            )
+        while running and running[0][0] <= now:
+            _, sample_id = heapq.heappop(running)
+            db.session.execute(
+                db.update(Sample)
+                .where(Sample.id == sample_id)
+                .values(status=Status.COMPLETED, timestamp_job_end=now)
+            )
+        db.session.commit()
+        while len(running) < n_runners:
+            sample = _claim_queued_sample(now)
+            if sample is None:
+                break
+            waits.setdefault(sample.email, []).append(now - sample.timestamp)
+            job_secs = 60 * rng.randint(*job_mins)
+            heapq.heappush(running, (now + job_secs, sample.id))
+    return waits
+
+
+def _percentile(values: list[int], percent: int) -> int:
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * percent // 100)]
+
+
+@click.command()
+@click.option("--users", default=8, show_default=True)
+@click.option("--burst-size", default=20, show_default=True)
+@click.option("--runners", default=2, show_default=True)
+@click.option("--duration-hours", default=4.0, show_default=True)
+@click.option("--priority-fraction", default=0.1, show_default=True)
+@click.option("--aging-secs", default=3600, show_default=True)
+def main(
+    users: int,
+    burst_size: int,
+    runners: int,
+    duration_hours: float,
+    priority_fraction: float,
+    aging_secs: int,
+):
+    for interval in ["REAPER", "VALIDATION", "EMAIL", "BLOB_GC"]:
+        os.environ[f"PREDICTCR_{interval}_INTERVAL_SECS"] = "0"
+    os.environ["PREDICTCR_NOTIFICATION_WINDOW_SECS"] = "0"
+    get_logger().setLevel(logging.WARNING)
+    trace = _make_trace(users, burst_size, duration_hours, priority_fraction)
+    with tempfile.TemporaryDirectory() as data_path:
+        app = create_app(data_path=data_path)
+        app.config["PREDICTCR_SCHEDULING_AGING_SECS"] = aging_secs
+        click.echo(
+            f"{'policy':>12} {'user':>14} {'samples':>8} {'p50 [min]':>10} {'p95 [min]':>10} {'max [min]':>10}"
+        )
+        for policy in scheduling_policies:
+            app.config["PREDICTCR_SCHEDULING_POLICY"] = policy
+            with app.app_context():
+                waits = _simulate(trace, runners, (5, 15))
+            for email, user_waits in sorted(waits.items()):
+                click.echo(
+                    f"{policy:>12} {email.split('@')[0]:>14} {len(user_waits):>8} "
+                    f"{_percentile(user_waits, 50) / 60:>10.1f} "
+                    f"{_percentile(user_waits, 95) / 60:>10.1f} "
+                    f"{max(user_waits) / 60:>10.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
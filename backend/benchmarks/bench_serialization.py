@@ -0,0 +1,87 @@
+"""
+Serialization time for large lists of jobs.
+
+Seeds a database with jobs and compares the time taken to turn all of them
+into JSON using the previous approach (load ORM objects, `as_dict` using
+`inspect` on each object, `jsonify`) with the column-cached tuple fast path
+and chunked JSON encoding used by the admin endpoints.
+
+    python benchmarks/bench_serialization.py --jobs 50000
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import tempfile
+import timeit
+import click
+import flask
+from sqlalchemy.inspection import inspect
+from predicTCR_server import create_app
+from predicTCR_server.logger import get_logger
+from predicTCR_server.model import (
+    db,
+    Job,
+    Status,
+    select_serialized,
+    serialized_columns,
+    iter_dicts,
+)
+
+
+def _seed_jobs(n_jobs: int) -> None:
+    db.session.execute(
+        db.insert(Job),
+        [
+            {
+                "sample_id": n,
+                "runner_id": 3,
+                "runner_hostname": f"runner{n % 10}",
+                "timestamp_start": n,
+                "timestamp_end": n + 100,
+                "status": Status.COMPLETED,
+                "error_message": "",
+            }
+            for n in range(n_jobs)
+        ],
+    )
+    db.session.commit()
+
+
+def _orm_as_dict() -> int:
+    jobs = db.session.execute(db.select(Job).order_by(db.desc(Job.id))).scalars()
+    response = flask.jsonify(
+        jobs=[{c: getattr(job, c) for c in inspect(job).attrs.keys()} for job in jobs]
+    )
+    db.session.expunge_all()
+    return len(response.get_data())
+
+
+def _tuple_fast_path() -> int:
+    rows = iter_dicts(
+        select_serialized(Job).order_by(db.desc(Job.id)), serialized_columns(Job)
+    )
+    return len(",".join(json.dumps(row) for row in rows))
+
+
+@click.command()
+@click.option("--jobs", default=50_000, show_default=True)
+@click.option("--repeats", default=5, show_default=True)
+def main(jobs: int, repeats: int):
+    get_logger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as data_path:
+        app = create_app(data_path=data_path)
+        with app.test_request_context():
+            _seed_jobs(jobs)
+            click.echo(f"{'method':>18} {'time for ' + str(jobs) + ' jobs [ms]':>24}")
+            for name, method in [
+                ("orm + as_dict", _orm_as_dict),
+                ("tuple fast path", _tuple_fast_path),
+            ]:
+                mean_secs = timeit.timeit(method, number=repeats) / repeats
+                click.echo(f"{name:>18} {1000 * mean_secs:>24.1f}")
+
+
+if __name__ == "__main__":
+    main()
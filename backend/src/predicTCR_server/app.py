@@ -1,10 +1,17 @@
 from __future__ import annotations
 
 import os
+import json
+import math
+import time
+import itertools
 import secrets
 import datetime
 import shutil
+import threading
+import pathlib
 import flask
+from typing import Callable, Iterable
 from flask import Flask
 from flask import jsonify
 from flask import request
@@ -14,7 +21,18 @@ from flask_jwt_extended import jwt_required
 from flask_jwt_extended import JWTManager
 from flask_cors import cross_origin
 from predicTCR_server.logger import get_logger
-from predicTCR_server.utils import timestamp_now
+from predicTCR_server.background import start_periodic_task
+from predicTCR_server.database import engine_options, configure_sqlite
+from predicTCR_server.events import QueueSignal, EventBroker, EventStreamsBusy
+from predicTCR_server.email import EmailSpool, send_queued_emails
+from predicTCR_server.cache import VersionedCache, TTLCache
+from predicTCR_server.hashing import (
+    HashingPool,
+    HashingPoolBusy,
+    argon2_parameters_error,
+)
+from predicTCR_server.blobs import BlobStore
+from predicTCR_server.utils import timestamp_now, file_size_bytes
 from predicTCR_server.model import (
     db,
     Sample,
@@ -28,11 +46,43 @@ from predicTCR_server.model import (
     update_user,
     activate_user,
     add_new_sample,
+    start_sample_upload,
+    get_sample_upload_status,
+    upload_sample_chunk,
+    finish_sample_upload,
     get_samples,
+    get_samples_page,
+    get_page_by_id,
+    get_job_stats,
+    get_settings,
+    load_settings,
+    get_user_by_id,
+    notify_settings_changed,
+    serialized_columns,
+    select_serialized,
+    iter_dicts,
     send_password_reset_email,
     request_job,
     process_result,
+    release_job,
     get_user_if_allowed_to_submit,
+    upgrade_database,
+    requeue_timed_out_samples,
+    delete_stale_uploads,
+    notify_queue,
+    send_notification_digests,
+    publish_sample_event,
+    publish_sample_deleted_event,
+    publish_job_event,
+    load_result_manifest,
+    result_zip_file,
+    delete_results,
+    migrate_result_zips,
+    collect_result_garbage,
+    validate_samples,
+    set_sample_priority,
+    runner_sample_filter,
+    scheduling_policies,
 )
 
 
@@ -51,13 +101,155 @@ def create_app(data_path: str = "/predictcr_data"):
         app.config["JWT_SECRET_KEY"] = secrets.token_urlsafe(64)
     # tokens are by default valid for 1 hour
     app.config["JWT_ACCESS_TOKEN_EXPIRES"] = datetime.timedelta(minutes=60)
-    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{data_path}/predicTCR.db"
+    # database to use, by default a SQLite database in the data directory
+    app.config["SQLALCHEMY_DATABASE_URI"] = (
+        os.environ.get("PREDICTCR_DATABASE_URI")
+        or f"sqlite:///{data_path}/predicTCR.db"
+    )
+    # connection pool should be large enough for every worker thread to hold a connection
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+        app.config["SQLALCHEMY_DATABASE_URI"],
+        pool_size=int(os.environ.get("PREDICTCR_DATABASE_POOL_SIZE", 16)),
+        max_overflow=int(os.environ.get("PREDICTCR_DATABASE_MAX_OVERFLOW", 8)),
+    )
+    # how long a SQLite write waits for another write to finish before failing
+    app.config["PREDICTCR_SQLITE_BUSY_TIMEOUT_MS"] = int(
+        os.environ.get("PREDICTCR_SQLITE_BUSY_TIMEOUT_MS", 10000)
+    )
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     # limit max file upload size to 100mb
     app.config["MAX_CONTENT_LENGTH"] = 100 * 1024 * 1024
+    # result zip files uploaded by runners can be larger: max total size of the three of them
+    app.config["PREDICTCR_RESULT_MAX_SIZE_MB"] = int(
+        os.environ.get("PREDICTCR_RESULT_MAX_SIZE_MB", 2048)
+    )
     app.config["PREDICTCR_DATA_PATH"] = data_path
+    # how often to requeue samples whose job has timed out, 0 to disable
+    app.config["PREDICTCR_REAPER_INTERVAL_SECS"] = int(
+        os.environ.get("PREDICTCR_REAPER_INTERVAL_SECS", 60)
+    )
+    # samples whose upload has not received a chunk for this long are deleted by the reaper
+    app.config["PREDICTCR_UPLOAD_EXPIRY_HOURS"] = int(
+        os.environ.get("PREDICTCR_UPLOAD_EXPIRY_HOURS", 24)
+    )
+    # how often to check the input files of submitted samples before they are queued,
+    # 0 to check them in the request that submits them instead
+    app.config["PREDICTCR_VALIDATION_INTERVAL_SECS"] = int(
+        os.environ.get("PREDICTCR_VALIDATION_INTERVAL_SECS", 2)
+    )
+    # how often to send queued emails, 0 to disable
+    app.config["PREDICTCR_EMAIL_INTERVAL_SECS"] = int(
+        os.environ.get("PREDICTCR_EMAIL_INTERVAL_SECS", 5)
+    )
+    # finished samples are collected and sent to each user as one email this often, 0 to disable
+    app.config["PREDICTCR_NOTIFICATION_WINDOW_SECS"] = int(
+        os.environ.get("PREDICTCR_NOTIFICATION_WINDOW_SECS", 300)
+    )
+    # SMTP server used to send emails, empty to log them instead
+    app.config["PREDICTCR_SMTP_SERVER"] = os.environ.get(
+        "PREDICTCR_SMTP_SERVER", "email:587"
+    )
+    app.extensions["predictcr_email_spool"] = EmailSpool(f"{data_path}/email_spool")
+    # result zip files are stored as their members, each distinct member only once
+    app.extensions["predictcr_blob_store"] = BlobStore(f"{data_path}/blobs")
+    # assembled result zip files are deleted if they have not been downloaded for this long
+    app.config["PREDICTCR_RESULT_ZIP_CACHE_DAYS"] = int(
+        os.environ.get("PREDICTCR_RESULT_ZIP_CACHE_DAYS", 7)
+    )
+    # how often to delete stored result files that are no longer used, 0 to disable
+    app.config["PREDICTCR_BLOB_GC_INTERVAL_SECS"] = int(
+        os.environ.get("PREDICTCR_BLOB_GC_INTERVAL_SECS", 86400)
+    )
+    # max time a runner job request can wait for a sample to be queued
+    app.config["PREDICTCR_LONG_POLL_MAX_WAIT_SECS"] = int(
+        os.environ.get("PREDICTCR_LONG_POLL_MAX_WAIT_SECS", 20)
+    )
+    # number of threads of each gunicorn worker, i.e. of requests it can serve at once
+    worker_threads = int(os.environ.get("PREDICTCR_WORKER_THREADS", 16))
+    # requests that wait for an event stream, a queued sample or password hashing each
+    # occupy a worker thread: at most this many of them are admitted at once, further
+    # ones are answered immediately, and the rest of the threads serve other requests
+    max_event_streams = int(os.environ.get("PREDICTCR_EVENT_STREAMS_MAX", 4))
+    max_long_poll_waiters = int(os.environ.get("PREDICTCR_LONG_POLL_MAX_WAITERS", 2))
+    hashing_threads = int(os.environ.get("PREDICTCR_HASHING_THREADS", 4))
+    hashing_queue = int(os.environ.get("PREDICTCR_HASHING_QUEUE", 2))
+    blocking_requests = (
+        max_event_streams + max_long_poll_waiters + hashing_threads + hashing_queue
+    )
+    if blocking_requests >= worker_threads:
+        raise ValueError(
+            f"PREDICTCR_EVENT_STREAMS_MAX + PREDICTCR_LONG_POLL_MAX_WAITERS + PREDICTCR_HASHING_THREADS + PREDICTCR_HASHING_QUEUE = {blocking_requests} should be less than PREDICTCR_WORKER_THREADS = {worker_threads}"
+        )
+    # further runner job requests return immediately if no sample is queued, 0 to disable long polling
+    app.extensions["predictcr_long_poll_slots"] = threading.BoundedSemaphore(
+        max_long_poll_waiters
+    )
+    # order in which queued samples are given to runners: fifo, priority or fair_share
+    app.config["PREDICTCR_SCHEDULING_POLICY"] = os.environ.get(
+        "PREDICTCR_SCHEDULING_POLICY", "fifo"
+    )
+    if app.config["PREDICTCR_SCHEDULING_POLICY"] not in scheduling_policies:
+        raise ValueError(
+            f"Unknown PREDICTCR_SCHEDULING_POLICY '{app.config['PREDICTCR_SCHEDULING_POLICY']}', should be one of {', '.join(scheduling_policies)}"
+        )
+    # waiting this long counts as one priority level with the priority & fair_share policies, 0 to disable
+    app.config["PREDICTCR_SCHEDULING_AGING_SECS"] = int(
+        os.environ.get("PREDICTCR_SCHEDULING_AGING_SECS", 3600)
+    )
+    # memory a job needs per MB of input files, used to only give runners samples that fit in their memory, 0 to disable
+    app.config["PREDICTCR_MEMORY_MB_PER_INPUT_MB"] = float(
+        os.environ.get("PREDICTCR_MEMORY_MB_PER_INPUT_MB", 0)
+    )
+    # max number of samples, jobs or users returned per page
+    app.config["PREDICTCR_PAGE_MAX_LIMIT"] = 1000
+    # if set, file downloads are offloaded to nginx using X-Accel-Redirect to this internal location
+    app.config["PREDICTCR_X_ACCEL_REDIRECT"] = os.environ.get(
+        "PREDICTCR_X_ACCEL_REDIRECT", ""
+    ).rstrip("/")
+    app.extensions["predictcr_queue_signal"] = QueueSignal(f"{data_path}/queue.signal")
+    # max time an event stream stays open before the client reconnects
+    app.config["PREDICTCR_EVENT_STREAM_MAX_SECS"] = int(
+        os.environ.get("PREDICTCR_EVENT_STREAM_MAX_SECS", 25)
+    )
+    # further clients poll instead of opening an event stream, 0 to disable event streams
+    app.extensions["predictcr_event_broker"] = EventBroker(
+        max_streams=max_event_streams
+    )
+    app.extensions["predictcr_settings_cache"] = VersionedCache(
+        f"{data_path}/settings.version", load_settings
+    )
+    # how long the values of a user are cached by each process, 0 to disable
+    app.extensions["predictcr_user_cache"] = TTLCache(
+        f"{data_path}/users.version",
+        ttl_secs=int(os.environ.get("PREDICTCR_USER_CACHE_TTL_SECS", 30)),
+        max_size=1024,
+    )
+
+    # password hashing is limited to this many threads, with this many more requests waiting
+    app.extensions["predictcr_hashing_pool"] = HashingPool(
+        max_workers=hashing_threads, max_queued=hashing_queue
+    )
 
     jwt = JWTManager(app)
+
+    @app.errorhandler(HashingPoolBusy)
+    def hashing_pool_busy(e):
+        logger.warning("Password hashing pool is busy: rejecting request")
+        return (
+            jsonify(message="Server is busy, please try again in a few seconds"),
+            429,
+            {"Retry-After": "5"},
+        )
+
+    @app.errorhandler(EventStreamsBusy)
+    def event_streams_busy(e):
+        logger.debug("No event streams available: rejecting request")
+        return (
+            jsonify(message="No event streams available, please poll instead"),
+            503,
+            {"Retry-After": "60"},
+        )
+
     db.init_app(app)
 
     # https://flask-jwt-extended.readthedocs.io/en/stable/api/#flask_jwt_extended.JWTManager.user_identity_loader
@@ -69,9 +261,7 @@ def create_app(data_path: str = "/predictcr_data"):
     @jwt.user_lookup_loader
     def user_lookup_callback(_jwt_header, jwt_data):
         identity = int(jwt_data["sub"])
-        return db.session.execute(
-            db.select(User).filter(User.id == identity)
-        ).scalar_one_or_none()
+        return get_user_by_id(identity)
 
     @app.route("/api/login", methods=["POST"])
     def login():
@@ -146,14 +336,156 @@ def create_app(data_path: str = "/predictcr_data"):
             400,
         )
 
+    def _stream_json_array(rows: Iterable[dict], key: str | None = None):
+        # encode and send large lists in chunks instead of building the whole response in memory
+        def generate():
+            yield "[" if key is None else f'{{"{key}":['
+            separator = ""
+            rows_iter = iter(rows)
+            while chunk := list(itertools.islice(rows_iter, 1000)):
+                yield separator + ",".join(json.dumps(row) for row in chunk)
+                separator = ","
+            yield "]" if key is None else "]}"
+
+        return flask.Response(
+            flask.stream_with_context(generate()), mimetype="application/json"
+        )
+
+    def _samples_page(email: str | None):
+        limit = min(
+            request.args.get("limit", 100, type=int),
+            app.config["PREDICTCR_PAGE_MAX_LIMIT"],
+        )
+        if limit < 1:
+            return jsonify(message="Invalid limit"), 400
+        statuses = request.args.get("status", None)
+        fields = request.args.get("fields", None)
+        response, code = get_samples_page(
+            email=email,
+            limit=limit,
+            cursor=request.args.get("cursor", None),
+            statuses=statuses.split(",") if statuses else None,
+            tumor_type=request.args.get("tumor_type", None),
+            timestamp_from=request.args.get("timestamp_from", None, type=int),
+            timestamp_to=request.args.get("timestamp_to", None, type=int),
+            fields=fields.split(",") if fields else None,
+        )
+        return jsonify(response), code
+
+    def _event_stream(accept: Callable[[dict], bool]):
+        # events come from the in-process broker, so streaming doesn't use the database
+        broker = app.extensions["predictcr_event_broker"]
+        broker.open_stream()
+        max_secs = app.config["PREDICTCR_EVENT_STREAM_MAX_SECS"]
+
+        def generate(sequence: int | None):
+            deadline = time.monotonic() + max_secs
+            if sequence is None:
+                # the events the client missed are no longer available
+                sequence = broker.sequence(None)
+                yield f"id: {broker.event_id(sequence)}\nevent: reset\ndata: {{}}\n\n"
+            else:
+                yield f"id: {broker.event_id(sequence)}\n\n"
+            while True:
+                remaining_secs = deadline - time.monotonic()
+                events = broker.wait_for_events(
+                    sequence, min(max(remaining_secs, 0), 15)
+                )
+                if events is None:
+                    sequence = broker.sequence(None)
+                    yield f"id: {broker.event_id(sequence)}\nevent: reset\ndata: {{}}\n\n"
+                for sequence, event in events or []:
+                    if accept(event):
+                        yield f"id: {broker.event_id(sequence)}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+                if remaining_secs <= 0:
+                    break
+                if not events:
+                    # keep idle connections from being closed by proxies
+                    yield ": keep-alive\n\n"
+            # resume after the last event, even if it was not sent to this client
+            yield f"id: {broker.event_id(sequence)}\n\n"
+
+        response = flask.Response(
+            generate(broker.sequence(request.headers.get("Last-Event-ID"))),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+        response.call_on_close(broker.close_stream)
+        return response
+
+    @app.route("/api/samples/events", methods=["GET"])
+    @jwt_required()
+    def samples_events():
+        email = current_user.email
+        return _event_stream(
+            lambda event: (
+                event["type"] in ["sample", "sample_deleted"]
+                and event["data"]["email"] == email
+            )
+        )
+
     @app.route("/api/samples", methods=["GET"])
     @jwt_required()
     def samples():
-        return get_samples(current_user.email)
+        # without query parameters all samples are returned, otherwise a page of samples
+        if request.args:
+            return _samples_page(current_user.email)
+        return _stream_json_array(get_samples(current_user.email))
 
     @app.route("/api/settings", methods=["GET"])
-    def get_settings():
-        return db.session.get(Settings, 1).as_dict()
+    def settings():
+        response = jsonify(get_settings().as_dict())
+        # allows browsers to revalidate their cached settings without downloading them again
+        response.add_etag()
+        return response.make_conditional(request)
+
+    def _send_data_file(
+        path: pathlib.Path, etag: str | bool = True, download_name: str | None = None
+    ):
+        x_accel_redirect = app.config["PREDICTCR_X_ACCEL_REDIRECT"]
+        if isinstance(etag, str) and request.if_none_match.contains(etag):
+            logger.info(f"  -> {path} not modified")
+            return flask.Response(status=304, headers={"ETag": f'"{etag}"'})
+        if x_accel_redirect != "":
+            # let nginx serve the file: it then also handles Range & conditional requests
+            relative_path = path.relative_to(app.config["PREDICTCR_DATA_PATH"])
+            logger.info(f"  -> offloading {relative_path} to {x_accel_redirect}")
+            response = flask.Response(mimetype="application/octet-stream")
+            response.headers.set(
+                "Content-Disposition", "attachment", filename=download_name or path.name
+            )
+            response.headers["X-Accel-Redirect"] = f"{x_accel_redirect}/{relative_path}"
+            return response
+        response = flask.send_file(
+            path,
+            as_attachment=True,
+            download_name=download_name,
+            conditional=False,
+            etag=etag,
+        )
+        # the download endpoints are POST requests, but the files they return are
+        # fixed, so handle If-None-Match / If-Range / Range as if they were GET requests
+        environ = dict(request.environ, REQUEST_METHOD="GET")
+        return response.make_conditional(
+            environ, accept_ranges=True, complete_length=path.stat().st_size
+        )
+
+    def _send_result_zip(manifest_path: pathlib.Path):
+        manifest = load_result_manifest(manifest_path)
+        if manifest is None:
+            logger.info(f"  -> file {manifest_path} not found")
+            return jsonify(message="Results file not found"), 400
+        members, etag = manifest
+        if request.if_none_match.contains(etag):
+            logger.info(f"  -> {manifest_path} not modified")
+            return flask.Response(status=304, headers={"ETag": f'"{etag}"'})
+        logger.info(f"Returning zip file assembled from {manifest_path}")
+        # the assembled zip file is kept, so it can be offloaded to nginx & range requested
+        return _send_data_file(
+            result_zip_file(members, etag),
+            etag,
+            download_name=manifest_path.name.removesuffix(".manifest.json") + ".zip",
+        )
 
     @app.route("/api/input_h5_file", methods=["POST"])
     @jwt_required()
@@ -171,7 +503,10 @@ def create_app(data_path: str = "/predictcr_data"):
         if user_sample is None:
             logger.info(f"  -> sample {sample_id} not found")
             return jsonify(message="Sample not found"), 400
-        return flask.send_file(user_sample.input_h5_file_path(), as_attachment=True)
+        # the sha256 of the input file is its ETag: clients with a cached copy can skip the download
+        return _send_data_file(
+            user_sample.input_h5_file_path(), user_sample.input_h5_sha256 or True
+        )
 
     @app.route("/api/input_csv_file", methods=["POST"])
     @jwt_required()
@@ -189,7 +524,9 @@ def create_app(data_path: str = "/predictcr_data"):
         if user_sample is None:
             logger.info(f"  -> sample {sample_id} not found")
             return jsonify(message="Sample not found"), 400
-        return flask.send_file(user_sample.input_csv_file_path(), as_attachment=True)
+        return _send_data_file(
+            user_sample.input_csv_file_path(), user_sample.input_csv_sha256 or True
+        )
 
     @app.route("/api/result", methods=["POST"])
     @jwt_required()
@@ -211,14 +548,8 @@ def create_app(data_path: str = "/predictcr_data"):
             logger.info(f"  -> sample {sample_id} found but no results available")
             return jsonify(message="No results available"), 400
         if current_user.full_results:
-            requested_file = user_sample.trusted_user_result_file_path()
-        else:
-            requested_file = user_sample.user_result_file_path()
-        if not requested_file.is_file():
-            logger.info(f"  -> file {requested_file} not found")
-            return jsonify(message="Results file not found"), 400
-        logger.info(f"Returning file {requested_file}")
-        return flask.send_file(requested_file, as_attachment=True)
+            return _send_result_zip(user_sample.trusted_user_result_file_path())
+        return _send_result_zip(user_sample.user_result_file_path())
 
     @app.route("/api/user_submit_message", methods=["GET"])
     @jwt_required()
@@ -246,6 +577,50 @@ def create_app(data_path: str = "/predictcr_data"):
             return jsonify(sample=new_sample)
         return jsonify(message=error_message), 400
 
+    @app.route("/api/sample/upload", methods=["POST"])
+    @jwt_required()
+    def start_upload():
+        email = current_user.email
+        name = request.json.get("name", "")
+        tumor_type = request.json.get("tumor_type", "")
+        source = request.json.get("source", "")
+        platform = request.json.get("platform", "")
+        logger.info(f"Starting upload of sample {name} from {email}")
+        new_sample, error_message = start_sample_upload(
+            email, name, tumor_type, source, platform
+        )
+        if new_sample is not None:
+            return jsonify(sample=new_sample)
+        return jsonify(message=error_message), 400
+
+    @app.route("/api/sample/upload/<int:sample_id>", methods=["GET"])
+    @jwt_required()
+    def upload_status(sample_id: int):
+        response, code = get_sample_upload_status(current_user.email, sample_id)
+        return jsonify(response), code
+
+    @app.route("/api/sample/upload/<int:sample_id>/<input_file_type>", methods=["PUT"])
+    @jwt_required()
+    def upload_chunk(sample_id: int, input_file_type: str):
+        offset = request.args.get("offset", type=int)
+        if offset is None:
+            return jsonify(message="Missing offset"), 400
+        response, code = upload_sample_chunk(
+            current_user.email, sample_id, input_file_type, offset, request.stream
+        )
+        return jsonify(response), code
+
+    @app.route("/api/sample/upload/<int:sample_id>/finish", methods=["POST"])
+    @jwt_required()
+    def finish_upload(sample_id: int):
+        email = current_user.email
+        logger.info(f"Finishing upload of sample {sample_id} from {email}")
+        sample, error_message = finish_sample_upload(email, sample_id)
+        if sample is not None:
+            logger.info("  - > success")
+            return jsonify(sample=sample)
+        return jsonify(message=error_message), 400
+
     @app.route("/api/admin/result", methods=["POST"])
     @jwt_required()
     def admin_result():
@@ -259,19 +634,23 @@ def create_app(data_path: str = "/predictcr_data"):
         if user_sample is None:
             logger.info(f"  -> sample {sample_id} not found")
             return jsonify(message="Sample not found"), 400
-        requested_file = user_sample.admin_result_file_path()
-        if not requested_file.is_file():
-            logger.info(f"  -> file {requested_file} not found")
-            return jsonify(message="Results file not found"), 400
-        logger.info(f"Returning file {requested_file}")
-        return flask.send_file(requested_file, as_attachment=True)
+        return _send_result_zip(user_sample.admin_result_file_path())
 
     @app.route("/api/admin/samples", methods=["GET"])
     @jwt_required()
     def admin_all_samples():
         if not current_user.is_admin:
             return jsonify(message="Admin account required"), 400
-        return jsonify(get_samples())
+        if request.args:
+            return _samples_page(None)
+        return _stream_json_array(get_samples())
+
+    @app.route("/api/admin/events", methods=["GET"])
+    @jwt_required()
+    def admin_events():
+        if not current_user.is_admin:
+            return jsonify(message="Admin account required"), 400
+        return _event_stream(lambda event: True)
 
     @app.route("/api/admin/resubmit-sample/<int:sample_id>", methods=["POST"])
     @jwt_required()
@@ -281,15 +660,26 @@ def create_app(data_path: str = "/predictcr_data"):
         sample = db.session.get(Sample, sample_id)
         if sample is None:
             return jsonify(message="Sample not found"), 404
-        sample.user_result_file_path().unlink(missing_ok=True)
-        sample.trusted_user_result_file_path().unlink(missing_ok=True)
-        sample.admin_result_file_path().unlink(missing_ok=True)
+        delete_results(sample)
         sample.has_results_zip = False
         sample.error_message = ""
         sample.status = Status.QUEUED
         db.session.commit()
+        notify_queue()
+        publish_sample_event(sample)
         return jsonify(message="Sample added to the queue")
 
+    @app.route("/api/admin/samples/<int:sample_id>/priority", methods=["POST"])
+    @jwt_required()
+    def admin_set_sample_priority(sample_id: int):
+        if not current_user.is_admin:
+            return jsonify(message="Admin account required"), 400
+        priority = request.json.get("priority", None)
+        if not isinstance(priority, int):
+            return jsonify(message="Priority must be an integer"), 400
+        message, code = set_sample_priority(sample_id, priority)
+        return jsonify(message=message), code
+
     @app.route("/api/admin/samples/<int:sample_id>", methods=["DELETE"])
     @jwt_required()
     def admin_delete_sample(sample_id: int):
@@ -302,8 +692,10 @@ def create_app(data_path: str = "/predictcr_data"):
             shutil.rmtree(sample.base_path())
         except Exception as e:
             logger.error(e)
+        email = sample.email
         db.session.delete(sample)
         db.session.commit()
+        publish_sample_deleted_event(sample_id, email)
         return jsonify(message="Sample deleted")
 
     @app.route("/api/admin/user", methods=["POST"])
@@ -321,35 +713,89 @@ def create_app(data_path: str = "/predictcr_data"):
             return jsonify(message="Admin account required"), 400
         settings = db.session.get(Settings, 1)
         settings_as_dict = settings.as_dict()
+        updates = {}
         for key, value in request.json.items():
             if key in settings_as_dict:
-                setattr(settings, key, value)
+                updates[key] = value
             else:
                 logger.info(f"Ignoring key {key}")
+        # invalid argon2 parameters would prevent everyone from logging in
+        new_settings = {**settings_as_dict, **updates}
+        message = argon2_parameters_error(
+            new_settings["argon2_time_cost"],
+            new_settings["argon2_memory_cost_kib"],
+            new_settings["argon2_parallelism"],
+        )
+        if message:
+            return jsonify(message=message), 400
+        for key, value in updates.items():
+            setattr(settings, key, value)
         db.session.commit()
+        notify_settings_changed()
         return jsonify(message="Settings updated")
 
+    def _page_by_id(model):
+        limit = min(
+            request.args.get("limit", 100, type=int),
+            app.config["PREDICTCR_PAGE_MAX_LIMIT"],
+        )
+        if limit < 1:
+            return None, None
+        return get_page_by_id(model, limit, request.args.get("cursor", None, type=int))
+
     @app.route("/api/admin/users", methods=["GET"])
     @jwt_required()
     def admin_users():
         if not current_user.is_admin:
             return jsonify(message="Admin account required"), 400
-        users = (
-            db.session.execute(db.select(User).order_by(db.desc(User.id)))
-            .scalars()
-            .all()
+        if request.args:
+            users, next_cursor = _page_by_id(User)
+            if users is None:
+                return jsonify(message="Invalid limit"), 400
+            return jsonify(users=users, next_cursor=next_cursor)
+        return _stream_json_array(
+            iter_dicts(
+                select_serialized(User).order_by(db.desc(User.id)),
+                serialized_columns(User),
+            ),
+            "users",
         )
-        return jsonify(users=[user.as_dict() for user in users])
 
     @app.route("/api/admin/jobs", methods=["GET"])
     @jwt_required()
     def admin_jobs():
         if not current_user.is_admin:
             return jsonify(message="Admin account required"), 400
-        jobs = (
-            db.session.execute(db.select(Job).order_by(db.desc(Job.id))).scalars().all()
+        if request.args:
+            jobs, next_cursor = _page_by_id(Job)
+            if jobs is None:
+                return jsonify(message="Invalid limit"), 400
+            return jsonify(jobs=jobs, next_cursor=next_cursor)
+        return _stream_json_array(
+            iter_dicts(
+                select_serialized(Job).order_by(db.desc(Job.id)),
+                serialized_columns(Job),
+            ),
+            "jobs",
+        )
+
+    @app.route("/api/admin/jobs/stats", methods=["GET"])
+    @jwt_required()
+    def admin_job_stats():
+        if not current_user.is_admin:
+            return jsonify(message="Admin account required"), 400
+        return jsonify(runners=get_job_stats())
+
+    @app.route("/api/admin/cache_stats", methods=["GET"])
+    @jwt_required()
+    def admin_cache_stats():
+        if not current_user.is_admin:
+            return jsonify(message="Admin account required"), 400
+        return jsonify(
+            settings=app.extensions["predictcr_settings_cache"].stats(),
+            users=app.extensions["predictcr_user_cache"].stats(),
+            events=app.extensions["predictcr_event_broker"].stats(),
         )
-        return jsonify(jobs=[job.as_dict() for job in jobs])
 
     @app.route("/api/admin/runner_token", methods=["GET"])
     @jwt_required()
@@ -371,16 +817,35 @@ def create_app(data_path: str = "/predictcr_data"):
         if not current_user.is_runner:
             return jsonify(message="Runner account required"), 400
         runner_hostname = request.json.get("runner_hostname", "")
-        logger.info(f"Runner {current_user.email} / {runner_hostname} requesting job")
-        sample_id = request_job()
-        if sample_id is None:
-            return jsonify(message="No job available"), 204
-        sample = db.session.get(Sample, sample_id)
+        try:
+            wait_secs = float(request.json.get("wait_secs", 0))
+            if math.isnan(wait_secs) or wait_secs < 0:
+                raise ValueError(f"{wait_secs} is not a number of seconds")
+        except (TypeError, ValueError) as e:
+            logger.info(f"  -> invalid wait_secs: {e}")
+            return jsonify(message=f"Invalid wait_secs: {e}"), 400
+        wait_secs = min(wait_secs, app.config["PREDICTCR_LONG_POLL_MAX_WAIT_SECS"])
+        capabilities = request.json.get("capabilities", {})
+        logger.info(
+            f"Runner {current_user.email} / {runner_hostname} requesting job with capabilities {capabilities}"
+        )
+        try:
+            sample_filter = runner_sample_filter(capabilities)
+        except (TypeError, ValueError) as e:
+            logger.info(f"  -> invalid capabilities: {e}")
+            return jsonify(message=f"Invalid runner capabilities: {e}"), 400
+        long_poll_slots = app.extensions["predictcr_long_poll_slots"]
+        waiting = wait_secs > 0 and long_poll_slots.acquire(blocking=False)
+        try:
+            sample = request_job(wait_secs if waiting else 0, sample_filter)
+        finally:
+            if waiting:
+                long_poll_slots.release()
         if sample is None:
-            return jsonify(message="Sample not found"), 400
+            return jsonify(message="No job available"), 204
         new_job = Job(
             id=None,
-            sample_id=sample_id,
+            sample_id=sample.id,
             runner_id=current_user.id,
             runner_hostname=runner_hostname,
             timestamp_start=timestamp_now(),
@@ -390,21 +855,48 @@ def create_app(data_path: str = "/predictcr_data"):
         )
         db.session.add(new_job)
         db.session.commit()
+        publish_job_event(new_job)
         return {
             "job_id": new_job.id,
-            "sample_id": sample_id,
+            "sample_id": sample.id,
             "sample_name": sample.name,
             "sample_tumor_type": sample.tumor_type,
             "sample_source": sample.source,
             "sample_platform": sample.platform,
+            "input_h5_size_bytes": file_size_bytes(sample.input_h5_file_path()),
+            "input_csv_size_bytes": file_size_bytes(sample.input_csv_file_path()),
+            "input_h5_sha256": sample.input_h5_sha256,
+            "input_csv_sha256": sample.input_csv_sha256,
         }
 
+    @app.route("/api/runner/release_job", methods=["POST"])
+    @cross_origin()
+    @jwt_required()
+    def runner_release_job():
+        if not current_user.is_runner:
+            return jsonify(message="Runner account required"), 400
+        job_id = request.json.get("job_id", None)
+        if job_id is None:
+            return jsonify(message="Missing key: job_id"), 400
+        sample_id = request.json.get("sample_id", None)
+        if sample_id is None:
+            return jsonify(message="Missing key: sample_id"), 400
+        runner_hostname = request.json.get("runner_hostname", "")
+        logger.info(
+            f"Job '{job_id}' for sample '{sample_id}' released by runner {current_user.email} / {runner_hostname}"
+        )
+        message, code = release_job(int(job_id), int(sample_id), current_user.id)
+        return jsonify(message=message), code
+
     @app.route("/api/runner/result", methods=["POST"])
     @cross_origin()
     @jwt_required()
     def runner_result():
         if not current_user.is_runner:
             return jsonify(message="Runner account required"), 400
+        request.max_content_length = (
+            app.config["PREDICTCR_RESULT_MAX_SIZE_MB"] * 1024 * 1024
+        )
         form_as_dict = request.form.to_dict()
         sample_id = form_as_dict.get("sample_id", None)
         if sample_id is None:
@@ -443,8 +935,20 @@ def create_app(data_path: str = "/predictcr_data"):
         )
         return jsonify(message=message), code
 
+    @app.cli.command("migrate-results")
+    def migrate_results():
+        """Move result zip files stored by previous versions into the blob store."""
+        n_migrated, n_bytes = migrate_result_zips()
+        n_deleted = collect_result_garbage(min_age_secs=0)
+        logger.info(
+            f"Migrated {n_migrated} result zip files ({n_bytes} bytes), deleted {n_deleted} unused blobs"
+        )
+
     with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            configure_sqlite(db.engine, app.config["PREDICTCR_SQLITE_BUSY_TIMEOUT_MS"])
         db.create_all()
+        upgrade_database()
         if db.session.get(Settings, 1) is None:
             db.session.add(
                 Settings(
@@ -465,4 +969,46 @@ def create_app(data_path: str = "/predictcr_data"):
             )
             db.session.commit()
 
+    if app.config["PREDICTCR_REAPER_INTERVAL_SECS"] > 0:
+        start_periodic_task(
+            app,
+            "requeue_timed_out_samples",
+            app.config["PREDICTCR_REAPER_INTERVAL_SECS"],
+            requeue_timed_out_samples,
+        )
+        start_periodic_task(
+            app,
+            "delete_stale_uploads",
+            app.config["PREDICTCR_REAPER_INTERVAL_SECS"],
+            delete_stale_uploads,
+        )
+    if app.config["PREDICTCR_VALIDATION_INTERVAL_SECS"] > 0:
+        start_periodic_task(
+            app,
+            "validate_samples",
+            app.config["PREDICTCR_VALIDATION_INTERVAL_SECS"],
+            validate_samples,
+        )
+    if app.config["PREDICTCR_EMAIL_INTERVAL_SECS"] > 0:
+        start_periodic_task(
+            app,
+            "send_queued_emails",
+            app.config["PREDICTCR_EMAIL_INTERVAL_SECS"],
+            send_queued_emails,
+        )
+    if app.config["PREDICTCR_NOTIFICATION_WINDOW_SECS"] > 0:
+        start_periodic_task(
+            app,
+            "send_notification_digests",
+            app.config["PREDICTCR_NOTIFICATION_WINDOW_SECS"],
+            send_notification_digests,
+        )
+    if app.config["PREDICTCR_BLOB_GC_INTERVAL_SECS"] > 0:
+        start_periodic_task(
+            app,
+            "collect_result_garbage",
+            app.config["PREDICTCR_BLOB_GC_INTERVAL_SECS"],
+            collect_result_garbage,
+        )
+
     return app
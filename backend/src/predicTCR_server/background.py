@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import threading
+from typing import Callable
+from flask import Flask
+from predicTCR_server.logger import get_logger
+
+logger = get_logger()
+
+
+def start_periodic_task(
+    app: Flask, name: str, interval_secs: float, task: Callable[[], None]
+) -> threading.Event:
+    """
+    Run `task` inside an app context every `interval_secs` seconds in a daemon thread.
+
+    Returns an event that stops the task when set.
+    """
+    stop_event = threading.Event()
+
+    def _run():
+        while not stop_event.wait(interval_secs):
+            try:
+                with app.app_context():
+                    task()
+            except Exception as e:
+                logger.exception(f"Background task {name} failed: {e}")
+
+    logger.info(f"Starting background task {name} every {interval_secs}s")
+    threading.Thread(target=_run, name=name, daemon=True).start()
+    return stop_event
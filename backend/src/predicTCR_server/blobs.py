@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import os
+import time
+import uuid
+import zlib
+import struct
+import hashlib
+import zipfile
+from typing import BinaryIO, Iterator
+from predicTCR_server.logger import get_logger
+
+logger = get_logger()
+
+_compress_type_names = {zipfile.ZIP_STORED: "stored", zipfile.ZIP_DEFLATED: "deflated"}
+
+
+class _ChunkBuffer:
+    """Write-only file object that collects the data written to it until it is taken."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class BlobStore:
+    """
+    Content-addressed storage of the members of zip files.
+
+    Each distinct member is stored once, named by the sha256 of its uncompressed
+    contents, as `{sha256[:2]}/{sha256}.{stored|deflated}`. Members are kept
+    compressed exactly as they were in the zip file they came from, so a zip file
+    can be assembled again from its list of members without compressing anything.
+    """
+
+    def __init__(self, path: str, chunk_size: int = 1024 * 1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        os.makedirs(f"{path}/tmp", exist_ok=True)
+
+    def _blob_path(self, sha256: str, compress_type: int) -> str:
+        return (
+            f"{self.path}/{sha256[:2]}/{sha256}.{_compress_type_names[compress_type]}"
+        )
+
+    def find(self, sha256: str) -> tuple[str, int] | None:
+        for compress_type in _compress_type_names:
+            blob_path = self._blob_path(sha256, compress_type)
+            if os.path.isfile(blob_path):
+                return blob_path, compress_type
+        return None
+
+    def _read_raw(self, zip_file: BinaryIO, zinfo: zipfile.ZipInfo) -> Iterator[bytes]:
+        # the compressed data follows the member's local file header
+        zip_file.seek(zinfo.header_offset)
+        header = zip_file.read(zipfile.sizeFileHeader)
+        if len(header) != zipfile.sizeFileHeader or header[:4] != b"PK\x03\x04":
+            raise zipfile.BadZipFile(f"Bad local file header for {zinfo.filename}")
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        zip_file.seek(name_length + extra_length, os.SEEK_CUR)
+        remaining = zinfo.compress_size
+        while remaining > 0:
+            chunk = zip_file.read(min(remaining, self.chunk_size))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated data for {zinfo.filename}")
+            remaining -= len(chunk)
+            yield chunk
+
+    def _put_member(
+        self, zip_file: BinaryIO, z: zipfile.ZipFile, zinfo: zipfile.ZipInfo
+    ) -> dict:
+        if zinfo.flag_bits & 0x1:
+            raise zipfile.BadZipFile(f"Encrypted member {zinfo.filename}")
+        sha256 = hashlib.sha256()
+        crc = 0
+        size = 0
+        tmp_path = f"{self.path}/tmp/{uuid.uuid4().hex}"
+        try:
+            with open(tmp_path, "wb") as tmp_file:
+                if zinfo.compress_type in _compress_type_names:
+                    # store the compressed data as it is, decompressing it only to hash it
+                    compress_type = zinfo.compress_type
+                    decompressor = (
+                        zlib.decompressobj(-zlib.MAX_WBITS)
+                        if compress_type == zipfile.ZIP_DEFLATED
+                        else None
+                    )
+                    for raw_chunk in self._read_raw(zip_file, zinfo):
+                        tmp_file.write(raw_chunk)
+                        chunk = (
+                            decompressor.decompress(raw_chunk)
+                            if decompressor
+                            else raw_chunk
+                        )
+                        sha256.update(chunk)
+                        crc = zlib.crc32(chunk, crc)
+                        size += len(chunk)
+                    if decompressor:
+                        chunk = decompressor.flush()
+                        sha256.update(chunk)
+                        crc = zlib.crc32(chunk, crc)
+                        size += len(chunk)
+                    if crc != zinfo.CRC or size != zinfo.file_size:
+                        raise zipfile.BadZipFile(f"Bad CRC-32 for {zinfo.filename}")
+                else:
+                    # other compression methods are re-compressed using deflate
+                    compress_type = zipfile.ZIP_DEFLATED
+                    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+                    with z.open(zinfo) as member:
+                        while chunk := member.read(self.chunk_size):
+                            tmp_file.write(compressor.compress(chunk))
+                            sha256.update(chunk)
+                            crc = zlib.crc32(chunk, crc)
+                            size += len(chunk)
+                    tmp_file.write(compressor.flush())
+            sha256 = sha256.hexdigest()
+            existing_blob = self.find(sha256)
+            if existing_blob is None:
+                blob_path = self._blob_path(sha256, compress_type)
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(tmp_path, blob_path)
+            else:
+                # keeps the existing blob from being garbage collected before it is referenced
+                os.utime(existing_blob[0])
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return {
+            "name": zinfo.filename,
+            "sha256": sha256,
+            "size": size,
+            "crc": crc,
+            "date_time": list(zinfo.date_time),
+            "external_attr": zinfo.external_attr,
+        }
+
+    def put_zip(self, zip_file: BinaryIO) -> list[dict]:
+        """
+        Store the members of a zip file that are not already stored.
+
+        Returns the list of members, from which the zip file can be assembled again.
+        Raises zipfile.BadZipFile if it is not a valid zip file.
+        """
+        members = []
+        with zipfile.ZipFile(zip_file) as z:
+            for zinfo in z.infolist():
+                if zinfo.is_dir():
+                    members.append(
+                        {
+                            "name": zinfo.filename,
+                            "date_time": list(zinfo.date_time),
+                            "external_attr": zinfo.external_attr,
+                        }
+                    )
+                else:
+                    members.append(self._put_member(zip_file, z, zinfo))
+        return members
+
+    def zip_stream(self, members: list[dict]) -> Iterator[bytes]:
+        """
+        Assemble a zip file from the stored members and return it in chunks.
+
+        The stored (compressed) data of each member is copied directly into the zip file.
+        """
+        buffer = _ChunkBuffer()
+        # the buffer isn't seekable, so ZipFile only writes to it sequentially
+        with zipfile.ZipFile(buffer, "w") as z:
+            for member in members:
+                zinfo = zipfile.ZipInfo(member["name"], tuple(member["date_time"]))
+                zinfo.external_attr = member["external_attr"]
+                if zinfo.is_dir():
+                    z.writestr(zinfo, b"")
+                    yield buffer.take()
+                    continue
+                blob = self.find(member["sha256"])
+                if blob is None:
+                    raise FileNotFoundError(f"Missing blob {member['sha256']}")
+                blob_path, zinfo.compress_type = blob
+                zinfo.CRC = member["crc"]
+                zinfo.file_size = member["size"]
+                zinfo.compress_size = os.path.getsize(blob_path)
+                zinfo.header_offset = z.fp.tell()
+                zip64 = (
+                    zinfo.file_size > zipfile.ZIP64_LIMIT
+                    or zinfo.compress_size > zipfile.ZIP64_LIMIT
+                )
+                z.fp.write(zinfo.FileHeader(zip64))
+                with open(blob_path, "rb") as blob_file:
+                    while chunk := blob_file.read(self.chunk_size):
+                        z.fp.write(chunk)
+                        yield buffer.take()
+                # add the member to the central directory written when the zip file is closed
+                z.filelist.append(zinfo)
+                z.NameToInfo[zinfo.filename] = zinfo
+                z.start_dir = z.fp.tell()
+                yield buffer.take()
+        yield buffer.take()
+
+    def blob_names(self) -> Iterator[tuple[str, str]]:
+        """The sha256 and path of each stored blob."""
+        for prefix in os.listdir(self.path):
+            if prefix == "tmp":
+                continue
+            for name in os.listdir(f"{self.path}/{prefix}"):
+                yield name.split(".", 1)[0], f"{self.path}/{prefix}/{name}"
+
+    def collect_garbage(self, referenced: set[str], min_age_secs: float) -> int:
+        """
+        Delete blobs that are not in `referenced` and older than `min_age_secs`,
+        so that blobs stored by uploads in progress are kept. Returns the number deleted.
+        """
+        n_deleted = 0
+        oldest_mtime = time.time() - min_age_secs
+        for sha256, blob_path in self.blob_names():
+            if sha256 in referenced:
+                continue
+            try:
+                if os.path.getmtime(blob_path) < oldest_mtime:
+                    os.remove(blob_path)
+                    n_deleted += 1
+            except FileNotFoundError:
+                pass
+        for tmp_name in os.listdir(f"{self.path}/tmp"):
+            tmp_path = f"{self.path}/tmp/{tmp_name}"
+            try:
+                if os.path.getmtime(tmp_path) < oldest_mtime:
+                    os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+        logger.info(f"Deleted {n_deleted} unused blobs")
+        return n_deleted
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, TypeVar
+from predicTCR_server.events import FileSignal
+
+T = TypeVar("T")
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class VersionedCache(Generic[T]):
+    """
+    Caches a value loaded from the database in this process.
+
+    The value is reloaded whenever the shared FileSignal has changed, so an
+    `invalidate` in any process that uses the same data directory is seen by all
+    of them on their next `get`, at the cost of a `stat` call.
+    """
+
+    def __init__(self, path: str, load: Callable[[], T]):
+        self._signal = FileSignal(path)
+        self._load = load
+        self._lock = threading.Lock()
+        self._value: T | None = None
+        self._version: str | None = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self) -> T:
+        version = self._signal.version()
+        with self._lock:
+            if self._value is None or version != self._version:
+                self.misses += 1
+                self._value = self._load()
+                self._version = version
+            else:
+                self.hits += 1
+            return self._value
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def invalidate(self) -> None:
+        """Call after committing a change to the cached value."""
+        self._signal.notify()
+
+
+class TTLCache(Generic[K, V]):
+    """
+    Bounded least-recently-used cache whose entries expire after `ttl_secs`.
+
+    All entries are dropped when the shared FileSignal changes, so a change
+    notified with `invalidate` in any process is seen by all of them.
+    """
+
+    def __init__(self, path: str, ttl_secs: float, max_size: int):
+        self._signal = FileSignal(path)
+        self._ttl_secs = ttl_secs
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._version = self._signal.version()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key: K, load: Callable[[K], V | None]) -> V | None:
+        version = self._signal.version()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = load(key)
+        if value is None or self._ttl_secs <= 0 or self._max_size <= 0:
+            return value
+        with self._lock:
+            # don't cache the value if it may have changed while we were loading it
+            if self._signal.version() == version == self._version:
+                self._entries[key] = (time.monotonic() + self._ttl_secs, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_size:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self) -> None:
+        """Call after committing a change to any of the cached values."""
+        self._signal.notify()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import sqlalchemy
+from sqlalchemy.engine import Engine
+from predicTCR_server.logger import get_logger
+
+logger = get_logger()
+
+
+def engine_options(database_uri: str, pool_size: int, max_overflow: int) -> dict:
+    """
+    SQLAlchemy engine options for the database at `database_uri`.
+
+    Each worker thread can hold a pooled connection, up to `pool_size` plus
+    `max_overflow` connections in total.
+    """
+    url = sqlalchemy.make_url(database_uri)
+    if url.get_backend_name() == "sqlite" and url.database in [None, "", ":memory:"]:
+        # in-memory databases use a single shared connection, not a pool
+        return {}
+    options = {"pool_size": pool_size, "max_overflow": max_overflow}
+    if url.get_backend_name() == "postgresql":
+        # replace connections closed by the server, e.g. after a database restart
+        options |= {"pool_pre_ping": True, "pool_recycle": 1800}
+    return options
+
+
+def configure_sqlite(engine: Engine, busy_timeout_ms: int) -> None:
+    """
+    Tune each new connection to a SQLite database for concurrent access.
+
+    WAL allows reads to continue while a write is in progress, writers wait up
+    to `busy_timeout_ms` for the lock instead of failing with "database is locked",
+    and with WAL synchronous=NORMAL only syncs to disk at checkpoints.
+    """
+
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    logger.info(f"SQLite database using WAL with busy timeout {busy_timeout_ms}ms")
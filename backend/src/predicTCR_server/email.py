@@ -1,24 +1,164 @@
 from __future__ import annotations
 
+import os
+import time
+import uuid
 import smtplib
+import email.policy
 from email.message import EmailMessage
+from email.parser import BytesParser
+import flask
 from predicTCR_server.settings import predicTCR_url
+from predicTCR_server.logger import get_logger
+
+logger = get_logger()
 
 
 def _wrap_email_message(email: str, message: str) -> str:
     return f"Dear {email},\n\n{message}\n\nBest wishes,\n\npredicTCR Team.\nhttps://{predicTCR_url}"
 
 
-def _send_email_message(email_message: EmailMessage) -> None:
-    postfix_server_address = "email:587"
-    with smtplib.SMTP(postfix_server_address) as s:
-        s.send_message(email_message)
+class EmailSpool:
+    """
+    Outgoing emails, stored as files in a spool directory shared by all processes.
+
+    Messages are written to `tmp` then moved to `new`. A sender claims a message
+    by moving it to `cur`, so each message is only sent by one process. Messages
+    that fail to send are moved back to `new` with a later send time, until
+    `max_attempts` is reached and they are moved to `failed`.
+
+    File names are `{not_before}_{attempts}_{id}.eml`, where `not_before` is the
+    unix timestamp before which the message should not be sent.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_attempts: int = 8,
+        retry_backoff_secs: float = 30,
+        stale_claim_secs: float = 600,
+    ):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_backoff_secs = retry_backoff_secs
+        self.stale_claim_secs = stale_claim_secs
+        for subdir in ["tmp", "new", "cur", "failed"]:
+            os.makedirs(f"{path}/{subdir}", exist_ok=True)
+
+    def put(self, email_message: EmailMessage) -> None:
+        name = f"{int(time.time())}_0_{uuid.uuid4().hex}.eml"
+        with open(f"{self.path}/tmp/{name}", "wb") as f:
+            f.write(email_message.as_bytes())
+        os.replace(f"{self.path}/tmp/{name}", f"{self.path}/new/{name}")
+
+    def pending(self) -> list[str]:
+        return sorted(os.listdir(f"{self.path}/new"))
+
+    def failed(self) -> list[str]:
+        return sorted(os.listdir(f"{self.path}/failed"))
+
+    def _claim(self, name: str) -> str | None:
+        claimed_path = f"{self.path}/cur/{name}"
+        try:
+            os.rename(f"{self.path}/new/{name}", claimed_path)
+        except FileNotFoundError:
+            # claimed by another process
+            return None
+        # mtime of claimed messages is used to detect claims by senders that died
+        os.utime(claimed_path)
+        return claimed_path
+
+    def _retry(self, name: str, error: Exception) -> None:
+        _, attempts, message_id = name.split("_", 2)
+        attempts = int(attempts) + 1
+        if attempts >= self.max_attempts:
+            logger.error(f"Giving up sending email {name}: {error}")
+            os.rename(f"{self.path}/cur/{name}", f"{self.path}/failed/{name}")
+            return
+        not_before = int(time.time() + self.retry_backoff_secs * 2 ** (attempts - 1))
+        logger.warning(
+            f"Sending email {name} failed, retrying after {not_before}: {error}"
+        )
+        os.rename(
+            f"{self.path}/cur/{name}",
+            f"{self.path}/new/{not_before}_{attempts}_{message_id}",
+        )
+
+    def _requeue_stale_claims(self) -> None:
+        now = time.time()
+        for name in os.listdir(f"{self.path}/cur"):
+            try:
+                if (
+                    now - os.stat(f"{self.path}/cur/{name}").st_mtime
+                    > self.stale_claim_secs
+                ):
+                    logger.warning(f"Requeuing stale claimed email {name}")
+                    os.rename(f"{self.path}/cur/{name}", f"{self.path}/new/{name}")
+            except FileNotFoundError:
+                pass
+
+    def send_pending(self, smtp_server: str) -> int:
+        """
+        Send all messages that are due using a single SMTP connection.
+
+        If `smtp_server` is empty the messages are logged instead of sent.
+        Returns the number of messages sent.
+        """
+        self._requeue_stale_claims()
+        now = time.time()
+        due = [name for name in self.pending() if int(name.split("_", 1)[0]) <= now]
+        n_sent = 0
+        smtp = None
+        try:
+            for name in due:
+                claimed_path = self._claim(name)
+                if claimed_path is None:
+                    continue
+                with open(claimed_path, "rb") as f:
+                    email_message = BytesParser(policy=email.policy.default).parse(f)
+                try:
+                    if smtp_server == "":
+                        logger.info(email_message)
+                    else:
+                        if smtp is None:
+                            smtp = smtplib.SMTP(smtp_server, timeout=30)
+                        smtp.send_message(email_message)
+                except (smtplib.SMTPException, OSError) as e:
+                    self._retry(name, e)
+                    # the connection may be unusable: open a new one for the next message
+                    _close_smtp(smtp)
+                    smtp = None
+                    continue
+                os.remove(claimed_path)
+                n_sent += 1
+        finally:
+            _close_smtp(smtp)
+        return n_sent
+
+
+def _close_smtp(smtp: smtplib.SMTP | None) -> None:
+    if smtp is None:
+        return
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        pass
+    smtp.close()
+
+
+def send_queued_emails() -> int:
+    """Send the emails that are due from the current app's spool."""
+    app = flask.current_app
+    return app.extensions["predictcr_email_spool"].send_pending(
+        app.config["PREDICTCR_SMTP_SERVER"]
+    )
 
 
 def send_email(email: str, subject: str, message: str) -> None:
+    """Add an email to the current app's spool, it is sent by a background task."""
     msg = EmailMessage()
     msg["From"] = f"no-reply@{predicTCR_url}"
     msg["To"] = email
     msg.set_content(_wrap_email_message(email, message))
     msg["Subject"] = subject
-    _send_email_message(msg)
+    flask.current_app.extensions["predictcr_email_spool"].put(msg)
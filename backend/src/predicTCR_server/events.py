@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import os
+import collections
+import itertools
+import secrets
+import threading
+import time
+
+
+class FileSignal:
+    """
+    Change signal shared between processes using the same data directory.
+
+    Each notify atomically replaces the file with a new unique token, which is
+    its version: unlike its stat result, this changes even if the inode is reused
+    and the mtime is too coarse to differ between two notifies.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._count = itertools.count()
+
+    def notify(self) -> None:
+        token = f"{os.getpid()}.{threading.get_ident()}.{next(self._count)}.{time.time_ns()}"
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "w") as f:
+            f.write(token)
+        os.replace(tmp_path, self.path)
+
+    def version(self) -> str | None:
+        try:
+            with open(self.path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+class QueueSignal:
+    """
+    Wakes up waiting threads when a sample is added to the queue.
+
+    Threads in this process are woken immediately, other processes notice the
+    change to the shared FileSignal within `poll_interval_secs`.
+    """
+
+    def __init__(self, path: str, poll_interval_secs: float = 0.2):
+        self._file_signal = FileSignal(path)
+        self._poll_interval_secs = poll_interval_secs
+        self._condition = threading.Condition()
+        self._count = 0
+
+    def version(self) -> tuple:
+        return self._count, self._file_signal.version()
+
+    def notify(self) -> None:
+        self._file_signal.notify()
+        with self._condition:
+            self._count += 1
+            self._condition.notify_all()
+
+    def wait_for_change(self, version: tuple, timeout_secs: float) -> bool:
+        """Wait until the version differs from `version`, returns False on timeout."""
+        deadline = time.monotonic() + timeout_secs
+        with self._condition:
+            while self.version() == version:
+                remaining_secs = deadline - time.monotonic()
+                if remaining_secs <= 0:
+                    return False
+                self._condition.wait(min(remaining_secs, self._poll_interval_secs))
+        return True
+
+
+class EventStreamsBusy(Exception):
+    pass
+
+
+class EventBroker:
+    """
+    Fans out events published in this process to all subscribed event streams.
+
+    The most recent `max_events` events are kept in memory with increasing
+    sequence numbers, so a stream that reconnects with the id of the last event
+    it received gets the events it missed without any database queries.
+    Event ids include a random prefix that changes when the process restarts.
+
+    At most `max_streams` streams can be open at once, since each one occupies
+    a worker thread.
+    """
+
+    def __init__(self, max_events: int = 1000, max_streams: int = 8):
+        self._condition = threading.Condition()
+        self._events: collections.deque[tuple[int, dict]] = collections.deque(
+            maxlen=max_events
+        )
+        self._sequence = 0
+        self._prefix = secrets.token_hex(4)
+        self._streams = (
+            threading.BoundedSemaphore(max_streams) if max_streams > 0 else None
+        )
+        self._n_streams = 0
+
+    def publish(self, event: dict) -> None:
+        with self._condition:
+            self._sequence += 1
+            self._events.append((self._sequence, event))
+            self._condition.notify_all()
+
+    def event_id(self, sequence: int) -> str:
+        return f"{self._prefix}-{sequence}"
+
+    def sequence(self, event_id: str | None) -> int | None:
+        """
+        The sequence number to resume from after the event `event_id`.
+
+        Returns the current sequence number if `event_id` is None, or None if the
+        events after `event_id` are no longer available.
+        """
+        with self._condition:
+            if event_id is None:
+                return self._sequence
+            prefix, _, sequence = event_id.partition("-")
+            if prefix != self._prefix or not sequence.isdigit():
+                return None
+            sequence = int(sequence)
+            if sequence > self._sequence:
+                return None
+            oldest_sequence = self._events[0][0] if self._events else self._sequence + 1
+            if sequence < oldest_sequence - 1:
+                return None
+            return sequence
+
+    def wait_for_events(
+        self, sequence: int, timeout_secs: float
+    ) -> list[tuple[int, dict]] | None:
+        """
+        Wait for events after `sequence`, returns an empty list on timeout or
+        None if some of the events after `sequence` are no longer available.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._sequence > sequence, timeout_secs)
+            if self._sequence == sequence:
+                return []
+            if self._events[0][0] > sequence + 1:
+                return None
+            n_new_events = self._sequence - sequence
+            return list(
+                itertools.islice(self._events, len(self._events) - n_new_events, None)
+            )
+
+    def open_stream(self) -> None:
+        """Reserve one of the available streams, raises EventStreamsBusy if there are none."""
+        if self._streams is None or not self._streams.acquire(blocking=False):
+            raise EventStreamsBusy()
+        with self._condition:
+            self._n_streams += 1
+
+    def close_stream(self) -> None:
+        with self._condition:
+            self._n_streams -= 1
+        self._streams.release()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "streams": self._n_streams,
+                "events": len(self._events),
+                "sequence": self._sequence,
+            }
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+import argon2
+
+T = TypeVar("T")
+
+
+class HashingPoolBusy(Exception):
+    pass
+
+
+class HashingPool:
+    """
+    Runs password hashing on a fixed number of threads.
+
+    At most `max_workers + max_queued` calls are admitted at once: any further
+    calls raise HashingPoolBusy immediately instead of waiting for a thread.
+    """
+
+    def __init__(self, max_workers: int, max_queued: int):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hashing"
+        )
+        self._admitted = threading.BoundedSemaphore(max_workers + max_queued)
+
+    def run(self, fn: Callable[..., T], *args) -> T:
+        if not self._admitted.acquire(blocking=False):
+            raise HashingPoolBusy()
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._admitted.release()
+
+
+@functools.cache
+def password_hasher(
+    time_cost: int, memory_cost_kib: int, parallelism: int
+) -> argon2.PasswordHasher:
+    return argon2.PasswordHasher(
+        time_cost=time_cost, memory_cost=memory_cost_kib, parallelism=parallelism
+    )
+
+
+def argon2_parameters_error(
+    time_cost: int, memory_cost_kib: int, parallelism: int
+) -> str:
+    """
+    Check that the argon2 parameters can be used to hash passwords, returns an error message or "".
+
+    The upper limits keep a single login from taking many seconds or gigabytes of memory.
+    """
+    for name, value in [
+        ("argon2_time_cost", time_cost),
+        ("argon2_memory_cost_kib", memory_cost_kib),
+        ("argon2_parallelism", parallelism),
+    ]:
+        if not isinstance(value, int) or isinstance(value, bool):
+            return f"{name} must be an integer"
+    if not 1 <= time_cost <= 20:
+        return "argon2_time_cost must be between 1 and 20"
+    if not 1 <= parallelism <= 64:
+        return "argon2_parallelism must be between 1 and 64"
+    if not 8 * parallelism <= memory_cost_kib <= 1024 * 1024:
+        return f"argon2_memory_cost_kib must be between {8 * parallelism} (8 x argon2_parallelism) and {1024 * 1024}"
+    return ""
+
+
+def verify_password(
+    ph: argon2.PasswordHasher, password_hash: str, password: str
+) -> tuple[bool, str | None]:
+    """
+    Check the password, returns whether it is correct and a new hash if the
+    existing hash uses different parameters to `ph`.
+    """
+    try:
+        ph.verify(password_hash, password)
+    except argon2.exceptions.VerificationError:
+        return False, None
+    if ph.check_needs_rehash(password_hash):
+        return True, ph.hash(password)
+    return True, None
@@ -1,9 +1,7 @@
 from __future__ import annotations
 import click
 from predicTCR_server import create_app
-from predicTCR_server.logger import get_logger
 from flask_cors import CORS
-import predicTCR_server.email
 
 
 @click.command()
@@ -15,10 +13,7 @@ def main(host: str, port: int, data_path: str):
     # local development server: enable CORS on all routes for all origins
     CORS(app)
     # local development server: log email messages instead of sending them
-    logger = get_logger()
-    predicTCR_server.email._send_email_message = lambda email_message: logger.info(
-        email_message
-    )
+    app.config["PREDICTCR_SMTP_SERVER"] = ""
     app.run(host=host, port=port)
 
 
@@ -1,25 +1,45 @@
 from __future__ import annotations
 
+import os
 import re
+import json
+import time
+import uuid
+import hashlib
+import zipfile
+import functools
 import flask
 import enum
+import shutil
 import argon2
 import pathlib
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase, MappedAsDataclass, Mapped, mapped_column
+from sqlalchemy.orm import make_transient_to_detached
 from werkzeug.datastructures import FileStorage
 from sqlalchemy.inspection import inspect
-from sqlalchemy import Integer, String, Boolean, Enum
+from sqlalchemy import Integer, BigInteger, String, Boolean, Enum
+from sqlalchemy.schema import CreateColumn
 from dataclasses import dataclass
+from typing import BinaryIO, Callable, Iterator
 from predicTCR_server.email import send_email
 from predicTCR_server.settings import predicTCR_url
 from predicTCR_server.logger import get_logger
+from predicTCR_server.hashing import HashingPool, password_hasher, verify_password
+from predicTCR_server.blobs import BlobStore
+from predicTCR_server.validation import (
+    VALIDATION_VERSION,
+    validate_csv_file,
+    validate_h5_file,
+)
 from predicTCR_server.utils import (
     timestamp_now,
     encode_activation_token,
     decode_activation_token,
     encode_password_reset_token,
     decode_password_reset_token,
+    save_file_with_sha256,
+    sha256_file,
 )
 
 
@@ -28,15 +48,41 @@ class Base(DeclarativeBase, MappedAsDataclass):
 
 
 db = SQLAlchemy(model_class=Base)
-ph = argon2.PasswordHasher()
 logger = get_logger()
 
+# columns that are never included when a model is serialized
+_hidden_columns = {"password_hash"}
+
+
+@functools.cache
+def serialized_columns(model: type[Base]) -> tuple[str, ...]:
+    return tuple(
+        key for key in inspect(model).columns.keys() if key not in _hidden_columns
+    )
+
+
+def select_serialized(model: type[Base], columns: tuple[str, ...] | None = None):
+    return db.select(
+        *[getattr(model, column) for column in columns or serialized_columns(model)]
+    )
+
+
+def iter_dicts(
+    statement, columns: tuple[str, ...], chunk_size: int = 1000
+) -> Iterator[dict]:
+    # rows are plain tuples: zipping them with the column names avoids constructing ORM objects
+    result = db.session.execute(statement.execution_options(yield_per=chunk_size))
+    for row in result.tuples():
+        yield dict(zip(columns, row))
+
 
 class Status(str, enum.Enum):
     QUEUED = "queued"
     RUNNING = "running"
     COMPLETED = "completed"
     FAILED = "failed"
+    UPLOADING = "uploading"
+    VALIDATING = "validating"
 
 
 @dataclass
@@ -58,9 +104,85 @@ class Settings(db.Model):
     max_filesize_csv_mb: Mapped[int] = mapped_column(Integer, nullable=False)
     about_md: Mapped[str] = mapped_column(String, nullable=False)
     news_items_json: Mapped[str] = mapped_column(String, nullable=False)
+    argon2_time_cost: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=3, server_default="3"
+    )
+    argon2_memory_cost_kib: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=65536, server_default="65536"
+    )
+    argon2_parallelism: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=4, server_default="4"
+    )
 
     def as_dict(self):
-        return {c: getattr(self, c) for c in inspect(self).attrs.keys()}
+        return {c: getattr(self, c) for c in serialized_columns(type(self))}
+
+
+def _hashing_pool() -> HashingPool:
+    return flask.current_app.extensions["predictcr_hashing_pool"]
+
+
+def _password_hasher() -> argon2.PasswordHasher:
+    settings = get_settings()
+    return password_hasher(
+        settings.argon2_time_cost,
+        settings.argon2_memory_cost_kib,
+        settings.argon2_parallelism,
+    )
+
+
+def hash_password(password: str) -> str:
+    """Raises HashingPoolBusy if too many passwords are already being hashed."""
+    return _hashing_pool().run(_password_hasher().hash, password)
+
+
+def load_settings() -> Settings:
+    # a detached copy can be shared between requests and threads
+    return Settings(**db.session.get(Settings, 1).as_dict())
+
+
+def get_settings() -> Settings:
+    """
+    Cached read-only copy of the settings.
+
+    To modify the settings, update `db.session.get(Settings, 1)`, commit, then
+    call `notify_settings_changed`.
+    """
+    return flask.current_app.extensions["predictcr_settings_cache"].get()
+
+
+def notify_settings_changed() -> None:
+    flask.current_app.extensions["predictcr_settings_cache"].invalidate()
+
+
+def _load_user_values(user_id: int) -> dict | None:
+    row = (
+        db.session.execute(db.select(User.__table__).filter(User.id == user_id))
+        .mappings()
+        .one_or_none()
+    )
+    return dict(row) if row is not None else None
+
+
+def get_user_by_id(user_id: int) -> User | None:
+    """
+    The user with this id, using a short-lived per-process cache of their values.
+
+    After committing a change to a user, call `notify_user_changed`.
+    """
+    user_values = flask.current_app.extensions["predictcr_user_cache"].get_or_load(
+        user_id, _load_user_values
+    )
+    if user_values is None:
+        return None
+    # attach to the session without querying the database again
+    user = User(**user_values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def notify_user_changed() -> None:
+    flask.current_app.extensions["predictcr_user_cache"].invalidate()
 
 
 @dataclass
@@ -75,11 +197,25 @@ class Job(db.Model):
     error_message: Mapped[str] = mapped_column(String, nullable=False)
 
     def as_dict(self):
-        return {c: getattr(self, c) for c in inspect(self).attrs.keys()}
+        return {c: getattr(self, c) for c in serialized_columns(type(self))}
 
 
 @dataclass
 class Sample(db.Model):
+    __table_args__ = (
+        # runner job queue: next queued sample & timed out running samples
+        db.Index("ix_sample_status_timestamp", "status", "timestamp"),
+        db.Index(
+            "ix_sample_status_timestamp_job_start", "status", "timestamp_job_start"
+        ),
+        # a user's samples, newest first
+        db.Index("ix_sample_email_timestamp", "email", "timestamp"),
+        # number of running samples of a user, for fair share scheduling
+        db.Index("ix_sample_status_email", "status", "email"),
+        # all samples, newest first
+        db.Index("ix_sample_timestamp_id", "timestamp", "id"),
+    )
+
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     email: Mapped[str] = mapped_column(String(256), nullable=False)
     name: Mapped[str] = mapped_column(String(128), nullable=False)
@@ -92,6 +228,20 @@ class Sample(db.Model):
     status: Mapped[Status] = mapped_column(Enum(Status), nullable=False)
     has_results_zip: Mapped[bool] = mapped_column(Boolean, nullable=False)
     error_message: Mapped[str] = mapped_column(String, nullable=False)
+    input_h5_sha256: Mapped[str] = mapped_column(
+        String(64), nullable=False, default="", server_default=""
+    )
+    input_csv_sha256: Mapped[str] = mapped_column(
+        String(64), nullable=False, default="", server_default=""
+    )
+    # total size of the input files, used to only give samples to runners that can handle them
+    input_size_bytes: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, default=0, server_default="0"
+    )
+    # set by admins: samples with a higher priority are run first
+    priority: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
 
     def base_path(self) -> pathlib.Path:
         data_path = flask.current_app.config["PREDICTCR_DATA_PATH"]
@@ -103,14 +253,33 @@ class Sample(db.Model):
     def input_csv_file_path(self) -> pathlib.Path:
         return self.base_path() / "input.csv"
 
+    # result zip files are stored as manifests listing their members in the blob store
     def user_result_file_path(self) -> pathlib.Path:
-        return self.base_path() / "user_results.zip"
+        return self.base_path() / "user_results.manifest.json"
 
     def trusted_user_result_file_path(self) -> pathlib.Path:
-        return self.base_path() / "trusted_user_results.zip"
+        return self.base_path() / "trusted_user_results.manifest.json"
 
     def admin_result_file_path(self) -> pathlib.Path:
-        return self.base_path() / "admin_results.zip"
+        return self.base_path() / "admin_results.manifest.json"
+
+
+@dataclass
+class Notification(db.Model):
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    email: Mapped[str] = mapped_column(String(256), nullable=False)
+    sample_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    sample_name: Mapped[str] = mapped_column(String(128), nullable=False)
+    status: Mapped[Status] = mapped_column(Enum(Status), nullable=False)
+    timestamp: Mapped[int] = mapped_column(Integer, nullable=False)
+
+
+@dataclass
+class InputValidation(db.Model):
+    # the input file type, sha256 and anything else the result depends on, e.g. the required columns
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    error_message: Mapped[str] = mapped_column(String, nullable=False)
+    timestamp: Mapped[int] = mapped_column(Integer, nullable=False)
 
 
 @dataclass
@@ -126,10 +295,15 @@ class User(db.Model):
     is_admin: bool = mapped_column(Boolean, nullable=False)
     is_runner: bool = mapped_column(Boolean, nullable=False)
     full_results: bool = mapped_column(Boolean, nullable=False)
+    # share of the runners this user gets relative to other users with fair share scheduling
+    scheduling_weight: int = mapped_column(
+        Integer, nullable=False, default=1, server_default="1"
+    )
 
     def set_password_nocheck(self, new_password: str):
-        self.password_hash = ph.hash(new_password)
+        self.password_hash = hash_password(new_password)
         db.session.commit()
+        notify_user_changed()
 
     def set_password(self, current_password: str, new_password: str) -> bool:
         if self.check_password(current_password):
@@ -138,67 +312,458 @@ class User(db.Model):
         return False
 
     def check_password(self, password: str) -> bool:
-        try:
-            ph.verify(self.password_hash, password)
-        except argon2.exceptions.VerificationError:
-            return False
-        if ph.check_needs_rehash(self.password_hash):
-            self.password_hash = ph.hash(password)
+        is_valid, new_password_hash = _hashing_pool().run(
+            verify_password, _password_hasher(), self.password_hash, password
+        )
+        if new_password_hash is not None:
+            # argon2 parameters in settings have changed since this hash was made
+            self.password_hash = new_password_hash
             db.session.commit()
-        return True
+            notify_user_changed()
+        return is_valid
 
     def as_dict(self):
-        return {
-            c: getattr(self, c)
-            for c in inspect(self).attrs.keys()
-            if c != "password_hash"
-        }
+        return {c: getattr(self, c) for c in serialized_columns(type(self))}
+
+
+def _enum_value_migrations() -> list[str]:
+    # native enum types, e.g. in PostgreSQL, don't get the values added to an Enum after they were created
+    if db.engine.dialect.name != "postgresql":
+        return []
+    enum_types = {
+        column.type.name: column.type
+        for table in db.metadata.sorted_tables
+        for column in table.columns
+        if isinstance(column.type, Enum) and column.type.native_enum
+    }
+    return [
+        f"ALTER TYPE {name} ADD VALUE IF NOT EXISTS '{value}'"
+        for name, enum_type in enum_types.items()
+        for value in enum_type.enums
+    ]
+
+
+def upgrade_database() -> None:
+    enum_value_migrations = _enum_value_migrations()
+    if enum_value_migrations:
+        # new enum values can only be used once added in a committed transaction
+        with db.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as connection:
+            for statement in enum_value_migrations:
+                connection.execute(db.text(statement))
+    # create_all only creates missing tables: add any missing columns and indexes to existing ones
+    # (new columns must have a server_default so that existing rows get a value)
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                logger.info(f"Adding column {column.name} to table {table.name}")
+                table_name = db.engine.dialect.identifier_preparer.format_table(table)
+                column_definition = CreateColumn(column).compile(
+                    dialect=db.engine.dialect
+                )
+                db.session.execute(
+                    db.text(f"ALTER TABLE {table_name} ADD COLUMN {column_definition}")
+                )
+        db.session.commit()
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
 
 
-def get_samples(email: str | None = None) -> list[Sample]:
-    selected_samples = db.select(Sample).order_by(db.desc("timestamp"))
+def get_samples(email: str | None = None) -> Iterator[dict]:
+    selected_samples = select_serialized(Sample).order_by(db.desc(Sample.timestamp))
     if email is not None:
         selected_samples = selected_samples.filter(Sample.email == email)
-    return db.session.execute(selected_samples).scalars().all()
+    return iter_dicts(selected_samples, serialized_columns(Sample))
 
 
-def request_job() -> int | None:
-    job_timeout_minutes = db.session.get(Settings, 1).runner_job_timeout_mins
-    sample_to_resubmit = (
-        db.session.execute(
-            db.select(Sample).filter(
-                (Sample.status == Status.RUNNING)
-                & (
-                    timestamp_now() - Sample.timestamp_job_start
-                    > job_timeout_minutes * 60
-                )
+def _parse_samples_cursor(cursor: str) -> tuple[int, int] | None:
+    try:
+        timestamp, sample_id = cursor.split(":")
+        return int(timestamp), int(sample_id)
+    except ValueError:
+        return None
+
+
+def get_samples_page(
+    email: str | None = None,
+    limit: int = 100,
+    cursor: str | None = None,
+    statuses: list[str] | None = None,
+    tumor_type: str | None = None,
+    timestamp_from: int | None = None,
+    timestamp_to: int | None = None,
+    fields: list[str] | None = None,
+) -> tuple[dict, int]:
+    columns = serialized_columns(Sample)
+    if fields:
+        unknown_fields = set(fields) - set(columns)
+        if unknown_fields:
+            return {"message": f"Unknown fields {sorted(unknown_fields)}"}, 400
+        # the cursor is made from timestamp and id, so these are always included
+        columns = tuple(fields) + tuple(
+            column for column in ["id", "timestamp"] if column not in fields
+        )
+    selected_samples = select_serialized(Sample, columns)
+    selected_samples = selected_samples.order_by(
+        db.desc(Sample.timestamp), db.desc(Sample.id)
+    ).limit(limit + 1)
+    if email is not None:
+        selected_samples = selected_samples.filter(Sample.email == email)
+    if statuses:
+        try:
+            selected_samples = selected_samples.filter(
+                Sample.status.in_([Status(status) for status in statuses])
             )
+        except ValueError:
+            return {"message": f"Invalid status in {statuses}"}, 400
+    if tumor_type is not None:
+        selected_samples = selected_samples.filter(Sample.tumor_type == tumor_type)
+    if timestamp_from is not None:
+        selected_samples = selected_samples.filter(Sample.timestamp >= timestamp_from)
+    if timestamp_to is not None:
+        selected_samples = selected_samples.filter(Sample.timestamp <= timestamp_to)
+    if cursor is not None:
+        parsed_cursor = _parse_samples_cursor(cursor)
+        if parsed_cursor is None:
+            return {"message": f"Invalid cursor '{cursor}'"}, 400
+        timestamp, sample_id = parsed_cursor
+        # the first condition is implied by the second, but lets the index be used as a range
+        selected_samples = selected_samples.filter(
+            Sample.timestamp <= timestamp,
+            (Sample.timestamp < timestamp)
+            | ((Sample.timestamp == timestamp) & (Sample.id < sample_id)),
         )
-        .scalars()
-        .first()
+    samples = list(iter_dicts(selected_samples, columns))
+    next_cursor = None
+    if len(samples) > limit:
+        samples = samples[:limit]
+        next_cursor = f"{samples[-1]['timestamp']}:{samples[-1]['id']}"
+    return {"samples": samples, "next_cursor": next_cursor}, 200
+
+
+def get_page_by_id(
+    model: type[Job] | type[User], limit: int, cursor: int | None = None
+) -> tuple[list[dict], int | None]:
+    selected_rows = (
+        select_serialized(model).order_by(db.desc(model.id)).limit(limit + 1)
     )
-    if sample_to_resubmit is not None:
-        logger.info(
-            f"Sample {sample_to_resubmit.id} has been running for more than {job_timeout_minutes} minutes - putting back in queue"
+    if cursor is not None:
+        selected_rows = selected_rows.filter(model.id < cursor)
+    rows = list(iter_dicts(selected_rows, serialized_columns(model)))
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1]["id"]
+    return rows, None
+
+
+def get_job_stats() -> list[dict]:
+    finished = Job.timestamp_end > 0
+    job_stats = db.session.execute(
+        db.select(
+            Job.runner_hostname,
+            db.func.count(Job.id).label("jobs"),
+            db.func.count(db.case((Job.status == Status.RUNNING, 1))).label("running"),
+            db.func.count(db.case((Job.status == Status.COMPLETED, 1))).label(
+                "completed"
+            ),
+            db.func.count(db.case((Job.status == Status.FAILED, 1))).label("failed"),
+            db.func.avg(
+                db.case((finished, Job.timestamp_end - Job.timestamp_start))
+            ).label("mean_runtime_secs"),
         )
-        sample_to_resubmit.status = Status.QUEUED
-        db.session.commit()
-    selected_samples = (
-        db.select(Sample)
+        .group_by(Job.runner_hostname)
+        .order_by(Job.runner_hostname)
+    ).mappings()
+    stats = []
+    for row in job_stats:
+        row = dict(row)
+        n_finished = row["completed"] + row["failed"]
+        row["failure_rate"] = row["failed"] / n_finished if n_finished > 0 else 0.0
+        row["mean_runtime_secs"] = row["mean_runtime_secs"] or 0.0
+        stats.append(row)
+    return stats
+
+
+def _waited_priority_levels(now: int, aging_secs: int):
+    # waiting for aging_secs counts as much as one priority level, so no sample waits forever
+    if aging_secs <= 0:
+        return db.literal(0.0)
+    return db.cast(now - Sample.timestamp, db.Float) / aging_secs
+
+
+def _fifo_order(now: int, aging_secs: int) -> list:
+    return []
+
+
+def _priority_order(now: int, aging_secs: int) -> list:
+    return [db.desc(Sample.priority + _waited_priority_levels(now, aging_secs))]
+
+
+def _fair_share_order(now: int, aging_secs: int) -> list:
+    running_sample = db.aliased(Sample)
+    n_running = (
+        db.select(db.func.count())
+        .where(
+            (running_sample.status == Status.RUNNING)
+            & (running_sample.email == Sample.email)
+        )
+        .scalar_subquery()
+    )
+    weight = (
+        db.select(User.scheduling_weight)
+        .where(User.email == Sample.email)
+        .scalar_subquery()
+    )
+    # the users using the smallest share of the runners relative to their weight go first
+    share = db.cast(n_running, db.Float) / db.case((weight > 0, weight), else_=1)
+    return [db.asc(share - Sample.priority - _waited_priority_levels(now, aging_secs))]
+
+
+# the order in which queued samples are given to runners by each scheduling policy,
+# before the oldest first
+scheduling_policies: dict[str, Callable[[int, int], list]] = {
+    "fifo": _fifo_order,
+    "priority": _priority_order,
+    "fair_share": _fair_share_order,
+}
+
+
+def runner_sample_filter(capabilities: dict):
+    """
+    The samples that a runner with these capabilities can run.
+
+    Raises ValueError if the capabilities are not valid.
+    """
+    if not isinstance(capabilities, dict):
+        raise ValueError("Runner capabilities must be an object")
+    platforms = capabilities.get("platforms", [])
+    if not isinstance(platforms, list) or not all(
+        isinstance(platform, str) for platform in platforms
+    ):
+        raise ValueError("Runner platforms must be a list of strings")
+    max_input_mb = float(capabilities.get("max_input_mb", 0))
+    memory_mb = float(capabilities.get("memory_mb", 0))
+    memory_mb_per_input_mb = flask.current_app.config[
+        "PREDICTCR_MEMORY_MB_PER_INPUT_MB"
+    ]
+    if memory_mb > 0 and memory_mb_per_input_mb > 0:
+        memory_max_input_mb = memory_mb / memory_mb_per_input_mb
+        max_input_mb = (
+            min(max_input_mb, memory_max_input_mb)
+            if max_input_mb > 0
+            else memory_max_input_mb
+        )
+    sample_filter = db.true()
+    if platforms:
+        sample_filter &= Sample.platform.in_(platforms)
+    if max_input_mb > 0:
+        sample_filter &= Sample.input_size_bytes <= int(max_input_mb * 1024 * 1024)
+    return sample_filter
+
+
+def _next_queued_sample_id(now: int, sample_filter=None):
+    config = flask.current_app.config
+    scheduling_order = scheduling_policies[config["PREDICTCR_SCHEDULING_POLICY"]]
+    return (
+        db.select(Sample.id)
         .filter(Sample.status == Status.QUEUED)
-        .order_by(db.asc("timestamp"))
+        .filter(sample_filter if sample_filter is not None else db.true())
+        .order_by(
+            *scheduling_order(now, config["PREDICTCR_SCHEDULING_AGING_SECS"]),
+            db.asc(Sample.timestamp),
+            db.asc(Sample.id),
+        )
+        .limit(1)
     )
-    sample = db.session.execute(selected_samples).scalars().first()
-    if sample is None:
-        logger.debug(" --> no samples in queue")
-        return None
+
+
+def _claim_queued_sample(now: int, sample_filter=None) -> Sample | None:
+    next_queued_sample_id = _next_queued_sample_id(now, sample_filter)
+
+    def _mark_running(sample_id):
+        return (
+            db.update(Sample)
+            .where((Sample.id == sample_id) & (Sample.status == Status.QUEUED))
+            .values(status=Status.RUNNING, timestamp_job_start=now, timestamp_job_end=0)
+        )
+
+    if db.engine.dialect.update_returning:
+        # pick and mark the next queued sample in a single atomic statement
+        sample = db.session.execute(
+            _mark_running(
+                next_queued_sample_id.with_for_update(
+                    skip_locked=True
+                ).scalar_subquery()
+            ).returning(Sample)
+        ).scalar_one_or_none()
+        db.session.commit()
+        return sample
+    # no UPDATE..RETURNING support: compare-and-swap on the sample status instead
+    while True:
+        sample_id = db.session.execute(next_queued_sample_id).scalar_one_or_none()
+        if sample_id is None:
+            return None
+        result = db.session.execute(
+            _mark_running(sample_id),
+            execution_options={"synchronize_session": False},
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return db.session.get(Sample, sample_id)
+        logger.debug(f"  --> sample id {sample_id} claimed by another runner")
+
+
+def requeue_timed_out_samples() -> list[int]:
+    job_timeout_minutes = get_settings().runner_job_timeout_mins
+    now = timestamp_now()
+    timed_out = (Sample.status == Status.RUNNING) & (
+        Sample.timestamp_job_start < now - job_timeout_minutes * 60
+    )
+    requeue = db.update(Sample).where(timed_out).values(status=Status.QUEUED)
+    if db.engine.dialect.update_returning:
+        sample_ids = db.session.execute(requeue.returning(Sample.id)).scalars().all()
     else:
-        logger.info(f"  --> sample id {sample.id}")
-        sample.timestamp_job_start = timestamp_now()
-        sample.timestamp_job_end = 0
-        sample.status = Status.RUNNING
+        sample_ids = (
+            db.session.execute(db.select(Sample.id).where(timed_out)).scalars().all()
+        )
+        db.session.execute(requeue.where(Sample.id.in_(sample_ids)))
+    if not sample_ids:
         db.session.commit()
-        return sample.id
+        return []
+    logger.info(
+        f"Samples {sample_ids} have been running for more than {job_timeout_minutes} minutes - putting back in queue"
+    )
+    db.session.execute(
+        db.update(Job)
+        .where(Job.sample_id.in_(sample_ids) & (Job.status == Status.RUNNING))
+        .values(
+            status=Status.FAILED,
+            timestamp_end=now,
+            error_message=f"Job timed out after {job_timeout_minutes} minutes",
+        )
+    )
+    db.session.commit()
+    notify_queue()
+    for sample in db.session.scalars(
+        db.select(Sample).where(Sample.id.in_(sample_ids))
+    ):
+        publish_sample_event(sample)
+    for job in db.session.scalars(
+        db.select(Job).where(
+            Job.sample_id.in_(sample_ids)
+            & (Job.status == Status.FAILED)
+            & (Job.timestamp_end == now)
+        )
+    ):
+        publish_job_event(job)
+    return sample_ids
+
+
+def notify_queue() -> None:
+    flask.current_app.extensions["predictcr_queue_signal"].notify()
+
+
+# the sample values that can change after it is submitted, sent to event streams
+_sample_event_columns = (
+    "id",
+    "email",
+    "status",
+    "timestamp_job_start",
+    "timestamp_job_end",
+    "has_results_zip",
+    "error_message",
+    "priority",
+)
+
+
+def _publish_event(event_type: str, data: dict) -> None:
+    flask.current_app.extensions["predictcr_event_broker"].publish(
+        {"type": event_type, "data": data}
+    )
+
+
+def publish_sample_event(sample: Sample) -> None:
+    _publish_event(
+        "sample", {column: getattr(sample, column) for column in _sample_event_columns}
+    )
+
+
+def publish_sample_deleted_event(sample_id: int, email: str) -> None:
+    _publish_event("sample_deleted", {"id": sample_id, "email": email})
+
+
+def publish_job_event(job: Job) -> None:
+    _publish_event("job", job.as_dict())
+
+
+def request_job(wait_secs: float = 0, sample_filter=None) -> Sample | None:
+    queue_signal = flask.current_app.extensions["predictcr_queue_signal"]
+    deadline = time.monotonic() + wait_secs
+    while True:
+        queue_version = queue_signal.version()
+        sample = _claim_queued_sample(timestamp_now(), sample_filter)
+        if sample is not None:
+            logger.info(f"  --> sample id {sample.id}")
+            publish_sample_event(sample)
+            return sample
+        remaining_secs = deadline - time.monotonic()
+        if remaining_secs <= 0 or not queue_signal.wait_for_change(
+            queue_version, remaining_secs
+        ):
+            logger.debug(" --> no samples in queue")
+            return None
+
+
+def set_sample_priority(sample_id: int, priority: int) -> tuple[str, int]:
+    sample = db.session.get(Sample, sample_id)
+    if sample is None:
+        return "Sample not found", 404
+    sample.priority = priority
+    db.session.commit()
+    publish_sample_event(sample)
+    return f"Sample {sample_id} priority set to {priority}", 200
+
+
+def release_job(job_id: int, sample_id: int, runner_id: int) -> tuple[str, int]:
+    job = db.session.get(Job, job_id)
+    if job is None or job.sample_id != sample_id or job.runner_id != runner_id:
+        logger.warning(f" --> Unknown job id {job_id} for sample id {sample_id}")
+        return f"Unknown job id {job_id} for sample id {sample_id}", 400
+    # the job may have timed out, in which case the sample may already run elsewhere
+    released = db.session.execute(
+        db.update(Job)
+        .where(
+            (Job.id == job_id)
+            & (Job.status == Status.RUNNING)
+            & (Job.runner_id == runner_id)
+        )
+        .values(
+            status=Status.FAILED,
+            timestamp_end=timestamp_now(),
+            error_message="Job released by runner",
+        ),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    if released != 1:
+        db.session.rollback()
+        logger.warning(f" --> Job id {job_id} is no longer running")
+        return f"Job {job_id} is no longer running", 409
+    requeued = db.session.execute(
+        db.update(Sample)
+        .where((Sample.id == sample_id) & (Sample.status == Status.RUNNING))
+        .values(status=Status.QUEUED)
+    ).rowcount
+    db.session.commit()
+    db.session.refresh(job)
+    publish_job_event(job)
+    if requeued:
+        logger.info(f"  --> sample id {sample_id} put back in queue")
+        notify_queue()
+        publish_sample_event(db.session.get(Sample, sample_id))
+    return "Job released", 200
 
 
 def process_result(
@@ -229,27 +794,239 @@ def process_result(
         job.error_message = error_message
         sample.error_message = error_message
     db.session.commit()
+    publish_job_event(job)
     if sample.has_results_zip:
         logger.warning(f" --> Sample {sample_id} already has results")
         return f"Sample {sample_id} already has results", 400
-    if admin_result_zip_file is not None:
-        admin_result_zip_file.save(sample.admin_result_file_path())
+    try:
+        if admin_result_zip_file is not None:
+            save_result_zip(
+                admin_result_zip_file.stream, sample.admin_result_file_path()
+            )
+        if success and user_result_zip_file is not None:
+            save_result_zip(user_result_zip_file.stream, sample.user_result_file_path())
+        if success and trusted_user_result_zip_file is not None:
+            save_result_zip(
+                trusted_user_result_zip_file.stream,
+                sample.trusted_user_result_file_path(),
+            )
+    except zipfile.BadZipFile as e:
+        logger.warning(f" --> Invalid result zip file: {e}")
+        return f"Invalid result zip file: {e}", 400
     if success is False:
         sample.has_results_zip = False
         sample.status = Status.FAILED
+        _add_notification(sample)
         db.session.commit()
+        publish_sample_event(sample)
         return "Result processed", 200
     if user_result_zip_file is None or trusted_user_result_zip_file is None:
         logger.warning(" --> Missing user result zipfile")
         return "User result zip file missing", 400
-    user_result_zip_file.save(sample.user_result_file_path())
-    trusted_user_result_zip_file.save(sample.trusted_user_result_file_path())
     sample.has_results_zip = True
     sample.status = Status.COMPLETED
+    _add_notification(sample)
     db.session.commit()
+    publish_sample_event(sample)
     return "Result processed", 200
 
 
+def _blob_store() -> BlobStore:
+    return flask.current_app.extensions["predictcr_blob_store"]
+
+
+def save_result_zip(zip_file: BinaryIO, manifest_path: pathlib.Path) -> None:
+    """
+    Store the members of a result zip file in the blob store and write its manifest.
+
+    Members that are already stored, e.g. from another zip file, are not written again.
+    """
+    members = _blob_store().put_zip(zip_file)
+    tmp_path = manifest_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    tmp_path.write_text(json.dumps({"members": members}))
+    os.replace(tmp_path, manifest_path)
+
+
+def load_result_manifest(manifest_path: pathlib.Path) -> tuple[list[dict], str] | None:
+    """The members of a stored result zip file and an ETag for it, or None if it doesn't exist."""
+    try:
+        manifest = manifest_path.read_bytes()
+    except FileNotFoundError:
+        return None
+    return json.loads(manifest)["members"], hashlib.sha256(manifest).hexdigest()
+
+
+def _result_zip_cache_path() -> pathlib.Path:
+    return pathlib.Path(flask.current_app.config["PREDICTCR_DATA_PATH"]) / "result_zips"
+
+
+def result_zip_file(members: list[dict], etag: str) -> pathlib.Path:
+    """
+    The result zip file with these members, assembled from the blob store the first time it is requested.
+
+    The file is named by the ETag of its manifest, and used again for as long as the manifest is unchanged.
+    """
+    zip_path = _result_zip_cache_path() / f"{etag}.zip"
+    if zip_path.is_file():
+        # keeps the zip file from being garbage collected while it is in use
+        os.utime(zip_path)
+        return zip_path
+    zip_path.parent.mkdir(exist_ok=True)
+    tmp_path = zip_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in _blob_store().zip_stream(members):
+                f.write(chunk)
+        os.replace(tmp_path, zip_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return zip_path
+
+
+def delete_results(sample: Sample) -> None:
+    # the blobs are deleted by collect_result_garbage once no manifest refers to them
+    for manifest_path in [
+        sample.user_result_file_path(),
+        sample.trusted_user_result_file_path(),
+        sample.admin_result_file_path(),
+    ]:
+        manifest_path.unlink(missing_ok=True)
+
+
+def _result_manifest_paths() -> Iterator[pathlib.Path]:
+    data_path = pathlib.Path(flask.current_app.config["PREDICTCR_DATA_PATH"])
+    return data_path.glob("*/*_results.manifest.json")
+
+
+def collect_result_garbage(min_age_secs: float = 3600) -> int:
+    """
+    Delete blobs that are no longer in any result manifest, returns the number deleted.
+
+    Assembled result zip files are deleted if their manifest no longer exists, or
+    if they have not been downloaded for PREDICTCR_RESULT_ZIP_CACHE_DAYS.
+    """
+    referenced = set()
+    etags = set()
+    for manifest_path in _result_manifest_paths():
+        manifest = load_result_manifest(manifest_path)
+        if manifest is not None:
+            referenced.update(
+                member["sha256"] for member in manifest[0] if "sha256" in member
+            )
+            etags.add(manifest[1])
+    now = time.time()
+    max_unused_secs = (
+        flask.current_app.config["PREDICTCR_RESULT_ZIP_CACHE_DAYS"] * 24 * 3600
+    )
+    n_zips_deleted = 0
+    for zip_path in _result_zip_cache_path().glob("*"):
+        try:
+            age_secs = now - zip_path.stat().st_mtime
+            if (zip_path.stem not in etags and age_secs > min_age_secs) or (
+                age_secs > max_unused_secs
+            ):
+                zip_path.unlink()
+                n_zips_deleted += 1
+        except FileNotFoundError:
+            pass
+    logger.info(f"Deleted {n_zips_deleted} assembled result zip files")
+    return _blob_store().collect_garbage(referenced, min_age_secs)
+
+
+def migrate_result_zips() -> tuple[int, int]:
+    """
+    Move result zip files stored by previous versions into the blob store.
+
+    Returns the number of zip files migrated and their total size in bytes.
+    """
+    data_path = pathlib.Path(flask.current_app.config["PREDICTCR_DATA_PATH"])
+    n_migrated = 0
+    n_bytes = 0
+    for zip_path in sorted(data_path.glob("*/*_results.zip")):
+        manifest_path = zip_path.with_suffix(".manifest.json")
+        try:
+            with open(zip_path, "rb") as zip_file:
+                save_result_zip(zip_file, manifest_path)
+        except zipfile.BadZipFile as e:
+            logger.error(f"Skipping invalid result zip file {zip_path}: {e}")
+            continue
+        n_bytes += zip_path.stat().st_size
+        zip_path.unlink()
+        n_migrated += 1
+        logger.info(f"Migrated {zip_path} to {manifest_path}")
+    return n_migrated, n_bytes
+
+
+def _add_notification(sample: Sample) -> None:
+    db.session.add(
+        Notification(
+            id=None,
+            email=sample.email,
+            sample_id=sample.id,
+            sample_name=sample.name,
+            status=sample.status,
+            timestamp=timestamp_now(),
+        )
+    )
+
+
+def _claim_notifications() -> list[tuple[str, int, str, Status]]:
+    columns = (
+        Notification.email,
+        Notification.sample_id,
+        Notification.sample_name,
+        Notification.status,
+    )
+    if db.engine.dialect.delete_returning:
+        notifications = (
+            db.session.execute(
+                db.delete(Notification)
+                .returning(*columns)
+                .execution_options(synchronize_session=False)
+            )
+            .tuples()
+            .all()
+        )
+    else:
+        # only keep the notifications this process managed to delete
+        notifications = []
+        for notification_id, *values in db.session.execute(
+            db.select(Notification.id, *columns)
+        ).all():
+            result = db.session.execute(
+                db.delete(Notification)
+                .where(Notification.id == notification_id)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                notifications.append(tuple(values))
+    db.session.commit()
+    return notifications
+
+
+def send_notification_digests() -> int:
+    """
+    Send each user a single email listing all their samples that have finished
+    since the last time this was called. Returns the number of emails sent.
+    """
+    samples_by_email: dict[str, list[str]] = {}
+    for email, sample_id, sample_name, status in sorted(
+        _claim_notifications(), key=lambda n: n[1]
+    ):
+        samples_by_email.setdefault(email, []).append(
+            f"  - {sample_name} (id {sample_id}): {status.value}"
+        )
+    for email, samples in samples_by_email.items():
+        n_samples = len(samples)
+        msg_body = (
+            f"The following sample{'s have' if n_samples > 1 else ' has'} finished:\n\n"
+            + "\n".join(samples)
+            + f"\n\nYou can see the status of your samples and download the results at https://{predicTCR_url}/samples."
+        )
+        send_email(email, "predicTCR samples finished", msg_body)
+    return len(samples_by_email)
+
+
 def is_valid_email(email: str) -> bool:
     return re.match(r"\S+@\S+\.\S+$", email) is not None
 
@@ -325,23 +1102,24 @@ def add_new_user(email: str, password: str, is_admin: bool) -> tuple[str, int]:
             "This email address is already in use",
             400,
         )
+    # hash first: if the hashing pool is busy no activation email is sent
+    password_hash = hash_password(password)
     try:
         _send_activation_email(email)
     except Exception as e:
         logger.warning(f"Send activation email failed: {e}")
         return "Failed to send activation email", 400
+    settings = get_settings()
     try:
         db.session.add(
             User(
                 id=None,
                 email=email,
-                password_hash=ph.hash(password),
+                password_hash=password_hash,
                 activated=False,
                 enabled=False,
-                quota=db.session.get(Settings, 1).default_personal_submission_quota,
-                submission_interval_minutes=db.session.get(
-                    Settings, 1
-                ).default_personal_submission_interval_mins,
+                quota=settings.default_personal_submission_quota,
+                submission_interval_minutes=settings.default_personal_submission_interval_mins,
                 last_submission_timestamp=0,
                 is_admin=is_admin,
                 is_runner=False,
@@ -415,11 +1193,13 @@ def update_user(user_updates: dict) -> tuple[str, int]:
         "quota",
         "full_results",
         "submission_interval_minutes",
+        "scheduling_weight",
     ]:
         value = user_updates.get(key, None)
         if value is not None:
             setattr(user, key, value)
     db.session.commit()
+    notify_user_changed()
     return f"Account {email} updated", 200
 
 
@@ -442,6 +1222,7 @@ def activate_user(token: str) -> tuple[str, int]:
         return f"Account for {email} is already activated", 400
     user.activated = True
     db.session.commit()
+    notify_user_changed()
     return f"Account {email} activated", 200
 
 
@@ -479,8 +1260,7 @@ def get_user_if_allowed_to_submit(email: str) -> tuple[User | None, str]:
         return None, f"Unknown email address {email}."
     if user.quota <= 0:
         return None, "You have reached your sample submission quota."
-    settings = db.session.get(Settings, 1)
-    if settings.global_quota <= 0:
+    if get_settings().global_quota <= 0:
         return None, "The service has reached its sample submission quota."
     mins_since_last_submission = (
         timestamp_now() - user.last_submission_timestamp
@@ -499,22 +1279,26 @@ def get_user_if_allowed_to_submit(email: str) -> tuple[User | None, str]:
     return user, ""
 
 
-def add_new_sample(
+def _charge_submission(user: User) -> None:
+    user.last_submission_timestamp = timestamp_now()
+    user.quota -= 1
+    settings = db.session.get(Settings, 1)
+    settings.global_quota -= 1
+
+
+def _add_new_sample(
     email: str,
     name: str,
     tumor_type: str,
     source: str,
     platform: str,
-    h5_file: FileStorage,
-    csv_file: FileStorage,
+    status: Status,
 ) -> tuple[Sample | None, str]:
     user, msg = get_user_if_allowed_to_submit(email)
     if user is None:
         return None, msg
-    user.last_submission_timestamp = timestamp_now()
-    user.quota -= 1
-    settings = db.session.get(Settings, 1)
-    settings.global_quota -= 1
+    if status != Status.UPLOADING:
+        _charge_submission(user)
     new_sample = Sample(
         id=None,
         email=email,
@@ -525,13 +1309,284 @@ def add_new_sample(
         timestamp=timestamp_now(),
         timestamp_job_start=0,
         timestamp_job_end=0,
-        status=Status.QUEUED,
+        status=status,
         has_results_zip=False,
         error_message="",
     )
     db.session.add(new_sample)
     db.session.commit()
-    new_sample.input_h5_file_path().parent.mkdir(parents=True, exist_ok=True)
-    h5_file.save(new_sample.input_h5_file_path())
-    csv_file.save(new_sample.input_csv_file_path())
+    if status != Status.UPLOADING:
+        notify_settings_changed()
+        notify_user_changed()
+    new_sample.base_path().mkdir(parents=True, exist_ok=True)
+    publish_sample_event(new_sample)
+    return new_sample, ""
+
+
+def add_new_sample(
+    email: str,
+    name: str,
+    tumor_type: str,
+    source: str,
+    platform: str,
+    h5_file: FileStorage,
+    csv_file: FileStorage,
+) -> tuple[Sample | None, str]:
+    new_sample, msg = _add_new_sample(
+        email, name, tumor_type, source, platform, Status.VALIDATING
+    )
+    if new_sample is None:
+        return None, msg
+    new_sample.input_h5_sha256 = save_file_with_sha256(
+        h5_file, new_sample.input_h5_file_path()
+    )
+    new_sample.input_csv_sha256 = save_file_with_sha256(
+        csv_file, new_sample.input_csv_file_path()
+    )
+    new_sample.input_size_bytes = _input_size_bytes(new_sample)
+    db.session.commit()
+    _validate_now_if_no_background_task(new_sample)
+    return new_sample, ""
+
+
+def start_sample_upload(
+    email: str, name: str, tumor_type: str, source: str, platform: str
+) -> tuple[Sample | None, str]:
+    # the quota is only charged when an upload finishes: each open upload reserves one submission
+    n_open_uploads = db.session.execute(
+        db.select(db.func.count(Sample.id)).where(
+            (Sample.email == email) & (Sample.status == Status.UPLOADING)
+        )
+    ).scalar_one()
+    user = db.session.execute(
+        db.select(User).filter(User.email == email)
+    ).scalar_one_or_none()
+    if user is not None and 0 < user.quota <= n_open_uploads:
+        return (
+            None,
+            "Your unfinished uploads already use your remaining sample submission quota.",
+        )
+    new_sample, msg = _add_new_sample(
+        email, name, tumor_type, source, platform, Status.UPLOADING
+    )
+    if new_sample is None:
+        return None, msg
+    for input_file_path in [
+        new_sample.input_h5_file_path(),
+        new_sample.input_csv_file_path(),
+    ]:
+        input_file_path.touch()
     return new_sample, ""
+
+
+def _get_uploading_sample(email: str, sample_id: int) -> Sample | None:
+    return db.session.execute(
+        db.select(Sample).filter(
+            (Sample.id == sample_id)
+            & (Sample.email == email)
+            & (Sample.status == Status.UPLOADING)
+        )
+    ).scalar_one_or_none()
+
+
+def _input_size_bytes(sample: Sample) -> int:
+    return (
+        sample.input_h5_file_path().stat().st_size
+        + sample.input_csv_file_path().stat().st_size
+    )
+
+
+def _input_file_path(sample: Sample, input_file_type: str) -> pathlib.Path | None:
+    if input_file_type == "h5":
+        return sample.input_h5_file_path()
+    if input_file_type == "csv":
+        return sample.input_csv_file_path()
+    return None
+
+
+def get_sample_upload_status(email: str, sample_id: int) -> tuple[dict, int]:
+    sample = _get_uploading_sample(email, sample_id)
+    if sample is None:
+        return {"message": f"No upload in progress for sample {sample_id}"}, 404
+    return {
+        "sample_id": sample.id,
+        "h5_size_bytes": sample.input_h5_file_path().stat().st_size,
+        "csv_size_bytes": sample.input_csv_file_path().stat().st_size,
+    }, 200
+
+
+def upload_sample_chunk(
+    email: str,
+    sample_id: int,
+    input_file_type: str,
+    offset: int,
+    stream: BinaryIO,
+    chunk_size: int = 1024 * 1024,
+) -> tuple[dict, int]:
+    sample = _get_uploading_sample(email, sample_id)
+    if sample is None:
+        return {"message": f"No upload in progress for sample {sample_id}"}, 404
+    input_file_path = _input_file_path(sample, input_file_type)
+    if input_file_path is None:
+        return {"message": f"Invalid input file type '{input_file_type}'"}, 400
+    settings = get_settings()
+    max_size_bytes = (
+        (
+            settings.max_filesize_h5_mb
+            if input_file_type == "h5"
+            else settings.max_filesize_csv_mb
+        )
+        * 1024
+        * 1024
+    )
+    with open(input_file_path, "r+b") as f:
+        size = f.seek(0, 2)
+        if offset != size:
+            # client needs to resume from the size we already have
+            return {
+                "message": f"Chunk offset {offset} doesn't match uploaded size {size}",
+                "size_bytes": size,
+            }, 409
+        while chunk := stream.read(chunk_size):
+            size += len(chunk)
+            if size > max_size_bytes:
+                f.truncate(offset)
+                return {
+                    "message": f"{input_file_type} file exceeds maximum size of {max_size_bytes // (1024 * 1024)}MB",
+                    "size_bytes": offset,
+                }, 413
+            f.write(chunk)
+    return {"size_bytes": size}, 200
+
+
+def finish_sample_upload(email: str, sample_id: int) -> tuple[Sample | None, str]:
+    sample = _get_uploading_sample(email, sample_id)
+    if sample is None:
+        return None, f"No upload in progress for sample {sample_id}"
+    for input_file_type in ["h5", "csv"]:
+        input_file_path = _input_file_path(sample, input_file_type)
+        if input_file_path.stat().st_size == 0:
+            return None, f"No {input_file_type} file uploaded"
+    # the submission is only charged once the upload succeeds
+    user, msg = get_user_if_allowed_to_submit(email)
+    if user is None:
+        return None, msg
+    _charge_submission(user)
+    sample.input_h5_sha256 = sha256_file(sample.input_h5_file_path())
+    sample.input_csv_sha256 = sha256_file(sample.input_csv_file_path())
+    sample.input_size_bytes = _input_size_bytes(sample)
+    sample.timestamp = timestamp_now()
+    sample.status = Status.VALIDATING
+    db.session.commit()
+    notify_settings_changed()
+    notify_user_changed()
+    publish_sample_event(sample)
+    _validate_now_if_no_background_task(sample)
+    return sample, ""
+
+
+def delete_stale_uploads() -> list[int]:
+    """Delete samples whose upload has not received a chunk for PREDICTCR_UPLOAD_EXPIRY_HOURS."""
+    expiry_secs = flask.current_app.config["PREDICTCR_UPLOAD_EXPIRY_HOURS"] * 3600
+    now = time.time()
+    stale_samples = []
+    for sample in db.session.scalars(
+        db.select(Sample).where(
+            (Sample.status == Status.UPLOADING) & (Sample.timestamp < now - expiry_secs)
+        )
+    ):
+        last_activity = max(
+            [sample.timestamp]
+            + [
+                path.stat().st_mtime
+                for path in [sample.input_h5_file_path(), sample.input_csv_file_path()]
+                if path.is_file()
+            ]
+        )
+        if last_activity < now - expiry_secs:
+            stale_samples.append(sample)
+    if not stale_samples:
+        return []
+    sample_ids = [sample.id for sample in stale_samples]
+    logger.info(f"Deleting samples {sample_ids} with abandoned uploads")
+    deleted_samples = [(sample.id, sample.email) for sample in stale_samples]
+    for sample in stale_samples:
+        shutil.rmtree(sample.base_path(), ignore_errors=True)
+        db.session.delete(sample)
+    db.session.commit()
+    for sample_id, email in deleted_samples:
+        publish_sample_deleted_event(sample_id, email)
+    return sample_ids
+
+
+def _validate_now_if_no_background_task(sample: Sample) -> None:
+    # without the periodic validate_samples task, samples are validated when they are submitted
+    if flask.current_app.config["PREDICTCR_VALIDATION_INTERVAL_SECS"] <= 0:
+        validate_samples([sample.id])
+
+
+def _validate_input_file(key: str, validate: Callable[[], str]) -> str:
+    # the same input files are often submitted again, e.g. after a failed job
+    cached = db.session.get(InputValidation, key)
+    if cached is not None:
+        return cached.error_message
+    error_message = validate()
+    db.session.merge(
+        InputValidation(key=key, error_message=error_message, timestamp=timestamp_now())
+    )
+    db.session.commit()
+    return error_message
+
+
+def _validate_sample(sample: Sample, required_columns: list[str]) -> str:
+    return _validate_input_file(
+        f"v{VALIDATION_VERSION}:h5:{sample.input_h5_sha256}",
+        lambda: validate_h5_file(sample.input_h5_file_path()),
+    ) or _validate_input_file(
+        f"v{VALIDATION_VERSION}:csv:{sample.input_csv_sha256}:{';'.join(required_columns)}",
+        lambda: validate_csv_file(sample.input_csv_file_path(), required_columns),
+    )
+
+
+def validate_samples(sample_ids: list[int] | None = None) -> list[int]:
+    """
+    Check the input files of samples waiting to be validated, or only of `sample_ids`.
+
+    Samples with valid input files are queued, the others fail with the reason
+    as their error message. Returns the ids of the samples that were validated.
+    """
+    required_columns = [
+        column.strip()
+        for column in get_settings().csv_required_columns.split(";")
+        if column.strip() != ""
+    ]
+    selected_samples = db.select(Sample).filter(Sample.status == Status.VALIDATING)
+    if sample_ids is not None:
+        selected_samples = selected_samples.filter(Sample.id.in_(sample_ids))
+    samples = (
+        db.session.execute(selected_samples.order_by(Sample.timestamp)).scalars().all()
+    )
+    validated_sample_ids = []
+    for sample in samples:
+        error_message = _validate_sample(sample, required_columns)
+        status = Status.FAILED if error_message else Status.QUEUED
+        # only the first process to validate a sample updates it
+        updated = db.session.execute(
+            db.update(Sample)
+            .where((Sample.id == sample.id) & (Sample.status == Status.VALIDATING))
+            .values(status=status, error_message=error_message)
+            .execution_options(synchronize_session=False)
+        )
+        if updated.rowcount != 1:
+            db.session.rollback()
+            continue
+        db.session.refresh(sample)
+        if status == Status.FAILED:
+            logger.info(f"Sample {sample.id} failed validation: {error_message}")
+            _add_notification(sample)
+        db.session.commit()
+        if status == Status.QUEUED:
+            notify_queue()
+        publish_sample_event(sample)
+        validated_sample_ids.append(sample.id)
+    return validated_sample_ids
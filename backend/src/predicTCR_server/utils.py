@@ -3,6 +3,10 @@ from typing import Optional
 from predicTCR_server.logger import get_logger
 from itsdangerous.url_safe import URLSafeTimedSerializer
 from datetime import datetime
+from typing import BinaryIO
+from werkzeug.datastructures import FileStorage
+import hashlib
+import os
 
 logger = get_logger()
 
@@ -11,6 +15,37 @@ def timestamp_now() -> int:
     return int(datetime.now().timestamp())
 
 
+def file_size_bytes(path: str | os.PathLike) -> Optional[int]:
+    try:
+        return os.stat(path).st_size
+    except OSError as e:
+        logger.warning(f"Failed to get size of {path}: {e}")
+        return None
+
+
+def copy_stream_with_sha256(
+    stream: BinaryIO, path: str | os.PathLike, chunk_size: int = 1024 * 1024
+) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "wb") as f:
+        while chunk := stream.read(chunk_size):
+            sha256.update(chunk)
+            f.write(chunk)
+    return sha256.hexdigest()
+
+
+def sha256_file(path: str | os.PathLike, chunk_size: int = 1024 * 1024) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def save_file_with_sha256(file: FileStorage, path: str | os.PathLike) -> str:
+    return copy_stream_with_sha256(file.stream, path)
+
+
 def _encode_string_as_token(string_to_encode: str, salt: str, secret_key: str) -> str:
     ss = URLSafeTimedSerializer(secret_key, salt=salt)
     return ss.dumps(string_to_encode)
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import csv
+import pathlib
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# increase when the checks change, so that cached results of previous checks are not used
+VALIDATION_VERSION = 3
+
+# an HDF5 file starts with this signature at offset 0, 512, 1024, 2048, ...
+_hdf5_signature = b"\x89HDF\r\n\x1a\n"
+
+
+def validate_csv_file(path: pathlib.Path, required_columns: list[str]) -> str:
+    """
+    Check that the header of a csv file has the required columns.
+
+    Only the header is read: rows may have blank cells. Returns an error message, or "" if it is valid.
+    """
+    try:
+        # utf-8-sig skips the byte order mark that e.g. Excel adds to csv files
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return "CSV file is empty"
+            header = [column.strip() for column in header]
+            missing_columns = [c for c in required_columns if c not in header]
+            if missing_columns:
+                return f"CSV file is missing required columns: {', '.join(missing_columns)}"
+    except UnicodeDecodeError:
+        return "CSV file is not a valid UTF-8 text file"
+    except csv.Error as e:
+        return f"CSV file is not valid: {e}"
+    return ""
+
+
+def _has_hdf5_signature(path: pathlib.Path) -> bool:
+    size = path.stat().st_size
+    offset = 0
+    with open(path, "rb") as f:
+        while offset + len(_hdf5_signature) <= size:
+            f.seek(offset)
+            if f.read(len(_hdf5_signature)) == _hdf5_signature:
+                return True
+            offset = 512 if offset == 0 else 2 * offset
+    return False
+
+
+def validate_h5_file(path: pathlib.Path) -> str:
+    """
+    Check that a file is an HDF5 file containing at least one dataset.
+
+    Only the metadata of the file is read, not the data of its datasets. Without
+    the optional h5py dependency only the HDF5 signature of the file is checked.
+    Returns an error message, or "" if it is valid.
+    """
+    if not _has_hdf5_signature(path):
+        return "H5 file is not a valid HDF5 file"
+    if h5py is None:
+        return ""
+    n_datasets = 0
+
+    def _count_datasets(name, obj):
+        nonlocal n_datasets
+        if isinstance(obj, h5py.Dataset):
+            n_datasets += 1
+
+    try:
+        with h5py.File(path, "r") as f:
+            f.visititems(_count_datasets)
+    except Exception as e:
+        return f"H5 file could not be read: {e}"
+    if n_datasets == 0:
+        return "H5 file contains no datasets"
+    return ""
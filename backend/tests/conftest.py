@@ -15,13 +15,25 @@ sys.path.append(os.path.join(os.path.dirname(__file__), "helpers"))
 import flask_test_utils as ftu
 
 
+@pytest.fixture(autouse=True)
+def no_background_tasks(monkeypatch):
+    # tests call the periodic background tasks explicitly where needed
+    monkeypatch.setenv("PREDICTCR_REAPER_INTERVAL_SECS", "0")
+    monkeypatch.setenv("PREDICTCR_VALIDATION_INTERVAL_SECS", "0")
+    monkeypatch.setenv("PREDICTCR_EMAIL_INTERVAL_SECS", "0")
+    monkeypatch.setenv("PREDICTCR_NOTIFICATION_WINDOW_SECS", "0")
+    monkeypatch.setenv("PREDICTCR_BLOB_GC_INTERVAL_SECS", "0")
+
+
 @pytest.fixture()
 def app(monkeypatch, tmp_path):
     monkeypatch.setenv("JWT_SECRET_KEY", "abcdefghijklmnopqrstuvwxyz")
     monkeypatch.setattr(
         smtplib.SMTP,
         "__init__",
-        lambda self, host: print(f"Monkeypatched SMTP host: {host}", flush=True),
+        lambda self, host, **kwargs: print(
+            f"Monkeypatched SMTP host: {host}", flush=True
+        ),
     )
     monkeypatch.setattr(
         smtplib.SMTP,
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import socketserver
+import threading
+from email.parser import BytesParser
+from email.message import Message
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    Minimal local SMTP server that stores the messages it receives.
+
+    The first `fail_data` messages are rejected with a temporary error.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, fail_data: int = 0):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.messages: list[Message] = []
+        self.n_connections = 0
+        self.fail_data = fail_data
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def address(self) -> str:
+        host, port = self.server_address
+        return f"{host}:{port}"
+
+    def __enter__(self) -> FakeSMTPServer:
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self) -> None:
+        server: FakeSMTPServer = self.server
+        server.n_connections += 1
+        self._reply("220 fake smtp server")
+        while line := self.rfile.readline():
+            command = line.decode().strip().upper()
+            if command.startswith("EHLO") or command.startswith("HELO"):
+                self._reply("250 fake")
+            elif command.startswith("DATA"):
+                self._reply("354 end data with <CR><LF>.<CR><LF>")
+                data = b""
+                while (data_line := self.rfile.readline()) != b".\r\n":
+                    data += data_line
+                if server.fail_data > 0:
+                    server.fail_data -= 1
+                    self._reply("451 try again later")
+                else:
+                    server.messages.append(BytesParser().parsebytes(data))
+                    self._reply("250 ok")
+            elif command.startswith("QUIT"):
+                self._reply("221 bye")
+                return
+            else:
+                self._reply("250 ok")
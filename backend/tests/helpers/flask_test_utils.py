@@ -63,3 +63,33 @@ def add_test_samples(app, data_path: pathlib.Path):
             )
             db.session.add(new_sample)
             db.session.commit()
+
+
+def add_queued_samples(app, data_path: pathlib.Path, n_samples: int) -> list[int]:
+    sample_ids = []
+    with app.app_context():
+        for n in range(n_samples):
+            new_sample = Sample(
+                id=None,
+                email="user@abc.xy",
+                name=f"queued{n}",
+                tumor_type="tumor_type",
+                source="source",
+                platform="platform",
+                timestamp=100 + n,
+                timestamp_job_start=0,
+                timestamp_job_end=0,
+                status=Status.QUEUED,
+                has_results_zip=False,
+                error_message="",
+            )
+            db.session.add(new_sample)
+            db.session.commit()
+            new_sample.base_path().mkdir(parents=True, exist_ok=True)
+            for input_file_type in ["h5", "csv"]:
+                with open(
+                    new_sample.base_path() / f"input.{input_file_type}", "w"
+                ) as f:
+                    f.write(input_file_type)
+            sample_ids.append(new_sample.id)
+    return sample_ids
@@ -1,10 +1,36 @@
 from __future__ import annotations
 from typing import Dict
 import io
+import os
+import json
+import hashlib
+import shutil
+import time
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 import pathlib
 import predicTCR_server
 import flask_test_utils as ftu
+from predicTCR_server.model import (
+    db,
+    Settings,
+    User,
+    notify_settings_changed,
+    Sample,
+    Job,
+    Status,
+    InputValidation,
+    load_result_manifest,
+    validate_samples,
+    delete_stale_uploads,
+    requeue_timed_out_samples,
+    delete_results,
+    collect_result_garbage,
+)
+from predicTCR_server.hashing import HashingPoolBusy
+from predicTCR_server.validation import VALIDATION_VERSION
 
 
 def _get_auth_headers(
@@ -87,6 +113,21 @@ def test_change_password_valid(client):
     assert response.status_code == 200
 
 
+def test_unknown_scheduling_policy(tmp_path, monkeypatch):
+    monkeypatch.setenv("PREDICTCR_SCHEDULING_POLICY", "random")
+    with pytest.raises(ValueError, match="PREDICTCR_SCHEDULING_POLICY"):
+        predicTCR_server.create_app(data_path=str(tmp_path))
+
+
+def test_thread_budget_exceeded(tmp_path, monkeypatch):
+    monkeypatch.setenv("PREDICTCR_WORKER_THREADS", "8")
+    with pytest.raises(ValueError, match="PREDICTCR_WORKER_THREADS"):
+        predicTCR_server.create_app(data_path=str(tmp_path))
+    monkeypatch.setenv("PREDICTCR_EVENT_STREAMS_MAX", "1")
+    monkeypatch.setenv("PREDICTCR_HASHING_QUEUE", "0")
+    predicTCR_server.create_app(data_path=str(tmp_path))
+
+
 def test_jwt_same_secret_persists_valid_tokens(tmp_path, monkeypatch):
     monkeypatch.setenv("JWT_SECRET_KEY", "0123456789abcdefghijklmnopqrstuvwxyz")
     app1 = predicTCR_server.create_app(data_path=str(tmp_path))
@@ -129,6 +170,72 @@ def test_samples_valid(client):
     assert len(response.json) == 4
 
 
+def test_samples_paginated(app, client, tmp_path):
+    ftu.add_queued_samples(app, tmp_path, 5)
+    headers = _get_auth_headers(client)
+    # test samples have timestamps 1,2,3,4 and the queued ones 100-104
+    sample_ids = []
+    cursor = None
+    for expected_size in [4, 4, 1]:
+        params = {"limit": 4}
+        if cursor is not None:
+            params["cursor"] = cursor
+        response = client.get("/api/samples", query_string=params, headers=headers)
+        assert response.status_code == 200
+        assert len(response.json["samples"]) == expected_size
+        sample_ids += [sample["id"] for sample in response.json["samples"]]
+        cursor = response.json["next_cursor"]
+    assert cursor is None
+    assert sample_ids == [9, 8, 7, 6, 5, 4, 3, 2, 1]
+    # filters
+    response = client.get(
+        "/api/samples", query_string={"status": "running,completed"}, headers=headers
+    )
+    assert [s["id"] for s in response.json["samples"]] == [3, 2]
+    response = client.get(
+        "/api/samples", query_string={"tumor_type": "tumor_type4"}, headers=headers
+    )
+    assert [s["id"] for s in response.json["samples"]] == [4]
+    response = client.get(
+        "/api/samples",
+        query_string={"timestamp_from": 2, "timestamp_to": 100},
+        headers=headers,
+    )
+    assert [s["id"] for s in response.json["samples"]] == [5, 4, 3, 2]
+    # projection: id and timestamp are always included
+    response = client.get(
+        "/api/samples", query_string={"fields": "name", "limit": 1}, headers=headers
+    )
+    assert response.json["samples"] == [{"id": 9, "name": "queued4", "timestamp": 104}]
+    assert response.json["next_cursor"] == "104:9"
+    # other users see none of these samples
+    admin_headers = _get_auth_headers(client, "admin@abc.xy", "admin")
+    response = client.get(
+        "/api/samples", query_string={"limit": 10}, headers=admin_headers
+    )
+    assert response.json == {"samples": [], "next_cursor": None}
+    # admins see all of them
+    response = client.get(
+        "/api/admin/samples", query_string={"limit": 10}, headers=admin_headers
+    )
+    assert len(response.json["samples"]) == 9
+
+
+@pytest.mark.parametrize(
+    "query_string",
+    [
+        {"limit": 0},
+        {"cursor": "abc"},
+        {"status": "unknown"},
+        {"fields": "name,password"},
+    ],
+)
+def test_samples_paginated_invalid(client, query_string):
+    headers = _get_auth_headers(client)
+    response = client.get("/api/samples", query_string=query_string, headers=headers)
+    assert response.status_code == 400
+
+
 def test_get_settings_valid(client):
     headers = _get_auth_headers(client)
     response = client.get("/api/settings", headers=headers)
@@ -147,9 +254,32 @@ def test_get_settings_valid(client):
         "max_filesize_csv_mb": 10,
         "about_md": "",
         "news_items_json": "[]",
+        "argon2_time_cost": 3,
+        "argon2_memory_cost_kib": 65536,
+        "argon2_parallelism": 4,
     }
 
 
+def test_get_settings_etag(client):
+    response = client.get("/api/settings")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    # unchanged settings
+    response = client.get("/api/settings", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    # settings modified by admin
+    headers = _get_auth_headers(client, "admin@abc.xy", "admin")
+    response = client.post(
+        "/api/admin/settings", json={"global_quota": 66}, headers=headers
+    )
+    assert response.status_code == 200
+    response = client.get("/api/settings", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json["global_quota"] == 66
+    assert response.headers["ETag"] != etag
+
+
 def test_update_settings_valid(client):
     headers = _get_auth_headers(client, "admin@abc.xy", "admin")
     new_settings = {
@@ -167,6 +297,9 @@ def test_update_settings_valid(client):
         "about_md": "# About",
         "invalid-key": "invalid",
         "news_items_json": "[{'id': '1', 'url': 'https://example.com', 'text': 'Example'}]",
+        "argon2_time_cost": 2,
+        "argon2_memory_cost_kib": 32768,
+        "argon2_parallelism": 2,
     }
     response = client.post("/api/admin/settings", headers=headers, json=new_settings)
     assert response.status_code == 200
@@ -174,6 +307,57 @@ def test_update_settings_valid(client):
     assert client.get("/api/settings", headers=headers).json == new_settings
 
 
+def test_update_settings_invalid_argon2_parameters(client):
+    headers = _get_auth_headers(client, "admin@abc.xy", "admin")
+    settings = client.get("/api/settings", headers=headers).json
+    for invalid_settings in [
+        {"argon2_time_cost": 0},
+        {"argon2_parallelism": 8, "argon2_memory_cost_kib": 32},
+        {"argon2_memory_cost_kib": "lots", "global_quota": 5},
+    ]:
+        response = client.post(
+            "/api/admin/settings", headers=headers, json=invalid_settings
+        )
+        assert response.status_code == 400
+        assert "argon2" in response.json["message"]
+    # nothing was changed and logging in still works
+    assert client.get("/api/settings", headers=headers).json == settings
+    _get_auth_headers(client)
+
+
+def test_login_rehashes_password_with_new_argon2_settings(app, client):
+    headers = _get_auth_headers(client, "admin@abc.xy", "admin")
+    client.post(
+        "/api/admin/settings",
+        headers=headers,
+        json={"argon2_time_cost": 1, "argon2_memory_cost_kib": 8192},
+    )
+    _get_auth_headers(client)
+    with app.app_context():
+        user = db.session.execute(
+            db.select(User).filter(User.email == "user@abc.xy")
+        ).scalar_one()
+        assert "m=8192,t=1" in user.password_hash
+    # login still works with the new hash
+    _get_auth_headers(client)
+
+
+def test_login_hashing_pool_busy(app, client, monkeypatch):
+    def busy(*args):
+        raise HashingPoolBusy()
+
+    monkeypatch.setattr(app.extensions["predictcr_hashing_pool"], "run", busy)
+    response = client.post(
+        "/api/login", json={"email": "user@abc.xy", "password": "user"}
+    )
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "5"
+    response = client.post(
+        "/api/signup", json={"email": "new@abc.xy", "password": "Abcdefgh1"}
+    )
+    assert response.status_code == 429
+
+
 @pytest.mark.parametrize("input_file_type", ["h5", "csv"])
 def test_input_file_invalid(client, input_file_type: str):
     # no auth header
@@ -206,6 +390,408 @@ def test_input_file_valid(client, input_file_type: str):
         assert input_file_type in f.read().decode("utf-8")
 
 
+def _add_sample(client, h5_content: bytes = b"h5", csv_content: bytes = b"csv"):
+    return client.post(
+        "/api/sample",
+        data={
+            "name": "new_sample",
+            "tumor_type": "Lung",
+            "source": "TIL",
+            "platform": "Illumina",
+            "h5_file": (io.BytesIO(h5_content), "input.h5"),
+            "csv_file": (io.BytesIO(csv_content), "input.csv"),
+        },
+        headers=_get_auth_headers(client),
+    )
+
+
+@pytest.mark.parametrize("input_file_type", ["h5", "csv"])
+def test_input_file_etag(client, input_file_type: str):
+    content = f"{input_file_type} file contents".encode()
+    response = _add_sample(client, h5_content=content, csv_content=content)
+    assert response.status_code == 200
+    assert response.json["sample"]["input_size_bytes"] == 2 * len(content)
+    sample_id = response.json["sample"]["id"]
+    sha256 = hashlib.sha256(content).hexdigest()
+    assert response.json["sample"][f"input_{input_file_type}_sha256"] == sha256
+    headers = _get_auth_headers(client, "runner@abc.xy", "runner")
+    response = client.post(
+        f"/api/input_{input_file_type}_file",
+        json={"sample_id": sample_id},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert response.data == content
+    assert response.headers["ETag"] == f'"{sha256}"'
+    # client already has this file
+    response = client.post(
+        f"/api/input_{input_file_type}_file",
+        json={"sample_id": sample_id},
+        headers={**headers, "If-None-Match": f'"{sha256}"'},
+    )
+    assert response.status_code == 304
+    assert response.data == b""
+    # client has a different file
+    response = client.post(
+        f"/api/input_{input_file_type}_file",
+        json={"sample_id": sample_id},
+        headers={**headers, "If-None-Match": '"abc123"'},
+    )
+    assert response.status_code == 200
+    assert response.data == content
+
+
+def test_input_file_range(client):
+    content = b"0123456789"
+    sample_id = _add_sample(client, h5_content=content).json["sample"]["id"]
+    headers = _get_auth_headers(client)
+    response = client.post(
+        "/api/input_h5_file",
+        json={"sample_id": sample_id},
+        headers={**headers, "Range": "bytes=4-"},
+    )
+    assert response.status_code == 206
+    assert response.data == b"456789"
+    assert response.headers["Content-Range"] == "bytes 4-9/10"
+    # resuming an interrupted download of the same file
+    etag = response.headers["ETag"]
+    response = client.post(
+        "/api/input_h5_file",
+        json={"sample_id": sample_id},
+        headers={**headers, "Range": "bytes=2-3", "If-Range": etag},
+    )
+    assert response.status_code == 206
+    assert response.data == b"23"
+    # file has changed: If-Range doesn't match so whole file is returned
+    response = client.post(
+        "/api/input_h5_file",
+        json={"sample_id": sample_id},
+        headers={**headers, "Range": "bytes=2-3", "If-Range": '"abc123"'},
+    )
+    assert response.status_code == 200
+    assert response.data == content
+    response = client.post(
+        "/api/input_h5_file",
+        json={"sample_id": sample_id},
+        headers={**headers, "Range": "bytes=20-"},
+    )
+    assert response.status_code == 416
+
+
+@pytest.mark.parametrize("input_file_type", ["h5", "csv"])
+def test_input_file_x_accel_redirect(app, client, input_file_type: str):
+    app.config["PREDICTCR_X_ACCEL_REDIRECT"] = "/protected"
+    response = client.post(
+        f"/api/input_{input_file_type}_file",
+        json={"sample_id": 1},
+        headers=_get_auth_headers(client),
+    )
+    assert response.status_code == 200
+    assert response.data == b""
+    assert (
+        response.headers["X-Accel-Redirect"] == f"/protected/1/input.{input_file_type}"
+    )
+    assert (
+        response.headers["Content-Disposition"]
+        == f"attachment; filename=input.{input_file_type}"
+    )
+    # ownership is still checked before offloading
+    response = client.post(
+        f"/api/input_{input_file_type}_file",
+        json={"sample_id": 66},
+        headers=_get_auth_headers(client),
+    )
+    assert response.status_code == 400
+    assert "X-Accel-Redirect" not in response.headers
+
+
+def test_sample_chunked_upload(app, client):
+    # samples are validated later by the background task
+    app.config["PREDICTCR_VALIDATION_INTERVAL_SECS"] = 60
+    headers = _get_auth_headers(client)
+    response = client.post(
+        "/api/sample/upload",
+        json={
+            "name": "chunked",
+            "tumor_type": "Lung",
+            "source": "TIL",
+            "platform": "Illumina",
+        },
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert response.json["sample"]["status"] == "uploading"
+    sample_id = response.json["sample"]["id"]
+    url = f"/api/sample/upload/{sample_id}"
+    # the quota is only charged once the upload is finished
+    with app.app_context():
+        user = db.session.execute(
+            db.select(User).filter(User.email == "user@abc.xy")
+        ).scalar_one()
+        quota = user.quota
+        last_submission_timestamp = user.last_submission_timestamp
+    # uploading samples are not given to runners
+    runner_headers = _get_auth_headers(client, "runner@abc.xy", "runner")
+    response = client.post(
+        "/api/runner/request_job",
+        json={"runner_hostname": "abc"},
+        headers=runner_headers,
+    )
+    assert response.status_code == 200
+    assert response.json["sample_id"] != sample_id
+    # missing offset
+    assert client.put(f"{url}/h5", data=b"h5", headers=headers).status_code == 400
+    # invalid input file type
+    response = client.put(f"{url}/txt?offset=0", data=b"txt", headers=headers)
+    assert response.status_code == 400
+    # finish before uploading both files fails
+    assert client.post(f"{url}/finish", headers=headers).status_code == 400
+    # upload h5 file in two chunks
+    response = client.put(f"{url}/h5?offset=0", data=b"h5 ", headers=headers)
+    assert response.status_code == 200
+    assert response.json == {"size_bytes": 3}
+    # resending a chunk with a stale offset is rejected with the current size
+    response = client.put(f"{url}/h5?offset=0", data=b"h5 ", headers=headers)
+    assert response.status_code == 409
+    assert response.json["size_bytes"] == 3
+    response = client.put(f"{url}/h5?offset=3", data=b"data", headers=headers)
+    assert response.status_code == 200
+    assert response.json == {"size_bytes": 7}
+    response = client.put(f"{url}/csv?offset=0", data=b"csv data", headers=headers)
+    assert response.status_code == 200
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert response.json == {
+        "sample_id": sample_id,
+        "h5_size_bytes": 7,
+        "csv_size_bytes": 8,
+    }
+    # other users can't see or modify the upload
+    admin_headers = _get_auth_headers(client, "admin@abc.xy", "admin")
+    assert client.get(url, headers=admin_headers).status_code == 404
+    response = client.put(f"{url}/csv?offset=8", data=b"x", headers=admin_headers)
+    assert response.status_code == 404
+    with app.app_context():
+        user = db.session.execute(
+            db.select(User).filter(User.email == "user@abc.xy")
+        ).scalar_one()
+        assert user.quota == quota
+        assert user.last_submission_timestamp == last_submission_timestamp
+    response = client.post(f"{url}/finish", headers=headers)
+    assert response.status_code == 200
+    assert response.json["sample"]["status"] == "validating"
+    assert response.json["sample"]["input_size_bytes"] == 7 + 8
+    with app.app_context():
+        user = db.session.execute(
+            db.select(User).filter(User.email == "user@abc.xy")
+        ).scalar_one()
+        assert user.quota == quota - 1
+        assert user.last_submission_timestamp > last_submission_timestamp
+    assert (
+        response.json["sample"]["input_h5_sha256"]
+        == hashlib.sha256(b"h5 data").hexdigest()
+    )
+    assert (
+        response.json["sample"]["input_csv_sha256"]
+        == hashlib.sha256(b"csv data").hexdigest()
+    )
+    # upload is no longer in progress
+    assert client.get(url, headers=headers).status_code == 404
+    # samples are not given to runners until their input files have been validated
+    response = client.post(
+        "/api/runner/request_job",
+        json={"runner_hostname": "abc"},
+        headers=runner_headers,
+    )
+    assert response.status_code == 204
+
+
+_valid_h5_content = b"\x89HDF\r\n\x1a\n" + b"\x00" * 8
+_valid_csv_content = b"barcode,cdr3,chain,count\nAAAC,CASSL,TRB,3\nAAAG,CAVR,TRA,1\n"
+
+
+@pytest.mark.parametrize(
+    "h5_content,csv_content,error_message",
+    [
+        (_valid_h5_content, _valid_csv_content, ""),
+        (b"h5", _valid_csv_content, "H5 file is not a valid HDF5 file"),
+        (
+            _valid_h5_content,
+            b"barcode,chain\nAAAC,TRB\n",
+            "CSV file is missing required columns: cdr3",
+        ),
+    ],
+)
+def test_validate_samples(
+    app, client, monkeypatch, h5_content, csv_content, error_message
+):
+    app.config["PREDICTCR_VALIDATION_INTERVAL_SECS"] = 60
+    response = _add_sample(client, h5_content=h5_content, csv_content=csv_content)
+    assert response.status_code == 200
+    assert response.json["sample"]["status"] == "validating"
+    sample_id = response.json["sample"]["id"]
+    with app.app_context():
+        assert validate_samples() == [sample_id]
+        sample = db.session.get(Sample, sample_id)
+        assert sample.status == ("failed" if error_message else "queued")
+        assert sample.error_message == error_message
+        # the result for the same input files is cached
+        assert db.session.get(
+            InputValidation, f"v{VALIDATION_VERSION}:h5:{sample.input_h5_sha256}"
+        )
+        assert validate_samples() == []
+        # input files that were already validated are not checked again
+        sample.status = Status.VALIDATING
+        db.session.commit()
+        monkeypatch.setattr(predicTCR_server.model, "validate_h5_file", None)
+        monkeypatch.setattr(predicTCR_server.model, "validate_csv_file", None)
+        assert validate_samples() == [sample_id]
+        sample = db.session.get(Sample, sample_id)
+        assert sample.error_message == error_message
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+@pytest.mark.parametrize("valid", [True, False])
+def test_validate_samples_without_background_task(app, client, chunked, valid):
+    # with the background task disabled, samples are validated when they are submitted
+    assert app.config["PREDICTCR_VALIDATION_INTERVAL_SECS"] == 0
+    h5_content = _valid_h5_content if valid else b"h5"
+    if chunked:
+        headers = _get_auth_headers(client)
+        response = client.post(
+            "/api/sample/upload",
+            json={"name": "s", "tumor_type": "", "source": "", "platform": ""},
+            headers=headers,
+        )
+        url = f"/api/sample/upload/{response.json['sample']['id']}"
+        client.put(f"{url}/h5?offset=0", data=h5_content, headers=headers)
+        client.put(f"{url}/csv?offset=0", data=_valid_csv_content, headers=headers)
+        response = client.post(f"{url}/finish", headers=headers)
+    else:
+        response = _add_sample(
+            client, h5_content=h5_content, csv_content=_valid_csv_content
+        )
+    assert response.status_code == 200
+    assert response.json["sample"]["status"] == ("queued" if valid else "failed")
+    if valid:
+        response = client.post(
+            "/api/runner/request_job",
+            json={"runner_hostname": "abc"},
+            headers=_get_auth_headers(client, "runner@abc.xy", "runner"),
+        )
+        assert response.json["sample_id"] == 1
+        response = client.post(
+            "/api/runner/request_job",
+            json={"runner_hostname": "abc"},
+            headers=_get_auth_headers(client, "runner@abc.xy", "runner"),
+        )
+        assert response.status_code == 200
+
+
+def test_sample_chunked_upload_quota(app, client):
+    with app.app_context():
+        user = db.session.execute(
+            db.select(User).filter(User.email == "user@abc.xy")
+        ).scalar_one()
+        user.quota = 2
+        user.submission_interval_minutes = 0
+        db.session.commit()
+    headers = _get_auth_headers(client)
+    sample_ids = []
+    for _ in range(2):
+        response = client.post(
+            "/api/sample/upload",
+            json={"name": "s", "tumor_type": "", "source": "", "platform": ""},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        sample_ids.append(response.json["sample"]["id"])
+    # open uploads reserve the remaining quota
+    response = client.post(
+        "/api/sample/upload",
+        json={"name": "s", "tumor_type": "", "source": "", "platform": ""},
+        headers=headers,
+    )
+    assert response.status_code == 400
+    assert "unfinished uploads" in response.json["message"]
+    # finishing an upload charges the quota, and its reservation is released
+    url = f"/api/sample/upload/{sample_ids[0]}"
+    client.put(f"{url}/h5?offset=0", data=_valid_h5_content, headers=headers)
+    client.put(f"{url}/csv?offset=0", data=_valid_csv_content, headers=headers)
+    assert client.post(f"{url}/finish", headers=headers).status_code == 200
+    response = client.post(
+        "/api/sample/upload",
+        json={"name": "s", "tumor_type": "", "source": "", "platform": ""},
+        headers=headers,
+    )
+    assert response.status_code == 400
+
+
+def test_sample_chunked_upload_too_large(app, client):
+    with app.app_context():
+        settings = db.session.get(Settings, 1)
+        settings.max_filesize_csv_mb = 1
+        db.session.commit()
+        notify_settings_changed()
+    headers = _get_auth_headers(client)
+    response = client.post(
+        "/api/sample/upload",
+        json={"name": "big", "tumor_type": "", "source": "", "platform": ""},
+        headers=headers,
+    )
+    sample_id = response.json["sample"]["id"]
+    url = f"/api/sample/upload/{sample_id}/csv"
+    chunk = b"x" * (768 * 1024)
+    response = client.put(f"{url}?offset=0", data=chunk, headers=headers)
+    assert response.status_code == 200
+    response = client.put(f"{url}?offset={len(chunk)}", data=chunk, headers=headers)
+    assert response.status_code == 413
+    # rejected chunk is discarded so the upload can be resumed
+    assert response.json["size_bytes"] == len(chunk)
+    response = client.get(f"/api/sample/upload/{sample_id}", headers=headers)
+    assert response.json["csv_size_bytes"] == len(chunk)
+
+
+def test_delete_stale_uploads(app, client):
+    app.config["PREDICTCR_UPLOAD_EXPIRY_HOURS"] = 1
+    with app.app_context():
+        user = db.session.execute(
+            db.select(User).filter(User.email == "user@abc.xy")
+        ).scalar_one()
+        user.quota = 2
+        db.session.commit()
+    headers = _get_auth_headers(client)
+    sample_ids = []
+    for name in ["stale", "active"]:
+        response = client.post(
+            "/api/sample/upload",
+            json={"name": name, "tumor_type": "", "source": "", "platform": ""},
+            headers=headers,
+        )
+        sample_ids.append(response.json["sample"]["id"])
+    stale_id, active_id = sample_ids
+    with app.app_context():
+        assert delete_stale_uploads() == []
+        two_hours_ago = time.time() - 2 * 3600
+        for sample_id in sample_ids:
+            sample = db.session.get(Sample, sample_id)
+            sample.timestamp = int(two_hours_ago)
+            for path in [sample.input_h5_file_path(), sample.input_csv_file_path()]:
+                os.utime(path, (two_hours_ago, two_hours_ago))
+        db.session.commit()
+        stale_base_path = db.session.get(Sample, stale_id).base_path()
+    # a recently uploaded chunk keeps the upload alive
+    url = f"/api/sample/upload/{active_id}/csv"
+    assert client.put(f"{url}?offset=0", data=b"x", headers=headers).status_code == 200
+    with app.app_context():
+        assert delete_stale_uploads() == [stale_id]
+        assert db.session.get(Sample, stale_id) is None
+        assert db.session.get(Sample, active_id) is not None
+    assert not stale_base_path.exists()
+    response = client.get(f"/api/sample/upload/{stale_id}", headers=headers)
+    assert response.status_code == 404
+
+
 def test_result_invalid(client):
     response = client.post("/api/result", json={"sample_id": 66})
     assert response.status_code == 401
@@ -224,23 +810,22 @@ def test_result_invalid(client):
 
 def _upload_result(client, result_zipfile: pathlib.Path, job_id: int, sample_id: int):
     headers = _get_auth_headers(client, "runner@abc.xy", "runner")
-    with open(result_zipfile, "rb") as f:
-        response = client.post(
-            "/api/runner/result",
-            data={
-                "job_id": job_id,
-                "sample_id": sample_id,
-                "success": True,
-                "user_results": (io.BytesIO(f.read()), result_zipfile.name),
-                "trusted_user_results": (io.BytesIO(f.read()), result_zipfile.name),
-                "admin_results": (io.BytesIO(f.read()), result_zipfile.name),
-            },
-            headers=headers,
-        )
-    return response
+    zip_data = result_zipfile.read_bytes()
+    return client.post(
+        "/api/runner/result",
+        data={
+            "job_id": job_id,
+            "sample_id": sample_id,
+            "success": True,
+            "user_results": (io.BytesIO(zip_data), result_zipfile.name),
+            "trusted_user_results": (io.BytesIO(zip_data), result_zipfile.name),
+            "admin_results": (io.BytesIO(zip_data), result_zipfile.name),
+        },
+        headers=headers,
+    )
 
 
-def test_runner_valid_success(client, result_zipfile):
+def test_runner_valid_success(app, client, result_zipfile):
     headers = _get_auth_headers(client, "runner@abc.xy", "runner")
     # request job
     request_job_response = client.post(
@@ -256,6 +841,10 @@ def test_runner_valid_success(client, result_zipfile):
         "sample_tumor_type": "tumor_type1",
         "sample_source": "source1",
         "sample_platform": "platform1",
+        "input_h5_size_bytes": 2,
+        "input_csv_size_bytes": 3,
+        "input_h5_sha256": "",
+        "input_csv_sha256": "",
     }
     # upload successful result
     assert _upload_result(client, result_zipfile, 1, 1).status_code == 200
@@ -265,7 +854,204 @@ def test_runner_valid_success(client, result_zipfile):
         headers=_get_auth_headers(client, "user@abc.xy", "user"),
     )
     assert response.status_code == 200
-    assert len(response.data) > 1
+    assert response.mimetype == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.data)) as z:
+        assert z.testzip() is None
+        assert sorted(z.namelist()) == ["a.txt", "b.txt", "c.txt"]
+        assert z.read("a.txt") == b"test file named a.txt"
+    # the three result zip files have the same members, which are only stored once
+    assert len(list(app.extensions["predictcr_blob_store"].blob_names())) == 3
+    # re-download of unchanged results
+    response = client.post(
+        "/api/result",
+        json={"sample_id": 1},
+        headers={
+            **_get_auth_headers(client, "user@abc.xy", "user"),
+            "If-None-Match": response.headers["ETag"],
+        },
+    )
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_admin_set_sample_priority(app, client):
+    url = "/api/admin/samples/1/priority"
+    response = client.post(url, json={"priority": 3}, headers=_get_auth_headers(client))
+    assert response.status_code == 400
+    admin_headers = _get_auth_headers(client, "admin@abc.xy", "admin")
+    response = client.post(url, json={"priority": "high"}, headers=admin_headers)
+    assert response.status_code == 400
+    response = client.post(
+        "/api/admin/samples/66/priority", json={"priority": 3}, headers=admin_headers
+    )
+    assert response.status_code == 404
+    response = client.post(url, json={"priority": 3}, headers=admin_headers)
+    assert response.status_code == 200
+    with app.app_context():
+        assert db.session.get(Sample, 1).priority == 3
+
+
+def test_runner_request_job_capabilities(client):
+    headers = _get_auth_headers(client, "runner@abc.xy", "runner")
+    # the only queued sample has platform "platform1"
+    response = client.post(
+        "/api/runner/request_job",
+        json={"runner_hostname": "me", "capabilities": {"platforms": ["Illumina"]}},
+        headers=headers,
+    )
+    assert response.status_code == 204
+    response = client.post(
+        "/api/runner/request_job",
+        json={"runner_hostname": "me", "capabilities": {"max_input_mb": "big"}},
+        headers=headers,
+    )
+    assert response.status_code == 400
+    assert "Invalid runner capabilities" in response.json["message"]
+    response = client.post(
+        "/api/runner/request_job",
+        json={
+            "runner_hostname": "me",
+            "capabilities": {
+                "memory_mb": 1024,
+                "cores": 2,
+                "platforms": ["Illumina", "platform1"],
+                "max_input_mb": 10,
+            },
+        },
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert response.json["sample_id"] == 1
+
+
+def test_runner_result_max_size(app, client, result_zipfile):
+    headers = _get_auth_headers(client, "runner@abc.xy", "runner")
+    client.post(
+        "/api/runner/request_job", json={"runner_hostname": "me"}, headers=headers
+    )
+    # results have their own size limit instead of the general upload limit
+    app.config["MAX_CONTENT_LENGTH"] = 256
+    app.config["PREDICTCR_RESULT_MAX_SIZE_MB"] = 1
+    response = client.post(
+        "/api/runner/result",
+        data={
+            "job_id": 1,
+            "sample_id": 1,
+            "success": True,
+            "user_results": (io.BytesIO(b"x" * 2 * 1024 * 1024), "user_results.zip"),
+        },
+        headers=headers,
+    )
+    assert response.status_code == 413
+    assert _upload_result(client, result_zipfile, 1, 1).status_code == 200
+
+
+def test_runner_invalid_result_zip(client):
+    headers = _get_auth_headers(client, "runner@abc.xy", "runner")
+    assert (
+        client.post(
+            "/api/runner/request_job", json={"runner_hostname": "me"}, headers=headers
+        ).status_code
+        == 200
+    )
+    response = client.post(
+        "/api/runner/result",
+        data={
+            "job_id": 1,
+            "sample_id": 1,
+            "success": True,
+            "user_results": (io.BytesIO(b"not a zip"), "user_results.zip"),
+            "trusted_user_results": (io.BytesIO(b"not a zip"), "user_results.zip"),
+            "admin_results": (io.BytesIO(b"not a zip"), "admin_results.zip"),
+        },
+        headers=headers,
+    )
+    assert response.status_code == 400
+    assert "Invalid result zip file" in response.json["message"]
+
+
+def test_migrate_results(app, tmp_path, result_zipfile):
+    with app.app_context():
+        sample = db.session.get(Sample, 1)
+        for kind in ["user_results", "trusted_user_results", "admin_results"]:
+            shutil.copy(result_zipfile, sample.base_path() / f"{kind}.zip")
+        # unreferenced blob left over from a deleted sample
+        (tmp_path / "blobs" / "ab").mkdir()
+        (tmp_path / "blobs" / "ab" / "abcd.stored").write_bytes(b"unused")
+    result = app.test_cli_runner().invoke(args=["migrate-results"])
+    assert result.exit_code == 0
+    with app.app_context():
+        sample = db.session.get(Sample, 1)
+        assert list(sample.base_path().glob("*.zip")) == []
+        members, _ = load_result_manifest(sample.user_result_file_path())
+        assert sorted(member["name"] for member in members) == [
+            "a.txt",
+            "b.txt",
+            "c.txt",
+        ]
+    assert sorted(
+        sha256 for sha256, _ in app.extensions["predictcr_blob_store"].blob_names()
+    ) == sorted(member["sha256"] for member in members)
+
+
+def test_result_zip_range_and_x_accel_redirect(app, client, result_zipfile):
+    client.post(
+        "/api/runner/request_job",
+        json={"runner_hostname": "me"},
+        headers=_get_auth_headers(client, "runner@abc.xy", "runner"),
+    )
+    assert _upload_result(client, result_zipfile, 1, 1).status_code == 200
+    headers = _get_auth_headers(client, "user@abc.xy", "user")
+    response = client.post("/api/result", json={"sample_id": 1}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["Content-Length"] == str(len(response.data))
+    assert (
+        response.headers["Content-Disposition"]
+        == "attachment; filename=user_results.zip"
+    )
+    zip_data = response.data
+    etag = response.headers["ETag"].strip('"')
+    # the assembled zip file is kept and can be range requested
+    zip_path = (
+        pathlib.Path(app.config["PREDICTCR_DATA_PATH"]) / "result_zips" / f"{etag}.zip"
+    )
+    assert zip_path.read_bytes() == zip_data
+    response = client.post(
+        "/api/result",
+        json={"sample_id": 1},
+        headers={**headers, "Range": "bytes=4-"},
+    )
+    assert response.status_code == 206
+    assert response.data == zip_data[4:]
+    assert (
+        response.headers["Content-Range"]
+        == f"bytes 4-{len(zip_data) - 1}/{len(zip_data)}"
+    )
+    # or offloaded to nginx
+    app.config["PREDICTCR_X_ACCEL_REDIRECT"] = "/protected"
+    response = client.post("/api/result", json={"sample_id": 1}, headers=headers)
+    assert response.status_code == 200
+    assert response.data == b""
+    assert response.headers["X-Accel-Redirect"] == f"/protected/result_zips/{etag}.zip"
+    assert (
+        response.headers["Content-Disposition"]
+        == "attachment; filename=user_results.zip"
+    )
+    with app.app_context():
+        # recently downloaded zip files of existing results are kept
+        assert collect_result_garbage(min_age_secs=0) == 0
+        assert zip_path.is_file()
+        # zip files that are not downloaded for a while are deleted
+        two_weeks_ago = time.time() - 14 * 24 * 3600
+        os.utime(zip_path, (two_weeks_ago, two_weeks_ago))
+        collect_result_garbage(min_age_secs=0)
+        assert not zip_path.is_file()
+        # as are those whose results are deleted
+        response = client.post("/api/result", json={"sample_id": 1}, headers=headers)
+        assert zip_path.is_file()
+        delete_results(db.session.get(Sample, 1))
+        assert collect_result_garbage(min_age_secs=0) == 3
+        assert not zip_path.is_file()
 
 
 def test_runner_valid_failure(client, result_zipfile):
@@ -284,6 +1070,10 @@ def test_runner_valid_failure(client, result_zipfile):
         "sample_tumor_type": "tumor_type1",
         "sample_source": "source1",
         "sample_platform": "platform1",
+        "input_h5_size_bytes": 2,
+        "input_csv_size_bytes": 3,
+        "input_h5_sha256": "",
+        "input_csv_sha256": "",
     }
     # upload failure result
     result_response = client.post(
@@ -305,6 +1095,167 @@ def test_runner_valid_failure(client, result_zipfile):
     assert response.status_code == 400
 
 
+def test_runner_request_job_concurrent(app, client, tmp_path):
+    queued_sample_ids = ftu.add_queued_samples(app, tmp_path, 40)
+    headers = _get_auth_headers(client, "runner@abc.xy", "runner")
+
+    def _request_jobs_until_queue_empty() -> list[int]:
+        sample_ids = []
+        while True:
+            response = client.post(
+                "/api/runner/request_job",
+                json={"runner_hostname": "me"},
+                headers=headers,
+            )
+            if response.status_code == 204:
+                return sample_ids
+            assert response.status_code == 200
+            sample_ids.append(response.json["sample_id"])
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(_request_jobs_until_queue_empty) for _ in range(8)]
+        claimed_sample_ids = [
+            sample_id for future in futures for sample_id in future.result()
+        ]
+    # no sample is ever handed out to more than one runner
+    assert len(claimed_sample_ids) == len(set(claimed_sample_ids))
+    assert set(queued_sample_ids) <= set(claimed_sample_ids)
+
+
+def test_runner_request_job_long_poll(app, client):
+    headers = _get_auth_headers(client, "runner@abc.xy", "runner")
+    admin_headers = _get_auth_headers(client, "admin@abc.xy", "admin")
+    # claim the only queued sample
+    response = client.post(
+        "/api/runner/request_job", json={"runner_hostname": "me"}, headers=headers
+    )
+    assert response.json["sample_id"] == 1
+    # no queued samples: long poll waits then returns no job
+    start_time = time.monotonic()
+    response = client.post(
+        "/api/runner/request_job",
+        json={"runner_hostname": "me", "wait_secs": 0.5},
+        headers=headers,
+    )
+    assert response.status_code == 204
+    assert time.monotonic() - start_time >= 0.5
+    # sample is queued while waiting: long poll returns it immediately
+    threading.Timer(
+        0.2,
+        lambda: client.post("/api/admin/resubmit-sample/3", headers=admin_headers),
+    ).start()
+    start_time = time.monotonic()
+    response = client.post(
+        "/api/runner/request_job",
+        json={"runner_hostname": "me", "wait_secs": 10},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert response.json["sample_id"] == 3
+    assert time.monotonic() - start_time < 10
+    # invalid wait times
+    for wait_secs in ["soon", None, -1, "nan", [1]]:
+        response = client.post(
+            "/api/runner/request_job",
+            json={"runner_hostname": "me", "wait_secs": wait_secs},
+            headers=headers,
+        )
+        assert response.status_code == 400
+        assert "wait_secs" in response.json["message"]
+    # all long-poll slots are occupied: request returns immediately
+    app.extensions["predictcr_long_poll_slots"] = threading.BoundedSemaphore(1)
+    app.extensions["predictcr_long_poll_slots"].acquire()
+    start_time = time.monotonic()
+    response = client.post(
+        "/api/runner/request_job",
+        json={"runner_hostname": "me", "wait_secs": 10},
+        headers=headers,
+    )
+    assert response.status_code == 204
+    assert time.monotonic() - start_time < 5
+
+
+def test_runner_release_job(client):
+    headers = _get_auth_headers(client, "runner@abc.xy", "runner")
+    response = client.post(
+        "/api/runner/request_job", json={"runner_hostname": "me"}, headers=headers
+    )
+    assert response.json["sample_id"] == 1
+    job_id = response.json["job_id"]
+    # missing / invalid keys
+    response = client.post(
+        "/api/runner/release_job", json={"sample_id": 1}, headers=headers
+    )
+    assert response.status_code == 400
+    response = client.post(
+        "/api/runner/release_job",
+        json={"job_id": job_id, "sample_id": 2},
+        headers=headers,
+    )
+    assert response.status_code == 400
+    # non-runner user
+    response = client.post(
+        "/api/runner/release_job",
+        json={"job_id": job_id, "sample_id": 1},
+        headers=_get_auth_headers(client),
+    )
+    assert response.status_code == 400
+    # release job: sample is back in the queue & can be claimed again
+    response = client.post(
+        "/api/runner/release_job",
+        json={"job_id": job_id, "sample_id": 1, "runner_hostname": "me"},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    response = client.post(
+        "/api/runner/request_job", json={"runner_hostname": "me"}, headers=headers
+    )
+    assert response.json["sample_id"] == 1
+    assert response.json["job_id"] != job_id
+    admin_headers = _get_auth_headers(client, "admin@abc.xy", "admin")
+    jobs = client.get("/api/admin/jobs", headers=admin_headers).json["jobs"]
+    released_job = [job for job in jobs if job["id"] == job_id][0]
+    assert released_job["status"] == "failed"
+    assert "released" in released_job["error_message"]
+    # the released job can't be released again
+    response = client.post(
+        "/api/runner/release_job",
+        json={"job_id": job_id, "sample_id": 1, "runner_hostname": "me"},
+        headers=headers,
+    )
+    assert response.status_code == 409
+
+
+def test_runner_release_job_after_timeout(app, client):
+    headers = _get_auth_headers(client, "runner@abc.xy", "runner")
+    response = client.post(
+        "/api/runner/request_job", json={"runner_hostname": "stale"}, headers=headers
+    )
+    assert response.json["sample_id"] == 1
+    stale_job_id = response.json["job_id"]
+    # the job times out and the sample is claimed by another runner
+    with app.app_context():
+        sample = db.session.get(Sample, 1)
+        sample.timestamp_job_start = 0
+        db.session.commit()
+        assert 1 in requeue_timed_out_samples()
+    response = client.post(
+        "/api/runner/request_job", json={"runner_hostname": "new"}, headers=headers
+    )
+    assert response.json["sample_id"] == 1
+    new_job_id = response.json["job_id"]
+    # the stale runner releasing its job doesn't put the sample back in the queue
+    response = client.post(
+        "/api/runner/release_job",
+        json={"job_id": stale_job_id, "sample_id": 1, "runner_hostname": "stale"},
+        headers=headers,
+    )
+    assert response.status_code == 409
+    with app.app_context():
+        assert db.session.get(Sample, 1).status == Status.RUNNING
+        assert db.session.get(Job, new_job_id).status == Status.RUNNING
+
+
 def test_admin_samples_valid(client):
     headers = _get_auth_headers(client, "admin@abc.xy", "admin")
     response = client.get("/api/admin/samples", headers=headers)
@@ -383,6 +1334,70 @@ def test_admin_users_valid(client):
     assert "users" in response.json
 
 
+def test_admin_users_paginated(client):
+    headers = _get_auth_headers(client, "admin@abc.xy", "admin")
+    response = client.get("/api/admin/users?limit=2", headers=headers)
+    assert response.status_code == 200
+    assert [user["id"] for user in response.json["users"]] == [3, 2]
+    assert "password_hash" not in response.json["users"][0]
+    response = client.get(
+        f"/api/admin/users?limit=2&cursor={response.json['next_cursor']}",
+        headers=headers,
+    )
+    assert [user["id"] for user in response.json["users"]] == [1]
+    assert response.json["next_cursor"] is None
+    response = client.get("/api/admin/users?limit=0", headers=headers)
+    assert response.status_code == 400
+
+
+def test_admin_jobs_paginated_and_stats(app, client, tmp_path, result_zipfile):
+    ftu.add_queued_samples(app, tmp_path, 2)
+    runner_headers = _get_auth_headers(client, "runner@abc.xy", "runner")
+    for hostname in ["a", "b", "a"]:
+        client.post(
+            "/api/runner/request_job",
+            json={"runner_hostname": hostname},
+            headers=runner_headers,
+        )
+    assert _upload_result(client, result_zipfile, 1, 1).status_code == 200
+    headers = _get_auth_headers(client, "admin@abc.xy", "admin")
+    response = client.get("/api/admin/jobs?limit=2", headers=headers)
+    assert response.status_code == 200
+    assert [job["id"] for job in response.json["jobs"]] == [3, 2]
+    response = client.get(
+        f"/api/admin/jobs?limit=2&cursor={response.json['next_cursor']}",
+        headers=headers,
+    )
+    assert [job["id"] for job in response.json["jobs"]] == [1]
+    assert response.json["next_cursor"] is None
+    # non-admin
+    response = client.get("/api/admin/jobs/stats", headers=runner_headers)
+    assert response.status_code == 400
+    response = client.get("/api/admin/jobs/stats", headers=headers)
+    assert response.status_code == 200
+    runners = response.json["runners"]
+    assert [runner["runner_hostname"] for runner in runners] == ["a", "b"]
+    assert runners[0]["jobs"] == 2
+    assert runners[0]["running"] == 1
+    assert runners[0]["completed"] == 1
+    assert runners[0]["failure_rate"] == 0.0
+    assert runners[1]["jobs"] == 1
+    assert runners[1]["running"] == 1
+
+
+def test_admin_cache_stats(client):
+    headers = _get_auth_headers(client)
+    assert client.get("/api/admin/cache_stats", headers=headers).status_code == 400
+    headers = _get_auth_headers(client, "admin@abc.xy", "admin")
+    for _ in range(3):
+        client.get("/api/admin/users", headers=headers)
+    response = client.get("/api/admin/cache_stats", headers=headers)
+    assert response.status_code == 200
+    assert response.json["users"]["hits"] >= 3
+    assert response.json["users"]["size"] >= 1
+    assert "hits" in response.json["settings"]
+
+
 def test_admin_update_user_valid(client):
     headers = _get_auth_headers(client, "admin@abc.xy", "admin")
     user = client.get("/api/admin/users", headers=headers).json["users"][0]
@@ -417,3 +1432,94 @@ def test_admin_update_user_invalid(client):
     headers = _get_auth_headers(client, "admin@abc.xy", "admin")
     response = client.post("/api/admin/user", headers=headers, json=user_update)
     assert response.status_code == 404
+
+
+def _parse_events(response) -> list[dict]:
+    events = []
+    for message in response.get_data(as_text=True).split("\n\n"):
+        fields = dict(
+            line.split(": ", 1)
+            for line in message.split("\n")
+            if line and not line.startswith(":")
+        )
+        if fields:
+            events.append(fields)
+    return events
+
+
+def test_samples_events(client):
+    client.application.config["PREDICTCR_EVENT_STREAM_MAX_SECS"] = 0
+    headers = _get_auth_headers(client)
+    admin_headers = _get_auth_headers(client, "admin@abc.xy", "admin")
+    response = client.get("/api/samples/events", headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    last_event_id = _parse_events(response)[-1]["id"]
+    assert (
+        client.post("/api/admin/resubmit-sample/3", headers=admin_headers).status_code
+        == 200
+    )
+    # samples of other users are not sent
+    client.application.extensions["predictcr_event_broker"].publish(
+        {"type": "sample", "data": {"id": 99, "email": "other@abc.xy"}}
+    )
+    response = client.get(
+        "/api/samples/events", headers=headers | {"Last-Event-ID": last_event_id}
+    )
+    events = [event for event in _parse_events(response) if "event" in event]
+    assert [event["event"] for event in events] == ["sample"]
+    sample = json.loads(events[0]["data"])
+    assert sample["id"] == 3
+    assert sample["status"] == "queued"
+    assert sample["has_results_zip"] is False
+    # events that are no longer available: client should reload its samples
+    response = client.get(
+        "/api/samples/events", headers=headers | {"Last-Event-ID": "unknown-1"}
+    )
+    assert _parse_events(response)[0]["event"] == "reset"
+
+
+def test_admin_events(client):
+    client.application.config["PREDICTCR_EVENT_STREAM_MAX_SECS"] = 0
+    headers = _get_auth_headers(client)
+    assert client.get("/api/admin/events", headers=headers).status_code == 400
+    admin_headers = _get_auth_headers(client, "admin@abc.xy", "admin")
+    runner_headers = _get_auth_headers(client, "runner@abc.xy", "runner")
+    last_event_id = _parse_events(
+        client.get("/api/admin/events", headers=admin_headers)
+    )[-1]["id"]
+    response = client.post(
+        "/api/runner/request_job",
+        json={"runner_hostname": "abc"},
+        headers=runner_headers,
+    )
+    assert response.status_code == 200
+    job_id = response.json["job_id"]
+    response = client.get(
+        "/api/admin/events", headers=admin_headers | {"Last-Event-ID": last_event_id}
+    )
+    events = [event for event in _parse_events(response) if "event" in event]
+    assert [event["event"] for event in events] == ["sample", "job"]
+    assert json.loads(events[0]["data"])["status"] == "running"
+    job = json.loads(events[1]["data"])
+    assert job["id"] == job_id
+    assert job["runner_hostname"] == "abc"
+    assert job["status"] == "running"
+
+
+def test_samples_events_wait_for_changes(client):
+    client.application.config["PREDICTCR_EVENT_STREAM_MAX_SECS"] = 10
+    headers = _get_auth_headers(client)
+    admin_headers = _get_auth_headers(client, "admin@abc.xy", "admin")
+    response = client.get("/api/samples/events", headers=headers, buffered=False)
+    stream = iter(response.response)
+    # initial message with the id to resume from
+    assert next(stream).startswith(b"id: ")
+    client.post("/api/admin/resubmit-sample/4", headers=admin_headers)
+    message = next(stream)
+    assert b"event: sample" in message
+    assert b'"id": 4' in message
+    response.close()
+    assert (
+        client.application.extensions["predictcr_event_broker"].stats()["streams"] == 0
+    )
@@ -0,0 +1,23 @@
+from __future__ import annotations
+import threading
+import flask
+from predicTCR_server.background import start_periodic_task
+
+
+def test_start_periodic_task():
+    app = flask.Flask("test")
+    app.config["VALUE"] = "from app context"
+    calls = []
+    called = threading.Event()
+
+    def _task():
+        calls.append(flask.current_app.config["VALUE"])
+        if len(calls) == 1:
+            raise RuntimeError("task exceptions are logged and the task continues")
+        called.set()
+
+    stop_event = start_periodic_task(app, "test_task", 0.01, _task)
+    assert called.wait(timeout=5)
+    stop_event.set()
+    assert calls[0] == "from app context"
+    assert len(calls) >= 2
@@ -0,0 +1,78 @@
+from __future__ import annotations
+import io
+import os
+import time
+import zipfile
+import pytest
+from predicTCR_server.blobs import BlobStore
+
+
+def _make_zip(files: dict[str, bytes], compression: int) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=compression) as z:
+        z.writestr("results/", b"")
+        for name, data in files.items():
+            z.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _read_zip(data: bytes) -> dict[str, bytes]:
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        assert z.testzip() is None
+        return {name: z.read(name) for name in z.namelist()}
+
+
+@pytest.mark.parametrize(
+    "compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_LZMA]
+)
+def test_blob_store_round_trip(tmp_path, compression):
+    store = BlobStore(str(tmp_path), chunk_size=16)
+    files = {
+        "results/a.txt": b"a" * 1000,
+        "results/b.bin": os.urandom(100),
+        "c.txt": b"",
+    }
+    members = store.put_zip(io.BytesIO(_make_zip(files, compression)))
+    assert [member["name"] for member in members] == ["results/", *files]
+    assert "sha256" not in members[0]
+    data = b"".join(store.zip_stream(members))
+    assert _read_zip(data) == {"results/": b"", **files}
+
+
+def test_blob_store_deduplicates_members(tmp_path):
+    store = BlobStore(str(tmp_path))
+    shared = os.urandom(1000)
+    store.put_zip(io.BytesIO(_make_zip({"a.bin": shared}, zipfile.ZIP_STORED)))
+    members = store.put_zip(
+        io.BytesIO(_make_zip({"b.bin": shared, "c.txt": b"c"}, zipfile.ZIP_DEFLATED))
+    )
+    assert len(list(store.blob_names())) == 2
+    data = b"".join(store.zip_stream(members))
+    assert _read_zip(data) == {"results/": b"", "b.bin": shared, "c.txt": b"c"}
+
+
+def test_blob_store_bad_zip(tmp_path):
+    store = BlobStore(str(tmp_path))
+    with pytest.raises(zipfile.BadZipFile):
+        store.put_zip(io.BytesIO(b"not a zip file"))
+    data = bytearray(_make_zip({"a.txt": b"abc" * 100}, zipfile.ZIP_STORED))
+    data[data.index(b"abcabc")] = ord("x")
+    with pytest.raises(zipfile.BadZipFile):
+        store.put_zip(io.BytesIO(bytes(data)))
+    assert list(store.blob_names()) == []
+    assert os.listdir(tmp_path / "tmp") == []
+
+
+def test_blob_store_collect_garbage(tmp_path):
+    store = BlobStore(str(tmp_path))
+    members = store.put_zip(
+        io.BytesIO(_make_zip({"a": b"a", "b": b"b"}, zipfile.ZIP_DEFLATED))
+    )
+    referenced = {members[1]["sha256"]}
+    # recently stored blobs are kept in case they are about to be referenced
+    assert store.collect_garbage(referenced, min_age_secs=60) == 0
+    old_time = time.time() - 120
+    for _, blob_path in store.blob_names():
+        os.utime(blob_path, (old_time, old_time))
+    assert store.collect_garbage(referenced, min_age_secs=60) == 1
+    assert [sha256 for sha256, _ in store.blob_names()] == list(referenced)
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import time
+from predicTCR_server.cache import VersionedCache, TTLCache
+
+
+def test_versioned_cache(tmp_path):
+    values = iter(range(100))
+    path = str(tmp_path / "version")
+    cache = VersionedCache(path, lambda: next(values))
+    assert cache.get() == 0
+    assert cache.get() == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.invalidate()
+    assert cache.get() == 1
+    assert cache.get() == 1
+    # another process using the same path invalidates it
+    VersionedCache(path, lambda: -1).invalidate()
+    assert cache.get() == 2
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_ttl_cache(tmp_path, monkeypatch):
+    path = str(tmp_path / "version")
+    cache = TTLCache(path, ttl_secs=10, max_size=2)
+    loads = []
+
+    def load(key):
+        loads.append(key)
+        return f"value{key}" if key > 0 else None
+
+    assert cache.get_or_load(1, load) == "value1"
+    assert cache.get_or_load(1, load) == "value1"
+    assert loads == [1]
+    # missing values are not cached
+    assert cache.get_or_load(0, load) is None
+    assert cache.get_or_load(0, load) is None
+    assert loads == [1, 0, 0]
+    # least recently used entry is evicted
+    cache.get_or_load(2, load)
+    cache.get_or_load(1, load)
+    cache.get_or_load(3, load)
+    assert cache.stats()["size"] == 2
+    loads.clear()
+    cache.get_or_load(1, load)
+    cache.get_or_load(2, load)
+    assert loads == [2]
+    # entries expire
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    cache.get_or_load(1, load)
+    assert loads == [2, 1]
+    # another process using the same path invalidates all entries
+    TTLCache(path, ttl_secs=10, max_size=2).invalidate()
+    cache.get_or_load(1, load)
+    assert loads == [2, 1, 1]
+
+
+def test_ttl_cache_invalidated_during_load(tmp_path):
+    cache = TTLCache(str(tmp_path / "version"), ttl_secs=10, max_size=2)
+
+    def load_then_invalidate(key):
+        # the value we loaded is already out of date
+        cache.invalidate()
+        return "stale"
+
+    assert cache.get_or_load(1, load_then_invalidate) == "stale"
+    assert cache.get_or_load(1, lambda key: "fresh") == "fresh"
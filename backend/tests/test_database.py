@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import sqlalchemy
+from concurrent.futures import ThreadPoolExecutor
+from predicTCR_server.database import engine_options, configure_sqlite
+import predicTCR_server.model as model
+
+
+def test_engine_options():
+    assert engine_options("sqlite:///:memory:", 4, 2) == {}
+    assert engine_options("sqlite://", 4, 2) == {}
+    assert engine_options("sqlite:////data/predicTCR.db", 4, 2) == {
+        "pool_size": 4,
+        "max_overflow": 2,
+    }
+    options = engine_options("postgresql+psycopg://user:pass@db/predictcr", 16, 8)
+    assert options["pool_size"] == 16
+    assert options["max_overflow"] == 8
+    assert options["pool_pre_ping"] is True
+
+
+def test_configure_sqlite(tmp_path):
+    engine = sqlalchemy.create_engine(
+        f"sqlite:///{tmp_path}/test.db", **engine_options("sqlite:///x.db", 8, 0)
+    )
+    configure_sqlite(engine, busy_timeout_ms=5000)
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+        # NORMAL
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+    # concurrent writers wait for the lock instead of failing
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE counter (n INTEGER)")
+
+    def _insert(n: int):
+        with engine.begin() as connection:
+            connection.exec_driver_sql("INSERT INTO counter VALUES (?)", (n,))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(_insert, range(200)))
+    with engine.connect() as connection:
+        assert (
+            connection.exec_driver_sql("SELECT COUNT(*) FROM counter").scalar() == 200
+        )
+    engine.dispose()
+
+
+def test_app_sqlite_database_uses_wal(app):
+    with app.app_context():
+        assert (
+            model.db.session.execute(model.db.text("PRAGMA journal_mode")).scalar()
+            == "wal"
+        )
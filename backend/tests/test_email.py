@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import os
+import time
+from email.message import EmailMessage
+from fake_smtp_server import FakeSMTPServer
+from predicTCR_server.email import EmailSpool
+
+
+def _message(n: int) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = "no-reply@abc.xy"
+    msg["To"] = f"user{n}@abc.xy"
+    msg["Subject"] = f"message {n}"
+    msg.set_content(f"message {n}")
+    return msg
+
+
+def test_email_spool_reuses_connection(tmp_path):
+    spool = EmailSpool(str(tmp_path))
+    for n in range(5):
+        spool.put(_message(n))
+    assert len(spool.pending()) == 5
+    with FakeSMTPServer() as server:
+        assert spool.send_pending(server.address) == 5
+        assert server.n_connections == 1
+        assert sorted(msg["To"] for msg in server.messages) == [
+            f"user{n}@abc.xy" for n in range(5)
+        ]
+    assert spool.pending() == []
+    assert os.listdir(tmp_path / "cur") == []
+
+
+def test_email_spool_retries_with_backoff(tmp_path, monkeypatch):
+    spool = EmailSpool(str(tmp_path), max_attempts=3, retry_backoff_secs=10)
+    spool.put(_message(0))
+    spool.put(_message(1))
+    with FakeSMTPServer(fail_data=1) as server:
+        # first message fails, second is sent using a new connection
+        assert spool.send_pending(server.address) == 1
+        assert server.n_connections == 2
+        assert len(server.messages) == 1
+        (pending,) = spool.pending()
+        assert pending.split("_")[1] == "1"
+        # not due yet
+        assert spool.send_pending(server.address) == 0
+        now = time.time()
+        monkeypatch.setattr(time, "time", lambda: now + 11)
+        assert spool.send_pending(server.address) == 1
+        assert len(server.messages) == 2
+    assert spool.pending() == []
+
+
+def test_email_spool_gives_up(tmp_path, monkeypatch):
+    spool = EmailSpool(str(tmp_path), max_attempts=2, retry_backoff_secs=0)
+    spool.put(_message(0))
+    with FakeSMTPServer(fail_data=2) as server:
+        assert spool.send_pending(server.address) == 0
+        assert spool.send_pending(server.address) == 0
+    assert spool.pending() == []
+    assert len(spool.failed()) == 1
+
+
+def test_email_spool_smtp_server_unavailable(tmp_path):
+    spool = EmailSpool(str(tmp_path))
+    spool.put(_message(0))
+    with FakeSMTPServer() as server:
+        address = server.address
+    assert spool.send_pending(address) == 0
+    assert len(spool.pending()) == 1
+
+
+def test_email_spool_requeues_stale_claims(tmp_path):
+    spool = EmailSpool(str(tmp_path), stale_claim_secs=60)
+    spool.put(_message(0))
+    (name,) = spool.pending()
+    # a sender claimed the message then died
+    claimed_path = spool._claim(name)
+    os.utime(claimed_path, (time.time() - 120, time.time() - 120))
+    with FakeSMTPServer() as server:
+        assert spool.send_pending(server.address) == 1
+    assert spool.pending() == []
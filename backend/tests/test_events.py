@@ -0,0 +1,108 @@
+from __future__ import annotations
+import threading
+import time
+import pytest
+from predicTCR_server.events import (
+    FileSignal,
+    QueueSignal,
+    EventBroker,
+    EventStreamsBusy,
+)
+
+
+def test_file_signal(tmp_path):
+    signal = FileSignal(str(tmp_path / "signal"))
+    assert signal.version() is None
+    signal.notify()
+    versions = {signal.version()}
+    for _ in range(5):
+        signal.notify()
+        versions.add(signal.version())
+    assert None not in versions
+    assert len(versions) == 6
+
+
+def test_file_signal_same_time(tmp_path, monkeypatch):
+    # notifies at the same time are still distinct, whatever the mtime resolution
+    signal = FileSignal(str(tmp_path / "signal"))
+    monkeypatch.setattr(time, "time_ns", lambda: 1)
+    signal.notify()
+    version = signal.version()
+    signal.notify()
+    assert signal.version() != version
+
+
+def test_queue_signal_same_process(tmp_path):
+    signal = QueueSignal(str(tmp_path / "signal"), poll_interval_secs=10)
+    version = signal.version()
+    assert signal.wait_for_change(version, 0.05) is False
+    threading.Timer(0.1, signal.notify).start()
+    start_time = time.monotonic()
+    assert signal.wait_for_change(version, 5) is True
+    # woken immediately, without waiting for the file poll interval
+    assert time.monotonic() - start_time < 5
+    # a notify before waiting is not missed
+    version = signal.version()
+    signal.notify()
+    assert signal.wait_for_change(version, 0) is True
+
+
+def test_queue_signal_other_process(tmp_path):
+    # separate QueueSignal instances on the same file, as in different processes
+    signal = QueueSignal(str(tmp_path / "signal"), poll_interval_secs=0.01)
+    other_process_signal = QueueSignal(str(tmp_path / "signal"))
+    version = signal.version()
+    threading.Timer(0.1, other_process_signal.notify).start()
+    assert signal.wait_for_change(version, 5) is True
+
+
+def test_event_broker_resume():
+    broker = EventBroker(max_events=3)
+    sequence = broker.sequence(None)
+    assert broker.wait_for_events(sequence, 0) == []
+    for n in range(2):
+        broker.publish({"n": n})
+    events = broker.wait_for_events(sequence, 0)
+    assert [event["n"] for _, event in events] == [0, 1]
+    # resume after the first event
+    sequence = broker.sequence(broker.event_id(events[0][0]))
+    assert [event["n"] for _, event in broker.wait_for_events(sequence, 0)] == [1]
+    # older events are dropped once more than max_events have been published
+    for n in range(2, 5):
+        broker.publish({"n": n})
+    assert broker.sequence(broker.event_id(events[0][0])) is None
+    assert broker.wait_for_events(events[0][0], 0) is None
+    sequence = broker.sequence(broker.event_id(events[1][0]))
+    assert [event["n"] for _, event in broker.wait_for_events(sequence, 0)] == [
+        2,
+        3,
+        4,
+    ]
+    # ids from a different broker, e.g. before a restart, can't be resumed
+    assert EventBroker().sequence(broker.event_id(1)) is None
+    assert broker.sequence("invalid") is None
+
+
+def test_event_broker_wakes_waiting_streams():
+    broker = EventBroker()
+    sequence = broker.sequence(None)
+    timer = threading.Timer(0.1, broker.publish, args=[{"n": 0}])
+    timer.start()
+    start = time.monotonic()
+    events = broker.wait_for_events(sequence, 10)
+    assert time.monotonic() - start < 5
+    assert [event for _, event in events] == [{"n": 0}]
+    timer.join()
+
+
+def test_event_broker_max_streams():
+    broker = EventBroker(max_streams=2)
+    broker.open_stream()
+    broker.open_stream()
+    with pytest.raises(EventStreamsBusy):
+        broker.open_stream()
+    assert broker.stats()["streams"] == 2
+    broker.close_stream()
+    broker.open_stream()
+    with pytest.raises(EventStreamsBusy):
+        EventBroker(max_streams=0).open_stream()
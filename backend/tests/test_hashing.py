@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import threading
+import pytest
+from predicTCR_server.hashing import (
+    HashingPool,
+    HashingPoolBusy,
+    argon2_parameters_error,
+    password_hasher,
+    verify_password,
+)
+
+
+def test_hashing_pool_admission():
+    pool = HashingPool(max_workers=2, max_queued=0)
+    assert pool.run(lambda x: 2 * x, 3) == 6
+    running = threading.Barrier(3)
+    release = threading.Event()
+
+    def blocked():
+        running.wait()
+        release.wait()
+
+    threads = [threading.Thread(target=pool.run, args=(blocked,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    running.wait()
+    # both threads are busy and no more calls can be queued
+    with pytest.raises(HashingPoolBusy):
+        pool.run(lambda: None)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert pool.run(lambda: 1) == 1
+
+
+def test_verify_password():
+    ph = password_hasher(1, 8192, 1)
+    password_hash = ph.hash("secret")
+    assert verify_password(ph, password_hash, "secret") == (True, None)
+    assert verify_password(ph, password_hash, "wrong") == (False, None)
+    # parameters changed: a new hash is returned
+    is_valid, new_hash = verify_password(
+        password_hasher(2, 8192, 1), password_hash, "secret"
+    )
+    assert is_valid
+    assert "t=2" in new_hash
+
+
+@pytest.mark.parametrize(
+    "time_cost,memory_cost_kib,parallelism,error_message",
+    [
+        (3, 65536, 4, ""),
+        (1, 8, 1, ""),
+        (0, 65536, 4, "argon2_time_cost must be between 1 and 20"),
+        (3, 65536, 0, "argon2_parallelism must be between 1 and 64"),
+        (3, 16, 4, "argon2_memory_cost_kib must be between 32"),
+        (3, 4 * 1024 * 1024, 4, "argon2_memory_cost_kib must be between 32"),
+        ("3", 65536, 4, "argon2_time_cost must be an integer"),
+        (3, 65536, True, "argon2_parallelism must be an integer"),
+    ],
+)
+def test_argon2_parameters_error(
+    time_cost, memory_cost_kib, parallelism, error_message
+):
+    message = argon2_parameters_error(time_cost, memory_cost_kib, parallelism)
+    assert message.startswith(error_message)
+    assert (message == "") == (error_message == "")
@@ -1,7 +1,11 @@
 from __future__ import annotations
 import predicTCR_server.model as model
 from predicTCR_server.settings import predicTCR_url
+from predicTCR_server.utils import timestamp_now
+from predicTCR_server.email import send_queued_emails
+import flask_test_utils as ftu
 import secrets
+import pytest
 
 
 def _count_users() -> int:
@@ -46,6 +50,7 @@ def test_add_new_user_valid(app):
         assert user.email == email
         assert user.is_admin is False
         assert user.activated is False
+        assert send_queued_emails() == 1
         email_msg = app.config["TESTING_ONLY_LAST_SMTP_MESSAGE"]
         assert email_msg["To"] == email
         # extract activation token from email contents
@@ -65,6 +70,7 @@ def test_add_new_user_valid(app):
         # enable user
         model.update_user({"email": email, "enabled": True})
         # user gets an email when their account has been enabled
+        assert send_queued_emails() == 1
         email_msg = app.config["TESTING_ONLY_LAST_SMTP_MESSAGE"]
         assert email_msg["To"] == email
         body = str(email_msg.get_body()).replace("=\n", "")
@@ -84,6 +90,7 @@ def test_send_password_reset_email_invalid(app):
     with app.app_context():
         email = "invalid@embl.de"
         model.send_password_reset_email(email)
+        assert send_queued_emails() == 1
         last_email_msg = app.config.get("TESTING_ONLY_LAST_SMTP_MESSAGE")
         assert last_email_msg is not None
         assert last_email_msg["To"] == email
@@ -98,6 +105,7 @@ def test_reset_password(app):
         email = "user@abc.xy"
         new_password = secrets.token_urlsafe()
         model.send_password_reset_email(email)
+        assert send_queued_emails() == 1
         last_email_msg = app.config.get("TESTING_ONLY_LAST_SMTP_MESSAGE")
         assert last_email_msg is not None
         assert last_email_msg["To"] == email
@@ -126,3 +134,440 @@ def test_reset_password(app):
         assert user is not None
         assert user.email == email
         assert user.check_password(new_password) is True
+
+
+def test_request_job_compare_and_swap_fallback(app, monkeypatch):
+    with app.app_context():
+        monkeypatch.setattr(model.db.engine.dialect, "update_returning", False)
+        sample = model.request_job()
+        assert sample is not None
+        assert sample.id == 1
+        assert sample.status == model.Status.RUNNING
+        assert sample.timestamp_job_start > 0
+        assert model.request_job() is None
+
+
+def _add_queued_sample(email: str, timestamp: int, priority: int = 0) -> int:
+    sample = model.Sample(
+        id=None,
+        email=email,
+        name=f"{email}{timestamp}",
+        tumor_type="tumor_type",
+        source="source",
+        platform="platform",
+        timestamp=timestamp,
+        timestamp_job_start=0,
+        timestamp_job_end=0,
+        status=model.Status.QUEUED,
+        has_results_zip=False,
+        error_message="",
+        priority=priority,
+    )
+    model.db.session.add(sample)
+    model.db.session.commit()
+    return sample.id
+
+
+@pytest.mark.parametrize("update_returning", [True, False])
+@pytest.mark.parametrize(
+    "policy,aging_secs,user_weight,expected_order",
+    [
+        ("fifo", 0, 1, ["u1", "u10", "u20", "a30", "a40"]),
+        ("priority", 0, 1, ["u20", "u1", "u10", "a30", "a40"]),
+        # waiting 4s counts as one priority level
+        ("priority", 4, 1, ["u1", "u10", "u20", "a30", "a40"]),
+        # user@abc.xy already has a running sample
+        ("fair_share", 0, 1, ["u20", "a30", "a40", "u1", "u10"]),
+        ("fair_share", 0, 4, ["u20", "a30", "u1", "u10", "a40"]),
+    ],
+)
+def test_request_job_scheduling_policies(
+    app, monkeypatch, update_returning, policy, aging_secs, user_weight, expected_order
+):
+    app.config["PREDICTCR_SCHEDULING_POLICY"] = policy
+    app.config["PREDICTCR_SCHEDULING_AGING_SECS"] = aging_secs
+    with app.app_context():
+        monkeypatch.setattr(
+            model.db.engine.dialect, "update_returning", update_returning
+        )
+        model.update_user({"email": "user@abc.xy", "scheduling_weight": user_weight})
+        names = {1: "u1"}
+        names[_add_queued_sample("user@abc.xy", 10)] = "u10"
+        names[_add_queued_sample("user@abc.xy", 20, priority=2)] = "u20"
+        names[_add_queued_sample("admin@abc.xy", 30)] = "a30"
+        names[_add_queued_sample("admin@abc.xy", 40)] = "a40"
+        order = []
+        while (sample := model.request_job()) is not None:
+            order.append(names[sample.id])
+        assert order == expected_order
+
+
+@pytest.mark.parametrize("update_returning", [True, False])
+@pytest.mark.parametrize(
+    "capabilities,memory_mb_per_input_mb,expected_names",
+    [
+        ({}, 0, ["small", "big", "other"]),
+        ({"platforms": ["Illumina"]}, 0, ["small", "big"]),
+        ({"max_input_mb": 10}, 0, ["small", "other"]),
+        ({"platforms": ["Illumina"], "max_input_mb": 10}, 0, ["small"]),
+        # the memory a job needs is estimated from the size of its input files
+        ({"memory_mb": 4096}, 0, ["small", "big", "other"]),
+        ({"memory_mb": 4096}, 100, ["small", "other"]),
+        ({"memory_mb": 4096, "max_input_mb": 1}, 100, []),
+    ],
+)
+def test_request_job_runner_capabilities(
+    app,
+    monkeypatch,
+    update_returning,
+    capabilities,
+    memory_mb_per_input_mb,
+    expected_names,
+):
+    app.config["PREDICTCR_MEMORY_MB_PER_INPUT_MB"] = memory_mb_per_input_mb
+    with app.app_context():
+        monkeypatch.setattr(
+            model.db.engine.dialect, "update_returning", update_returning
+        )
+        # only the new samples are queued
+        model.db.session.execute(
+            model.db.update(model.Sample).values(status=model.Status.COMPLETED)
+        )
+        names = {}
+        for timestamp, (name, platform, input_mb) in enumerate(
+            [("small", "Illumina", 2), ("big", "Illumina", 200), ("other", "x", 5)]
+        ):
+            sample_id = _add_queued_sample("user@abc.xy", timestamp)
+            sample = model.db.session.get(model.Sample, sample_id)
+            sample.platform = platform
+            sample.input_size_bytes = input_mb * 1024 * 1024
+            model.db.session.commit()
+            names[sample_id] = name
+        sample_filter = model.runner_sample_filter(capabilities)
+        claimed_names = []
+        while (sample := model.request_job(sample_filter=sample_filter)) is not None:
+            claimed_names.append(names[sample.id])
+        assert claimed_names == expected_names
+
+
+@pytest.mark.parametrize(
+    "capabilities",
+    [[], {"platforms": "Illumina"}, {"platforms": [1]}, {"max_input_mb": "big"}],
+)
+def test_runner_sample_filter_invalid(app, capabilities):
+    with app.app_context():
+        with pytest.raises(ValueError):
+            model.runner_sample_filter(capabilities)
+
+
+def _sample_index_names() -> set[str]:
+    return {
+        index["name"]
+        for index in model.db.inspect(model.db.engine).get_indexes("sample")
+    }
+
+
+def test_upgrade_database_adds_missing_indexes(app):
+    sample_indexes = {
+        "ix_sample_status_timestamp",
+        "ix_sample_status_timestamp_job_start",
+        "ix_sample_email_timestamp",
+        "ix_sample_timestamp_id",
+        "ix_sample_status_email",
+    }
+    with app.app_context():
+        assert sample_indexes <= _sample_index_names()
+        # simulate an existing database created before the indexes were added
+        for index_name in sample_indexes:
+            model.db.session.execute(model.db.text(f"DROP INDEX {index_name}"))
+        model.db.session.commit()
+        assert not sample_indexes & _sample_index_names()
+        model.upgrade_database()
+        assert sample_indexes <= _sample_index_names()
+        # calling it again is a no-op
+        model.upgrade_database()
+        assert sample_indexes <= _sample_index_names()
+
+
+def test_request_job_queries_use_indexes(app):
+    with app.app_context():
+        next_queued_sample = (
+            model.db.select(model.Sample.id)
+            .filter(model.Sample.status == model.Status.QUEUED)
+            .order_by(model.db.asc(model.Sample.timestamp))
+            .limit(1)
+        )
+        compiled = next_queued_sample.compile(
+            model.db.engine, compile_kwargs={"literal_binds": True}
+        )
+        query_plan = " ".join(
+            str(row)
+            for row in model.db.session.execute(
+                model.db.text(f"EXPLAIN QUERY PLAN {compiled}")
+            )
+        )
+        assert "ix_sample_status_timestamp" in query_plan
+        assert "TEMP B-TREE" not in query_plan
+
+
+@pytest.mark.parametrize("policy", ["fifo", "priority", "fair_share"])
+def test_scheduling_policy_queries_use_indexes(app, policy):
+    app.config["PREDICTCR_SCHEDULING_POLICY"] = policy
+    with app.app_context():
+        compiled = model._next_queued_sample_id(timestamp_now()).compile(
+            model.db.engine, compile_kwargs={"literal_binds": True}
+        )
+        query_plan = " ".join(
+            str(row)
+            for row in model.db.session.execute(
+                model.db.text(f"EXPLAIN QUERY PLAN {compiled}")
+            )
+        )
+        # only the queued samples are read, using the index
+        assert "ix_sample_status_timestamp" in query_plan
+        assert "SCAN sample" not in query_plan
+        if policy == "fair_share":
+            assert "ix_sample_status_email" in query_plan
+
+
+@pytest.mark.parametrize("email", [None, "user@abc.xy"])
+def test_samples_page_query_uses_index(app, email):
+    with app.app_context():
+        selected_samples = (
+            model.db.select(model.Sample)
+            .order_by(
+                model.db.desc(model.Sample.timestamp), model.db.desc(model.Sample.id)
+            )
+            .filter(
+                model.Sample.timestamp <= 100,
+                (model.Sample.timestamp < 100)
+                | ((model.Sample.timestamp == 100) & (model.Sample.id < 5)),
+            )
+            .limit(51)
+        )
+        if email is not None:
+            selected_samples = selected_samples.filter(model.Sample.email == email)
+        compiled = selected_samples.compile(
+            model.db.engine, compile_kwargs={"literal_binds": True}
+        )
+        query_plan = " ".join(
+            str(row)
+            for row in model.db.session.execute(
+                model.db.text(f"EXPLAIN QUERY PLAN {compiled}")
+            )
+        )
+        assert "ix_sample_" in query_plan
+        assert "TEMP B-TREE" not in query_plan
+
+
+def _add_running_job(sample_id: int, timestamp_start: int) -> int:
+    job = model.Job(
+        id=None,
+        sample_id=sample_id,
+        runner_id=3,
+        runner_hostname="runner",
+        timestamp_start=timestamp_start,
+        timestamp_end=0,
+        status=model.Status.RUNNING,
+        error_message="",
+    )
+    model.db.session.add(job)
+    model.db.session.commit()
+    return job.id
+
+
+@pytest.mark.parametrize("update_returning", [True, False])
+def test_requeue_timed_out_samples(app, tmp_path, monkeypatch, update_returning):
+    extra_sample_ids = ftu.add_queued_samples(app, tmp_path, 5)
+    with app.app_context():
+        monkeypatch.setattr(
+            model.db.engine.dialect, "update_returning", update_returning
+        )
+        now = timestamp_now()
+        # sample 2 has been running since timestamp 0, i.e. has timed out
+        stuck_sample_ids = [2] + extra_sample_ids[:3]
+        recent_sample_ids = extra_sample_ids[3:]
+        for sample_id in extra_sample_ids:
+            sample = model.db.session.get(model.Sample, sample_id)
+            sample.status = model.Status.RUNNING
+            sample.timestamp_job_start = (
+                0 if sample_id in stuck_sample_ids else now - 60
+            )
+        model.db.session.commit()
+        stuck_job_ids = [_add_running_job(i, 0) for i in stuck_sample_ids]
+        recent_job_ids = [_add_running_job(i, now - 60) for i in recent_sample_ids]
+        assert sorted(model.requeue_timed_out_samples()) == sorted(stuck_sample_ids)
+        for sample_id in stuck_sample_ids:
+            sample = model.db.session.get(model.Sample, sample_id)
+            assert sample.status == model.Status.QUEUED
+        for sample_id in recent_sample_ids:
+            sample = model.db.session.get(model.Sample, sample_id)
+            assert sample.status == model.Status.RUNNING
+        for job_id in stuck_job_ids:
+            job = model.db.session.get(model.Job, job_id)
+            assert job.status == model.Status.FAILED
+            assert "timed out" in job.error_message
+            assert job.timestamp_end >= now
+        for job_id in recent_job_ids:
+            job = model.db.session.get(model.Job, job_id)
+            assert job.status == model.Status.RUNNING
+        # nothing left to requeue
+        assert model.requeue_timed_out_samples() == []
+
+
+@pytest.mark.parametrize("delete_returning", [True, False])
+def test_send_notification_digests(app, tmp_path, monkeypatch, delete_returning):
+    sample_ids = ftu.add_queued_samples(app, tmp_path, 3)
+    with app.app_context():
+        monkeypatch.setattr(
+            model.db.engine.dialect, "delete_returning", delete_returning
+        )
+        assert model.send_notification_digests() == 0
+        for sample_id in sample_ids:
+            job_id = _add_running_job(sample_id, timestamp_now())
+            message, code = model.process_result(
+                job_id, sample_id, False, "failed", None, None, None
+            )
+            assert code == 200
+        # no emails are sent until the digest is sent
+        assert send_queued_emails() == 0
+        # one email listing all of the user's finished samples
+        assert model.send_notification_digests() == 1
+        assert send_queued_emails() == 1
+        email_msg = app.config["TESTING_ONLY_LAST_SMTP_MESSAGE"]
+        assert email_msg["To"] == "user@abc.xy"
+        body = str(email_msg.get_body()).replace("=\n", "")
+        for n, sample_id in enumerate(sample_ids):
+            assert f"queued{n} (id {sample_id}): failed" in body
+        # notifications are only sent once
+        assert model.send_notification_digests() == 0
+        assert send_queued_emails() == 0
+
+
+def test_enum_value_migrations(app, monkeypatch):
+    with app.app_context():
+        assert model._enum_value_migrations() == []
+        monkeypatch.setattr(model.db.engine.dialect, "name", "postgresql")
+        statements = model._enum_value_migrations()
+    # the status type is shared by all tables and only migrated once
+    assert statements == [
+        f"ALTER TYPE status ADD VALUE IF NOT EXISTS '{status.name}'"
+        for status in model.Status
+    ]
+
+
+def test_upgrade_database_adds_missing_columns(app):
+    with app.app_context():
+        # simulate an existing database created before the sha256 columns were added
+        for column in ["input_h5_sha256", "input_csv_sha256"]:
+            model.db.session.execute(
+                model.db.text(f"ALTER TABLE sample DROP COLUMN {column}")
+            )
+        model.db.session.commit()
+        columns = {
+            c["name"] for c in model.db.inspect(model.db.engine).get_columns("sample")
+        }
+        assert "input_h5_sha256" not in columns
+        model.upgrade_database()
+        model.db.session.expire_all()
+        sample = model.db.session.get(model.Sample, 1)
+        assert sample.input_h5_sha256 == ""
+        assert sample.input_csv_sha256 == ""
+
+
+def test_get_job_stats(app):
+    with app.app_context():
+        assert model.get_job_stats() == []
+        for hostname, status, timestamp_start, timestamp_end in [
+            ("a", model.Status.COMPLETED, 10, 20),
+            ("a", model.Status.FAILED, 10, 40),
+            ("a", model.Status.RUNNING, 50, 0),
+            ("b", model.Status.FAILED, 10, 11),
+            ("c", model.Status.RUNNING, 10, 0),
+        ]:
+            model.db.session.add(
+                model.Job(
+                    id=None,
+                    sample_id=1,
+                    runner_id=3,
+                    runner_hostname=hostname,
+                    timestamp_start=timestamp_start,
+                    timestamp_end=timestamp_end,
+                    status=status,
+                    error_message="",
+                )
+            )
+        model.db.session.commit()
+        assert model.get_job_stats() == [
+            {
+                "runner_hostname": "a",
+                "jobs": 3,
+                "running": 1,
+                "completed": 1,
+                "failed": 1,
+                "failure_rate": 0.5,
+                "mean_runtime_secs": 20.0,
+            },
+            {
+                "runner_hostname": "b",
+                "jobs": 1,
+                "running": 0,
+                "completed": 0,
+                "failed": 1,
+                "failure_rate": 1.0,
+                "mean_runtime_secs": 1.0,
+            },
+            {
+                "runner_hostname": "c",
+                "jobs": 1,
+                "running": 1,
+                "completed": 0,
+                "failed": 0,
+                "failure_rate": 0.0,
+                "mean_runtime_secs": 0.0,
+            },
+        ]
+
+
+def test_serialized_columns(app):
+    assert "password_hash" not in model.serialized_columns(model.User)
+    assert "email" in model.serialized_columns(model.User)
+    assert model.serialized_columns(model.Job) == (
+        "id",
+        "sample_id",
+        "runner_id",
+        "runner_hostname",
+        "timestamp_start",
+        "timestamp_end",
+        "status",
+        "error_message",
+    )
+    with app.app_context():
+        users = model.db.session.execute(model.db.select(model.User)).scalars()
+        user_dicts = model.iter_dicts(
+            model.select_serialized(model.User),
+            model.serialized_columns(model.User),
+            chunk_size=2,
+        )
+        # tuple fast path gives the same result as as_dict on the ORM objects
+        assert list(user_dicts) == [user.as_dict() for user in users]
+
+
+def test_get_user_by_id_cached(app):
+    with app.app_context():
+        user = model.get_user_by_id(2)
+        assert user.email == "user@abc.xy"
+        assert model.get_user_by_id(66) is None
+    with app.app_context():
+        # cached user is attached to the new session: changes to it are saved
+        user = model.get_user_by_id(2)
+        assert user.quota == 1
+        user.quota = 5
+        model.db.session.commit()
+        model.notify_user_changed()
+        assert app.extensions["predictcr_user_cache"].stats()["hits"] == 1
+    with app.app_context():
+        assert model.get_user_by_id(2).quota == 5
+        message, code = model.update_user({"email": "user@abc.xy", "quota": 7})
+        assert code == 200
+        assert model.get_user_by_id(2).quota == 7
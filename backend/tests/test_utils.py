@@ -4,6 +4,9 @@ from predicTCR_server.utils import (
     decode_password_reset_token,
 )
 from predicTCR_server.utils import encode_activation_token, decode_activation_token
+from predicTCR_server.utils import file_size_bytes, copy_stream_with_sha256, sha256_file
+import hashlib
+import io
 
 
 def test_password_reset_token():
@@ -28,3 +31,26 @@ def test_activation_token():
     assert decoded_email is None
     decoded_email = decode_activation_token("invalid-token", secret)
     assert decoded_email is None
+
+
+def test_file_size_bytes(tmp_path):
+    path = tmp_path / "file.txt"
+    assert file_size_bytes(path) is None
+    path.write_text("abc")
+    assert file_size_bytes(path) == 3
+    assert file_size_bytes(str(path)) == 3
+
+
+def test_copy_stream_with_sha256(tmp_path):
+    content = b"0123456789" * 1000
+    path = tmp_path / "file"
+    sha256 = copy_stream_with_sha256(io.BytesIO(content), path, chunk_size=7)
+    assert sha256 == hashlib.sha256(content).hexdigest()
+    assert path.read_bytes() == content
+
+
+def test_sha256_file(tmp_path):
+    content = b"0123456789" * 1000
+    path = tmp_path / "file"
+    path.write_bytes(content)
+    assert sha256_file(path, chunk_size=7) == hashlib.sha256(content).hexdigest()
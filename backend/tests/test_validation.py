@@ -0,0 +1,60 @@
+from __future__ import annotations
+import pytest
+from predicTCR_server.validation import validate_csv_file, validate_h5_file
+
+_required_columns = ["barcode", "cdr3"]
+
+
+@pytest.mark.parametrize(
+    "content,error_message",
+    [
+        (b"barcode,cdr3,count\nAAAC,CASSL,3\n", ""),
+        (b" cdr3 , barcode\r\nCASSL,AAAC\r\n\r\n", ""),
+        (b"", "CSV file is empty"),
+        (b"barcode,cdr3\n", ""),
+        (b"barcode,count\nAAAC,3\n", "CSV file is missing required columns: cdr3"),
+        # byte order mark added by Excel
+        (b"\xef\xbb\xbfbarcode,cdr3,chain\nA,B,C\n", ""),
+        # trailing delimiters and extra or missing optional values
+        (b"barcode,cdr3,chain\nA,B,C,\nA,B\n", ""),
+        # blank cells, also in required columns
+        (b"barcode,cdr3\nAAAC,CASSL\nAAAG\n", ""),
+        (b"barcode,cdr3\nAAAC, \n", ""),
+        (b"barcode,cdr3\xff\xfe\nx,y\n", "CSV file is not a valid UTF-8 text file"),
+    ],
+)
+def test_validate_csv_file(tmp_path, content, error_message):
+    path = tmp_path / "input.csv"
+    path.write_bytes(content)
+    assert validate_csv_file(path, _required_columns) == error_message
+
+
+@pytest.mark.parametrize(
+    "content,valid",
+    [
+        (b"\x89HDF\r\n\x1a\n" + b"\x00" * 100, True),
+        # the signature can be after a user block of 512, 1024, 2048, ... bytes
+        (b"\x00" * 1024 + b"\x89HDF\r\n\x1a\n", True),
+        (b"\x00" * 1000 + b"\x89HDF\r\n\x1a\n", False),
+        (b"", False),
+        (b"h5", False),
+    ],
+)
+def test_validate_h5_file_signature(tmp_path, monkeypatch, content, valid):
+    monkeypatch.setattr("predicTCR_server.validation.h5py", None)
+    path = tmp_path / "input.h5"
+    path.write_bytes(content)
+    assert validate_h5_file(path) == (
+        "" if valid else "H5 file is not a valid HDF5 file"
+    )
+
+
+def test_validate_h5_file_structure(tmp_path):
+    h5py = pytest.importorskip("h5py")
+    path = tmp_path / "input.h5"
+    with h5py.File(path, "w") as f:
+        f.create_group("matrix")
+    assert validate_h5_file(path) == "H5 file contains no datasets"
+    with h5py.File(path, "a") as f:
+        f["matrix"].create_dataset("data", data=[1, 2, 3])
+    assert validate_h5_file(path) == ""
@@ -18,6 +18,9 @@ export const useSettingsStore = defineStore("settings", () => {
     max_filesize_h5_mb: 1,
     max_filesize_csv_mb: 1,
     news_items_json: "[]",
+    argon2_time_cost: 3,
+    argon2_memory_cost_kib: 65536,
+    argon2_parallelism: 4,
   } as Settings);
 
   function refresh() {
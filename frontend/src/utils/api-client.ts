@@ -75,6 +75,70 @@ export function download_admin_result(sample_id: number, sample_name: string) {
   );
 }
 
+const upload_chunk_size = 8 * 1024 * 1024;
+const upload_max_retries = 5;
+
+function sleep(ms: number) {
+  return new Promise((resolve) => setTimeout(resolve, ms));
+}
+
+async function upload_file_in_chunks(
+  sample_id: number,
+  input_file_type: string,
+  file: File,
+) {
+  const url = `sample/upload/${sample_id}/${input_file_type}`;
+  // resume from whatever the server already has
+  const status = await apiClient.get(`sample/upload/${sample_id}`);
+  let offset = status.data[`${input_file_type}_size_bytes`] as number;
+  let retries = 0;
+  while (offset < file.size) {
+    const chunk = file.slice(offset, offset + upload_chunk_size);
+    try {
+      const response = await apiClient.put(url, chunk, {
+        params: { offset: offset },
+        headers: { "Content-Type": "application/octet-stream" },
+      });
+      offset = response.data.size_bytes;
+      retries = 0;
+    } catch (error) {
+      if (!axios.isAxiosError(error)) {
+        throw error;
+      }
+      // a previous attempt of this chunk may have arrived after all
+      if (error.response?.status === 409) {
+        offset = error.response.data.size_bytes;
+        continue;
+      }
+      // client errors such as a file that is too large are not retried
+      const http_status = error.response?.status ?? 0;
+      if (
+        (http_status >= 400 && http_status < 500) ||
+        retries >= upload_max_retries
+      ) {
+        throw error;
+      }
+      retries += 1;
+      await sleep(1000 * 2 ** retries);
+      // resume from the size the server has after the failed chunk
+      const status_response = await apiClient.get(`sample/upload/${sample_id}`);
+      offset = status_response.data[`${input_file_type}_size_bytes`] as number;
+    }
+  }
+}
+
+export async function upload_sample(
+  sample: object,
+  h5_file: File,
+  csv_file: File,
+) {
+  const response = await apiClient.post("sample/upload", sample);
+  const sample_id = response.data.sample.id as number;
+  await upload_file_in_chunks(sample_id, "h5", h5_file);
+  await upload_file_in_chunks(sample_id, "csv", csv_file);
+  return apiClient.post(`sample/upload/${sample_id}/finish`);
+}
+
 export function logout() {
   const user = useUserStore();
   user.user = null;
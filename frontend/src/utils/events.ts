@@ -0,0 +1,104 @@
+import { logout } from "@/utils/api-client";
+import { useUserStore } from "@/stores/user";
+import type { Sample } from "@/utils/types";
+
+function sleep(ms: number) {
+  return new Promise((resolve) => setTimeout(resolve, ms));
+}
+
+// Calls on_event for each server-sent event from the endpoint until signal is aborted,
+// reconnecting whenever the server closes the stream.
+// (EventSource can't be used as it doesn't allow setting the Authorization header)
+// Returns false if the server has no event streams available, so the caller should poll instead.
+export async function listen_to_events(
+  endpoint: string,
+  on_event: (event: string, data: Record<string, unknown>) => void,
+  signal: AbortSignal,
+) {
+  const user = useUserStore();
+  let last_event_id = "";
+  while (!signal.aborted) {
+    const headers: Record<string, string> = {
+      Authorization: `Bearer ${user.token}`,
+    };
+    if (last_event_id !== "") {
+      headers["Last-Event-ID"] = last_event_id;
+    }
+    try {
+      const response = await fetch(
+        `${import.meta.env.VITE_REST_API_LOCATION}/${endpoint}`,
+        { headers: headers, signal: signal },
+      );
+      if (!response.ok || response.body === null) {
+        if (response.status > 400 && response.status !== 503) {
+          logout();
+        }
+        return false;
+      }
+      const reader = response.body
+        .pipeThrough(new TextDecoderStream())
+        .getReader();
+      let buffer = "";
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) {
+          break;
+        }
+        buffer += value;
+        let end = buffer.indexOf("\n\n");
+        while (end >= 0) {
+          let event = "";
+          let data = "";
+          for (const line of buffer.slice(0, end).split("\n")) {
+            const separator = line.indexOf(": ");
+            const field = line.slice(0, separator);
+            const field_value = line.slice(separator + 2);
+            if (field === "id") {
+              last_event_id = field_value;
+            } else if (field === "event") {
+              event = field_value;
+            } else if (field === "data") {
+              data = field_value;
+            }
+          }
+          if (event !== "") {
+            on_event(event, JSON.parse(data));
+          }
+          buffer = buffer.slice(end + 2);
+          end = buffer.indexOf("\n\n");
+        }
+      }
+    } catch (error) {
+      if (signal.aborted) {
+        break;
+      }
+      console.log(error);
+      await sleep(5000);
+    }
+  }
+  return true;
+}
+
+// Applies a sample event to the list of samples in place.
+// Returns false if the samples need to be reloaded instead.
+export function apply_sample_event(
+  samples: Sample[],
+  event: string,
+  data: Record<string, unknown>,
+) {
+  if (event === "reset") {
+    return false;
+  }
+  const index = samples.findIndex((sample) => sample.id === data.id);
+  if (event === "sample_deleted") {
+    if (index >= 0) {
+      samples.splice(index, 1);
+    }
+  } else if (event === "sample") {
+    if (index < 0) {
+      return false;
+    }
+    Object.assign(samples[index], data);
+  }
+  return true;
+}
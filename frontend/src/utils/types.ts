@@ -11,6 +11,10 @@ export type Sample = {
   status: string;
   has_results_zip: boolean;
   error_message: string;
+  input_h5_sha256: string;
+  input_csv_sha256: string;
+  input_size_bytes: number;
+  priority: number;
 };
 
 export type User = {
@@ -24,6 +28,7 @@ export type User = {
   is_runner: boolean;
   full_results: boolean;
   submission_interval_minutes: number;
+  scheduling_weight: number;
 };
 
 export type Settings = {
@@ -40,6 +45,9 @@ export type Settings = {
   max_filesize_h5_mb: number;
   max_filesize_csv_mb: number;
   news_items_json: string;
+  argon2_time_cost: number;
+  argon2_memory_cost_kib: number;
+  argon2_parallelism: number;
 };
 
 export type Job = {
@@ -52,3 +60,13 @@ export type Job = {
   status: string;
   error_message: string;
 };
+
+export type RunnerJobStats = {
+  runner_hostname: string;
+  jobs: number;
+  running: number;
+  completed: number;
+  failed: number;
+  failure_rate: number;
+  mean_runtime_secs: number;
+};
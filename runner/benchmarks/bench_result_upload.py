@@ -0,0 +1,150 @@
+"""
+Wall time and peak extra disk use of uploading job results.
+
+Creates three result folders, each with a compressible text file and an
+incompressible .h5 file, then uploads them to a local stand-in for the
+predicTCR api that discards the request body. Compares writing a zip file of
+each folder with `shutil.make_archive` before uploading them, as the runner
+used to do, with streaming the zip files in the request body.
+
+    python benchmarks/bench_result_upload.py --folder-size-mb 200 --compression-level 6
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import click
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from predicTCR_runner.runner import Runner, Job
+
+_result_folders = ["admin_results", "trusted_user_results", "user_results"]
+
+
+class _DiscardHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            while chunk_size := int(self.rfile.readline().strip(), 16):
+                self.rfile.read(chunk_size + 2)
+            self.rfile.readline()
+        else:
+            remaining = int(self.headers["Content-Length"])
+            while remaining > 0:
+                remaining -= len(self.rfile.read(min(remaining, 1024 * 1024)))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _folder_size_bytes(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(dirpath, filename))
+        for dirpath, _, filenames in os.walk(path)
+        for filename in filenames
+    )
+
+
+def _make_result_folders(tmpdir: str, folder_size_mb: int) -> None:
+    half_size_bytes = folder_size_mb * 1024 * 1024 // 2
+    line = b"CASSLGQAYEQYF,TRBV7-9,TRBJ2-7,0.000123\n"
+    for result_folder in _result_folders:
+        os.makedirs(f"{tmpdir}/{result_folder}")
+        with open(f"{tmpdir}/{result_folder}/clones.csv", "wb") as f:
+            f.write(line * (half_size_bytes // len(line)))
+        with open(f"{tmpdir}/{result_folder}/embeddings.h5", "wb") as f:
+            f.write(os.urandom(half_size_bytes))
+
+
+def _upload_archives(runner: Runner, job: Job, tmpdir: str) -> None:
+    # the previous implementation: write each zip file to disk then upload them
+    for result_folder in _result_folders:
+        shutil.make_archive(
+            f"{tmpdir}/{result_folder}", "zip", f"{tmpdir}/{result_folder}"
+        )
+    files = {
+        result_folder: open(f"{tmpdir}/{result_folder}.zip", "rb")
+        for result_folder in _result_folders
+    }
+    try:
+        runner.session.post(
+            url=f"{runner.api_url}/runner/result",
+            files=files,
+            data={"job_id": job.job_id, "sample_id": job.sample_id, "success": True},
+            timeout=30,
+        )
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def _upload_streaming(runner: Runner, job: Job, tmpdir: str) -> None:
+    runner._upload_result(
+        job,
+        success=True,
+        result_folders={
+            result_folder: f"{tmpdir}/{result_folder}"
+            for result_folder in _result_folders
+        },
+        error_message="",
+    )
+
+
+def _measure(upload, runner: Runner, job: Job, tmpdir: str) -> tuple[float, int]:
+    initial_size_bytes = _folder_size_bytes(tmpdir)
+    peak_size_bytes = initial_size_bytes
+    done = threading.Event()
+
+    def _sample_disk_use():
+        nonlocal peak_size_bytes
+        while not done.wait(0.05):
+            peak_size_bytes = max(peak_size_bytes, _folder_size_bytes(tmpdir))
+
+    sampler = threading.Thread(target=_sample_disk_use)
+    sampler.start()
+    start = time.perf_counter()
+    upload(runner, job, tmpdir)
+    elapsed_secs = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    for result_folder in _result_folders:
+        if os.path.exists(f"{tmpdir}/{result_folder}.zip"):
+            os.remove(f"{tmpdir}/{result_folder}.zip")
+    return elapsed_secs, peak_size_bytes - initial_size_bytes
+
+
+@click.command()
+@click.option("--folder-size-mb", default=200, show_default=True)
+@click.option("--compression-level", default=6, show_default=True)
+def main(folder_size_mb: int, compression_level: int):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _DiscardHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    runner = Runner(
+        api_url=f"http://127.0.0.1:{server.server_port}/api",
+        jwt_token="abc",
+        compression_level=compression_level,
+    )
+    job = Job(1, 2, {})
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _make_result_folders(tmpdir, folder_size_mb)
+        click.echo(f"{'upload':>12} {'time [s]':>10} {'peak extra disk [MB]':>22}")
+        for name, upload in [
+            ("zip files", _upload_archives),
+            ("streaming", _upload_streaming),
+        ]:
+            elapsed_secs, disk_bytes = _measure(upload, runner, job, tmpdir)
+            click.echo(
+                f"{name:>12} {elapsed_secs:>10.2f} {disk_bytes / 1024 / 1024:>22.1f}"
+            )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Per-poll latency of runner job requests with and without a keep-alive session.
+
+Starts a local stand-in for the predicTCR api that replies 204 (no job
+available) to every job request, then times polling it with a new connection
+per request (plain `requests.post`) and with the runner's pooled session.
+
+    python benchmarks/bench_session.py --polls 1000
+"""
+
+from __future__ import annotations
+
+import threading
+import timeit
+import click
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from predicTCR_runner.runner import Runner
+
+
+class _NoJobHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@click.command()
+@click.option("--polls", default=1000, show_default=True)
+def main(polls: int):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _NoJobHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_port}/api"
+    runner = Runner(api_url=api_url, jwt_token="abc")
+
+    def _poll_new_connection():
+        requests.post(
+            url=f"{api_url}/runner/request_job",
+            json={"runner_hostname": runner.runner_hostname},
+            headers=runner.auth_header,
+            timeout=30,
+        )
+
+    click.echo(f"{'client':>16} {'mean poll latency [ms]':>24}")
+    for name, poll in [
+        ("requests.post", _poll_new_connection),
+        ("runner session", runner._request_job),
+    ]:
+        mean_secs = timeit.timeit(poll, number=polls) / polls
+        click.echo(f"{name:>16} {1000 * mean_secs:>24.3f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
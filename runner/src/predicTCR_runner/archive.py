@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import zipfile
+from typing import Iterator
+
+# files that are already compressed are stored as they are instead of being compressed again
+STORED_SUFFIXES = {
+    ".h5",
+    ".hdf5",
+    ".h5ad",
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".gif",
+    ".zip",
+    ".gz",
+    ".bz2",
+    ".xz",
+    ".zst",
+    ".bam",
+}
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _ChunkWriter:
+    """Write-only file object that puts fixed size chunks of the data written to it on a queue."""
+
+    def __init__(
+        self, chunks: queue.Queue, cancelled: threading.Event, chunk_size: int
+    ):
+        self._chunks = chunks
+        self._cancelled = cancelled
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+
+    def put(self, item: bytes | BaseException | None) -> None:
+        while True:
+            if self._cancelled.is_set():
+                raise _Cancelled()
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        while len(self._buffer) >= self._chunk_size:
+            self.put(bytes(self._buffer[: self._chunk_size]))
+            del self._buffer[: self._chunk_size]
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+
+
+class FolderZipper:
+    """
+    Zips a folder in a background thread without writing the zip file to disk.
+
+    The zip file is read in chunks from `chunks()`. At most `max_buffered_chunks`
+    chunks are kept in memory: the thread waits for them to be read before
+    compressing any more.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        compression_level: int = 6,
+        chunk_size: int = 1024 * 1024,
+        max_buffered_chunks: int = 64,
+    ):
+        self.folder = folder
+        self.compression_level = compression_level
+        self._chunks: queue.Queue = queue.Queue(maxsize=max_buffered_chunks)
+        self._cancelled = threading.Event()
+        self._writer = _ChunkWriter(self._chunks, self._cancelled, chunk_size)
+        self._thread = threading.Thread(target=self._zip, daemon=True)
+
+    def _compression(self, path: str) -> int:
+        if self.compression_level == 0:
+            return zipfile.ZIP_STORED
+        if os.path.splitext(path)[1].lower() in STORED_SUFFIXES:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def _zip(self) -> None:
+        try:
+            # the writer isn't seekable, so each entry is followed by a data descriptor
+            with zipfile.ZipFile(self._writer, "w") as zip_file:
+                for dirpath, dirnames, filenames in os.walk(self.folder):
+                    dirnames.sort()
+                    for name in dirnames + sorted(filenames):
+                        path = os.path.join(dirpath, name)
+                        zip_file.write(
+                            path,
+                            os.path.relpath(path, self.folder),
+                            compress_type=self._compression(path),
+                            compresslevel=self.compression_level,
+                        )
+            self._writer.close()
+            self._writer.put(None)
+        except _Cancelled:
+            pass
+        except BaseException as e:
+            try:
+                self._writer.put(e)
+            except _Cancelled:
+                pass
+
+    def start(self) -> FolderZipper:
+        self._thread.start()
+        return self
+
+    def chunks(self) -> Iterator[bytes]:
+        while (chunk := self._chunks.get()) is not None:
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def multipart_body(
+    boundary: str,
+    fields: dict[str, str],
+    folders: dict[str, str],
+    compression_level: int = 6,
+) -> Iterator[bytes]:
+    """
+    A multipart/form-data body containing `fields` and a zip file of each of `folders`.
+
+    All the folders are zipped in parallel as soon as the body starts to be read,
+    so they are compressed while the previous parts are being sent.
+    """
+    zippers = {
+        name: FolderZipper(folder, compression_level)
+        for name, folder in folders.items()
+    }
+    try:
+        for zipper in zippers.values():
+            zipper.start()
+        for name, value in fields.items():
+            yield (
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f"{value}\r\n"
+            ).encode()
+        for name, zipper in zippers.items():
+            yield (
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="{name}"; filename="{name}.zip"\r\n'
+                f"Content-Type: application/zip\r\n\r\n"
+            ).encode()
+            yield from zipper.chunks()
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
+    finally:
+        for zipper in zippers.values():
+            zipper.cancel()
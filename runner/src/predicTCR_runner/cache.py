@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import os
+import re
+import shutil
+import logging
+import pathlib
+import tempfile
+import threading
+
+
+class InputFileCache:
+    """
+    On-disk cache of input files, keyed by the sha256 of their contents.
+
+    Least recently used files are removed once the total size exceeds max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+    def _file_path(self, sha256: str) -> pathlib.Path:
+        if re.fullmatch(r"[0-9a-f]{64}", sha256) is None:
+            raise ValueError(f"Invalid sha256 '{sha256}'")
+        return self.path / sha256
+
+    def get(self, sha256: str) -> pathlib.Path | None:
+        with self._lock:
+            file_path = self._file_path(sha256)
+            try:
+                # mtime is used as the last access time for LRU eviction
+                os.utime(file_path)
+            except FileNotFoundError:
+                return None
+            return file_path
+
+    def put(self, sha256: str, source_path: str | os.PathLike) -> None:
+        file_path = self._file_path(sha256)
+        # copy to a temporary file first so a partially copied file is never in the cache
+        with tempfile.NamedTemporaryFile(dir=self.path, delete=False) as tmp_file:
+            with open(source_path, "rb") as source_file:
+                shutil.copyfileobj(source_file, tmp_file)
+        with self._lock:
+            os.replace(tmp_file.name, file_path)
+            self._evict()
+
+    def _evict(self) -> None:
+        cached_files = sorted(
+            (entry.stat().st_mtime_ns, entry.stat().st_size, pathlib.Path(entry.path))
+            for entry in os.scandir(self.path)
+            if entry.is_file() and re.fullmatch(r"[0-9a-f]{64}", entry.name)
+        )
+        total_bytes = sum(size for _, size, _ in cached_files)
+        for _, size, file_path in cached_files:
+            if total_bytes <= self.max_bytes:
+                break
+            self.logger.debug(f"Removing {file_path} from input file cache")
+            file_path.unlink(missing_ok=True)
+            total_bytes -= size
@@ -9,6 +9,102 @@ from .runner import Runner
 @click.option("--api-url", type=str)
 @click.option("--jwt-token", type=str)
 @click.option("--max-poll-interval", type=int, default=60, show_default=True)
+@click.option(
+    "--long-poll/--no-long-poll",
+    default=False,
+    help="Wait on the server for a job instead of polling at intervals",
+    show_default=True,
+)
+@click.option(
+    "--long-poll-wait",
+    type=int,
+    default=20,
+    help="Max time in seconds to wait on the server for a job when long polling",
+    show_default=True,
+)
+@click.option(
+    "--slots",
+    type=int,
+    default=1,
+    help="Number of jobs to run in parallel",
+    show_default=True,
+)
+@click.option(
+    "--slot-cpus",
+    type=int,
+    default=0,
+    help="Number of CPU cores each job is restricted to (0: no limit)",
+    show_default=True,
+)
+@click.option(
+    "--slot-memory-mb",
+    type=int,
+    default=0,
+    help="Max memory in MB for each job (0: no limit)",
+    show_default=True,
+)
+@click.option(
+    "--shutdown-timeout",
+    type=int,
+    default=5,
+    help="Time in seconds running jobs have to finish on shutdown before they are released back to the queue",
+    show_default=True,
+)
+@click.option(
+    "--retries",
+    type=int,
+    default=3,
+    help="Number of times to retry requests that fail with a connection error, and input file downloads that fail with 502/503/504",
+    show_default=True,
+)
+@click.option(
+    "--retry-backoff",
+    type=float,
+    default=0.5,
+    help="Backoff factor in seconds between retries, doubled for each retry and randomly jittered",
+    show_default=True,
+)
+@click.option(
+    "--cache-dir",
+    type=str,
+    default=None,
+    help="Folder to cache input files in, to avoid downloading them again when a job is retried",
+)
+@click.option(
+    "--cache-size-mb",
+    type=int,
+    default=10240,
+    help="Max total size in MB of the cached input files",
+    show_default=True,
+)
+@click.option(
+    "--compression-level",
+    type=click.IntRange(0, 9),
+    default=6,
+    help="Compression level of the uploaded result zip files (0: no compression). Already compressed files such as .h5 or .png are never compressed",
+    show_default=True,
+)
+@click.option(
+    "--upload-timeout",
+    type=int,
+    default=600,
+    help="Time in seconds to wait for the server to reply once a result upload has been sent, while it stores the result",
+    show_default=True,
+)
+@click.option(
+    "--platforms",
+    type=str,
+    default="",
+    help="Comma-separated list of the sample platforms this runner can run jobs for (empty: all)",
+    show_default=True,
+)
+@click.option(
+    "--max-input-mb",
+    type=int,
+    default=0,
+    help="Max total size in MB of the input files of the jobs this runner can run (0: no limit)",
+    show_default=True,
+)
 @click.option(
     "--log-level",
     default="INFO",
@@ -19,15 +115,69 @@ from .runner import Runner
     show_default=True,
     show_choices=True,
 )
-def main(api_url, jwt_token, max_poll_interval, log_level):
+def main(
+    api_url,
+    jwt_token,
+    max_poll_interval,
+    long_poll,
+    long_poll_wait,
+    slots,
+    slot_cpus,
+    slot_memory_mb,
+    shutdown_timeout,
+    retries,
+    retry_backoff,
+    cache_dir,
+    cache_size_mb,
+    compression_level,
+    upload_timeout,
+    platforms,
+    max_input_mb,
+    log_level,
+):
     logging.basicConfig(
         level=log_level, format="%(levelname)s %(module)s.%(funcName)s :: %(message)s"
     )
     logging.info("Starting predict TCR runner")
     logging.info(f"  - api_url={api_url}")
     logging.info(f"  - max_poll_interval={max_poll_interval}s")
+    logging.info(f"  - long_poll={long_poll}")
+    if long_poll:
+        logging.info(f"  - long_poll_wait={long_poll_wait}s")
+    logging.info(f"  - slots={slots}")
+    logging.info(f"  - slot_cpus={slot_cpus}")
+    logging.info(f"  - slot_memory_mb={slot_memory_mb}")
+    logging.info(f"  - shutdown_timeout={shutdown_timeout}s")
+    logging.info(f"  - retries={retries}")
+    logging.info(f"  - retry_backoff={retry_backoff}s")
+    logging.info(f"  - cache_dir={cache_dir}")
+    if cache_dir:
+        logging.info(f"  - cache_size_mb={cache_size_mb}")
+    logging.info(f"  - compression_level={compression_level}")
+    logging.info(f"  - upload_timeout={upload_timeout}s")
+    logging.info(f"  - platforms={platforms}")
+    logging.info(f"  - max_input_mb={max_input_mb}")
     logging.info(f"  - log_level={log_level}")
-    runner = Runner(api_url, jwt_token, max_poll_interval)
+    runner = Runner(
+        api_url,
+        jwt_token,
+        max_poll_interval,
+        long_poll_wait if long_poll else 0,
+        slots,
+        slot_cpus,
+        slot_memory_mb,
+        shutdown_timeout,
+        retries=retries,
+        retry_backoff=retry_backoff,
+        cache_dir=cache_dir,
+        cache_size_mb=cache_size_mb,
+        compression_level=compression_level,
+        upload_timeout=upload_timeout,
+        platforms=[
+            platform.strip() for platform in platforms.split(",") if platform.strip()
+        ],
+        max_input_mb=max_input_mb,
+    )
     runner.start()
 
 
@@ -1,136 +1,386 @@
 from __future__ import annotations
 
 import requests
-import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 import pathlib
 import os
 import tempfile
 import json
+import hashlib
 import shutil
+import uuid
+import signal
+import time
+import threading
 import subprocess
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from .cache import InputFileCache
+from .archive import multipart_body
+
+
+def _total_memory_mb() -> int:
+    total_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    # a container's memory can be limited to less than that of the host
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            total_bytes = min(total_bytes, int(f.read()))
+    except (OSError, ValueError):
+        pass
+    return total_bytes // (1024 * 1024)
+
+
+@dataclass
+class Job:
+    job_id: int
+    sample_id: int
+    request_job_response: dict
+    slot: int = 0
+    # set if the job was interrupted by a shutdown and handed back to the server
+    released: threading.Event = field(default_factory=threading.Event)
 
 
 class Runner:
-    def __init__(self, api_url: str, jwt_token: str, max_poll_interval: int = 60):
+    def __init__(
+        self,
+        api_url: str,
+        jwt_token: str,
+        max_poll_interval: int = 60,
+        long_poll_wait_secs: int = 0,
+        slots: int = 1,
+        slot_cpus: int = 0,
+        slot_memory_mb: int = 0,
+        shutdown_timeout: int = 5,
+        script_folder: str = "/script",
+        retries: int = 3,
+        retry_backoff: float = 0.5,
+        cache_dir: str | None = None,
+        cache_size_mb: int = 10240,
+        compression_level: int = 6,
+        upload_timeout: int = 600,
+        platforms: list[str] | None = None,
+        max_input_mb: int = 0,
+    ):
         self.api_url = api_url
         self.auth_header = {"Authorization": f"Bearer {jwt_token}"}
         self.max_poll_interval = max_poll_interval
-        self.poll_interval = 1
+        self.long_poll_wait_secs = long_poll_wait_secs
+        # each slot backs off independently when there are no jobs
+        self.poll_intervals = [1] * slots
+        self.slots = slots
+        self.slot_cpus = slot_cpus
+        self.slot_memory_mb = slot_memory_mb
+        self.shutdown_timeout = shutdown_timeout
+        self.script_folder = script_folder
+        self.download_chunk_size = 1024 * 1024
+        self.stop_event = threading.Event()
         self.runner_hostname = os.environ.get("HOSTNAME", "unknown")
         self.logger = logging.getLogger(__name__)
-        self.job_id: int | None = None
-        self.request_job_response: dict | None = None
-        self.sample_id: int | None = None
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.compression_level = compression_level
+        self.upload_timeout = upload_timeout
+        # the server may have acted on a request that returned an error status, e.g. claimed
+        # a job or stored a result before a gateway timeout: only retry if the connection fails
+        self.session = self._create_session(retries, retry_backoff, retry_status=False)
+        # downloading an input file has no side effects, so it can also be retried on errors
+        self.download_session = self._create_session(retries, retry_backoff)
+        self.cache = (
+            InputFileCache(cache_dir, cache_size_mb * 1024 * 1024)
+            if cache_dir
+            else None
+        )
+        # sent with each job request: the server only gives this runner jobs that it can run
+        self.capabilities = {
+            "memory_mb": slot_memory_mb or _total_memory_mb() // slots,
+            "cores": slot_cpus or max(1, len(os.sched_getaffinity(0)) // slots),
+            "platforms": platforms or [],
+            "max_input_mb": max_input_mb,
+        }
 
-    def _request_job(self) -> bool:
+    def _create_session(
+        self, retries: int, retry_backoff: float, retry_status: bool = True
+    ) -> requests.Session:
+        # retry connection errors, and optionally gateway errors from nginx, with jittered
+        # exponential backoff, but not read errors, as the server may already have acted on the request
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries if retry_status else 0,
+            status_forcelist=[502, 503, 504] if retry_status else None,
+            allowed_methods=None,
+            backoff_factor=retry_backoff,
+            backoff_jitter=retry_backoff,
+            raise_on_status=False,
+        )
+        # keep-alive connection pool shared by all slots
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=2 * self.slots + 1, max_retries=retry
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(self.auth_header)
+        return session
+
+    def _request_job(self, slot: int = 0) -> Job | None:
         self.logger.debug(f"Requesting job from {self.api_url}...")
-        self.job_id = None
-        self.sample_id = None
-        self.request_job_response = None
-        response = requests.post(
+        request_job_json = {
+            "runner_hostname": self.runner_hostname,
+            "capabilities": self.capabilities,
+        }
+        if self.long_poll_wait_secs > 0:
+            # the server waits up to this long for a job before replying
+            request_job_json["wait_secs"] = self.long_poll_wait_secs
+        start_time = time.monotonic()
+        response = self.session.post(
             url=f"{self.api_url}/runner/request_job",
-            json={"runner_hostname": self.runner_hostname},
-            headers=self.auth_header,
-            timeout=30,
+            json=request_job_json,
+            timeout=30 + self.long_poll_wait_secs,
         )
         if response.status_code == 204:
-            self.poll_interval = min(2 * self.poll_interval, self.max_poll_interval)
+            # the server may reply at once instead of waiting, e.g. if too many runners are waiting
+            if time.monotonic() - start_time >= self.long_poll_wait_secs / 2 > 0:
+                self.poll_intervals[slot] = 0
+            else:
+                self.poll_intervals[slot] = min(
+                    2 * self.poll_intervals[slot], self.max_poll_interval
+                )
             self.logger.debug(
-                f"  -> no job available, will check again in {self.poll_interval} seconds..."
+                f"  -> no job available, will check again in {self.poll_intervals[slot]} seconds..."
             )
-            return False
+            return None
         elif response.status_code == 200:
-            self.request_job_response = response.json()
-            self.job_id = self.request_job_response.get("job_id", None)
-            self.sample_id = self.request_job_response.get("sample_id", None)
-            self.logger.debug(
-                f"  -> job id {self.job_id} for sample id {self.sample_id}."
-            )
-            return self.job_id is not None and self.sample_id is not None
+            request_job_response = response.json()
+            job_id = request_job_response.get("job_id", None)
+            sample_id = request_job_response.get("sample_id", None)
+            self.logger.debug(f"  -> job id {job_id} for sample id {sample_id}.")
+            if job_id is None or sample_id is None:
+                return None
+            return Job(job_id, sample_id, request_job_response)
         else:
             self.logger.error(
                 f"request_job failed with {response.status_code}: {response.content}"
             )
-            return False
+            return None
 
-    def _report_job_failed(self, error_message: str):
-        self.logger.info(f"...job {self.job_id} failed for sample id {self.sample_id}.")
-        response = requests.post(
+    def _report_job_failed(self, job: Job, error_message: str):
+        self.logger.info(f"...job {job.job_id} failed for sample id {job.sample_id}.")
+        response = self.session.post(
             url=f"{self.api_url}/runner/result",
             data={
-                "job_id": self.job_id,
-                "sample_id": self.sample_id,
+                "job_id": job.job_id,
+                "sample_id": job.sample_id,
                 "runner_id": self.runner_hostname,
                 "success": "false",
                 "error_message": error_message,
             },
-            headers=self.auth_header,
             timeout=30,
         )
         if response.status_code != 200:
             self.logger.error(f"result with {response.status_code}: {response.content}")
 
+    def _release_job(self, job: Job):
+        self.logger.info(
+            f"...releasing job {job.job_id} for sample id {job.sample_id} back to the queue."
+        )
+        response = self.session.post(
+            url=f"{self.api_url}/runner/release_job",
+            json={
+                "job_id": job.job_id,
+                "sample_id": job.sample_id,
+                "runner_hostname": self.runner_hostname,
+            },
+            timeout=30,
+        )
+        if response.status_code != 200:
+            self.logger.error(
+                f"release_job failed with {response.status_code}: {response.content}"
+            )
+
+    def _download_input_file(
+        self, job: Job, input_file_type: str, tmpdir: str, use_cache: bool = True
+    ) -> str | None:
+        """
+        Stream an input file to disk, returns an error message if it failed.
+
+        If the file is in the input file cache, the server is only asked to
+        confirm that it hasn't changed.
+        """
+        input_file_name = f"input.{input_file_type}"
+        input_file_path = f"{tmpdir}/{input_file_name}"
+        self.logger.debug(f"  - downloading {input_file_name} to {tmpdir}...")
+        expected_size = job.request_job_response.get(
+            f"input_{input_file_type}_size_bytes", None
+        )
+        expected_sha256 = job.request_job_response.get(
+            f"input_{input_file_type}_sha256", ""
+        )
+        cached_file_path = None
+        headers = {}
+        if self.cache is not None and expected_sha256 and use_cache:
+            cached_file_path = self.cache.get(expected_sha256)
+            if cached_file_path is not None:
+                headers["If-None-Match"] = f'"{expected_sha256}"'
+        size = 0
+        sha256 = hashlib.sha256()
+        try:
+            with self.download_session.post(
+                url=f"{self.api_url}/input_{input_file_type}_file",
+                json={"sample_id": job.sample_id},
+                headers=headers,
+                timeout=30,
+                stream=True,
+            ) as response:
+                if response.status_code == 304 and cached_file_path is not None:
+                    self.logger.debug(f"    ...using cached {cached_file_path}.")
+                    try:
+                        shutil.copyfile(cached_file_path, input_file_path)
+                    except FileNotFoundError:
+                        # evicted by another slot since it was looked up: download it after all
+                        self.logger.debug(f"    ...{cached_file_path} was evicted.")
+                        return self._download_input_file(
+                            job, input_file_type, tmpdir, use_cache=False
+                        )
+                    return None
+                if response.status_code != 200:
+                    self.logger.error(
+                        f"Failed to download {input_file_type}: {response.content}"
+                    )
+                    return f"Failed to download {input_file_type} on {self.runner_hostname}"
+                with open(input_file_path, "wb") as input_file:
+                    for chunk in response.iter_content(
+                        chunk_size=self.download_chunk_size
+                    ):
+                        input_file.write(chunk)
+                        sha256.update(chunk)
+                        size += len(chunk)
+        except (requests.RequestException, OSError) as e:
+            self.logger.error(f"Failed to download {input_file_type}: {e}")
+            return (
+                f"Failed to download {input_file_type} on {self.runner_hostname}: {e}"
+            )
+        if expected_size is not None and size != expected_size:
+            self.logger.error(
+                f"Downloaded {input_file_name} has {size} bytes, expected {expected_size}"
+            )
+            return f"Incomplete download of {input_file_type} on {self.runner_hostname}"
+        if expected_sha256:
+            if sha256.hexdigest() != expected_sha256:
+                self.logger.error(
+                    f"Downloaded {input_file_name} has sha256 {sha256.hexdigest()}, expected {expected_sha256}"
+                )
+                return (
+                    f"Corrupted download of {input_file_type} on {self.runner_hostname}"
+                )
+            if self.cache is not None:
+                self.cache.put(expected_sha256, input_file_path)
+        self.logger.debug(f"    ...{input_file_name}: {size} bytes.")
+        return None
+
     def _upload_result(
         self,
+        job: Job,
         success: bool,
-        user_results: str,
-        trusted_user_results: str,
-        admin_results: str,
+        result_folders: dict[str, str],
         error_message: str,
     ):
+        """
+        Upload a zip file of each result folder.
+
+        The folders are zipped while they are being uploaded, so the zip files
+        are never written to disk.
+        """
         self.logger.info(
-            f"...job {self.job_id} {'complete' if success else 'failed'} for sample id {self.sample_id}, uploading {user_results}, {trusted_user_results} and {admin_results}..."
+            f"...job {job.job_id} {'complete' if success else 'failed'} for sample id {job.sample_id}, uploading {', '.join(result_folders.values())}..."
         )
-        with (
-            open(user_results, "rb") as user_result_file,
-            open(trusted_user_results, "rb") as trusted_user_result_file,
-            open(admin_results, "rb") as admin_result_file,
-        ):
-            response = requests.post(
-                url=f"{self.api_url}/runner/result",
-                files={
-                    "user_results": user_result_file,
-                    "trusted_user_results": trusted_user_result_file,
-                    "admin_results": admin_result_file,
-                },
-                data={
-                    "job_id": self.job_id,
-                    "sample_id": self.sample_id,
-                    "runner_hostname": self.runner_hostname,
-                    "success": success,
-                    "error_message": error_message,
-                },
-                headers=self.auth_header,
-                timeout=30,
-            )
-            if response.status_code != 200:
-                self.logger.error(f"Failed to upload result: {response.content}")
+        boundary = uuid.uuid4().hex
+        fields = {
+            "job_id": job.job_id,
+            "sample_id": job.sample_id,
+            "runner_hostname": self.runner_hostname,
+            "success": success,
+            "error_message": error_message,
+        }
+        # not retried on a gateway error, as the server may already have stored the result
+        response = self.session.post(
+            url=f"{self.api_url}/runner/result",
+            data=multipart_body(
+                boundary, fields, result_folders, self.compression_level
+            ),
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+            # the server only replies once it has stored the whole upload
+            timeout=(30, self.upload_timeout),
+        )
+        if response.status_code != 200:
+            self.logger.error(f"Failed to upload result: {response.content}")
+
+    def _slot_cpu_set(self, slot: int) -> set[int]:
+        if self.slot_cpus <= 0:
+            return set()
+        cpus = sorted(os.sched_getaffinity(0))
+        first_cpu = slot * self.slot_cpus
+        return {cpus[(first_cpu + i) % len(cpus)] for i in range(self.slot_cpus)}
+
+    def _slot_command(self, slot: int) -> list[str]:
+        # the limits are set by taskset & prlimit before they exec script.sh, so they
+        # apply to script.sh and every process it starts (preexec_fn is not safe with threads)
+        command = ["./script.sh"]
+        if self.slot_memory_mb > 0:
+            command = ["prlimit", f"--as={self.slot_memory_mb * 1024 * 1024}"] + command
+        cpu_set = self._slot_cpu_set(slot)
+        if cpu_set:
+            command = [
+                "taskset",
+                "-c",
+                ",".join(str(cpu) for cpu in sorted(cpu_set)),
+            ] + command
+        return command
+
+    def _slot_env(self) -> dict:
+        env = dict(os.environ)
+        if self.slot_cpus > 0:
+            env["OMP_NUM_THREADS"] = str(self.slot_cpus)
+        return env
 
-    def _run_job(self):
+    def _terminate_on_shutdown(
+        self, job: Job, proc: subprocess.Popen, job_finished: threading.Event
+    ):
+        while not job_finished.wait(1):
+            if self.stop_event.is_set():
+                if not job_finished.wait(self.shutdown_timeout):
+                    self.logger.info(
+                        f"Job {job.job_id} still running {self.shutdown_timeout}s after shutdown request - stopping it"
+                    )
+                    job.released.set()
+                    # stop script.sh and any processes it started
+                    os.killpg(proc.pid, signal.SIGTERM)
+                return
+
+    def _run_job(self, job: Job):
         self.logger.info(
-            f"Starting job {self.job_id} for sample id {self.sample_id}..."
+            f"Starting job {job.job_id} for sample id {job.sample_id} in slot {job.slot}..."
         )
         self.logger.debug("Downloading input files...")
-        with tempfile.TemporaryDirectory(delete=False) as tmpdir:
-            for input_file_type in ["h5", "csv"]:
-                response = requests.post(
-                    url=f"{self.api_url}/input_{input_file_type}_file",
-                    json={"sample_id": self.sample_id},
-                    headers=self.auth_header,
-                    timeout=30,
-                )
-                if response.status_code != 200:
-                    self.logger.error(
-                        f"Failed to download {input_file_type}: {response.content}"
-                    )
-                    return self._report_job_failed(
-                        f"Failed to download {input_file_type} on {self.runner_hostname}"
+        with tempfile.TemporaryDirectory(
+            prefix=f"predictcr_slot{job.slot}_", delete=False
+        ) as tmpdir:
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                download_errors = [
+                    error
+                    for error in pool.map(
+                        lambda input_file_type: self._download_input_file(
+                            job, input_file_type, tmpdir
+                        ),
+                        ["h5", "csv"],
                     )
-                input_file_name = f"input.{input_file_type}"
-                self.logger.debug(f"  - writing {input_file_name} to {tmpdir}...")
-                with open(f"{tmpdir}/{input_file_name}", "wb") as input_file:
-                    input_file.write(response.content)
+                    if error is not None
+                ]
+            if download_errors:
+                return self._report_job_failed(job, "; ".join(download_errors))
             try:
                 result_folders = [
                     "admin_results",
@@ -139,11 +389,11 @@ class Runner:
                 ]
                 self.logger.debug(f"  - writing job info to {tmpdir}/input.json...")
                 with open(f"{tmpdir}/input.json", "w") as f:
-                    json.dump(self.request_job_response, f)
+                    json.dump(job.request_job_response, f)
                 self.logger.debug(
                     f"  - copying contents of script folder to {tmpdir}..."
                 )
-                shutil.copytree("/script", tmpdir, dirs_exist_ok=True)
+                shutil.copytree(self.script_folder, tmpdir, dirs_exist_ok=True)
                 self.logger.debug(
                     "  - making admin_results and user_results folders..."
                 )
@@ -151,46 +401,86 @@ class Runner:
                     (pathlib.Path(tmpdir) / result_folder).mkdir(exist_ok=True)
                 self.logger.debug(f"  - running {tmpdir}/script.sh...")
                 script_output_last_line = ""
+                job_finished = threading.Event()
                 with subprocess.Popen(
-                    args=["./script.sh"],
+                    args=self._slot_command(job.slot),
                     cwd=tmpdir,
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE,
                     encoding="utf-8",
                     universal_newlines=True,
+                    env=self._slot_env(),
+                    start_new_session=True,
                 ) as proc:
+                    threading.Thread(
+                        target=self._terminate_on_shutdown,
+                        args=(job, proc, job_finished),
+                        daemon=True,
+                    ).start()
                     for line in proc.stdout:
                         script_output_last_line = line.strip()
                         self.logger.debug(f"./script.sh :: {script_output_last_line}")
+                job_finished.set()
+                if job.released.is_set():
+                    return self._release_job(job)
                 success = proc.returncode == 0
                 error_message = script_output_last_line if not success else ""
                 self.logger.debug(
                     f"     ...{tmpdir}/script.sh {'finished' if success else 'failed'}."
                 )
-                for result_folder in result_folders:
-                    result_folder_path = str(pathlib.Path(tmpdir) / result_folder)
-                    shutil.make_archive(result_folder_path, "zip", result_folder_path)
                 self._upload_result(
+                    job,
                     success=success,
-                    admin_results=f"{tmpdir}/admin_results.zip",
-                    trusted_user_results=f"{tmpdir}/trusted_user_results.zip",
-                    user_results=f"{tmpdir}/user_results.zip",
+                    result_folders={
+                        result_folder: f"{tmpdir}/{result_folder}"
+                        for result_folder in result_folders
+                    },
                     error_message=error_message,
                 )
-                self.poll_interval = 1
+                self.poll_intervals[job.slot] = 1
             except Exception as e:
                 self.logger.exception(e)
                 self.logger.error(
-                    f"Failed to run job {self.job_id} for sample {self.sample_id}: {e}"
+                    f"Failed to run job {job.job_id} for sample {job.sample_id}: {e}"
                 )
                 return self._report_job_failed(
-                    f"Error during job execution on {self.runner_hostname}: {e}"
+                    job, f"Error during job execution on {self.runner_hostname}: {e}"
                 )
 
-    def start(self):
-        self.logger.info(f"Polling {self.api_url} for jobs...")
-        while True:
-            if self._request_job():
-                self._run_job()
+    def _run_slot(self, slot: int):
+        while not self.stop_event.is_set():
+            try:
+                job = self._request_job(slot)
+            except requests.RequestException as e:
+                self.logger.error(f"request_job failed: {e}")
+                job = None
+            if job is not None:
+                job.slot = slot
+                self._run_job(job)
             else:
-                time.sleep(self.poll_interval)
+                self.stop_event.wait(self.poll_intervals[slot])
+        self.logger.debug(f"Slot {slot} stopped.")
+
+    def stop(self, *args):
+        if not self.stop_event.is_set():
+            self.logger.info(
+                f"Shutting down: running jobs have {self.shutdown_timeout}s to finish before being released..."
+            )
+        self.stop_event.set()
+
+    def start(self):
+        self.logger.info(f"Polling {self.api_url} for jobs using {self.slots} slots...")
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        slot_threads = [
+            threading.Thread(target=self._run_slot, args=(slot,), name=f"slot{slot}")
+            for slot in range(self.slots)
+        ]
+        for slot_thread in slot_threads:
+            slot_thread.start()
+        # join with a timeout so the main thread can still handle signals
+        while any(slot_thread.is_alive() for slot_thread in slot_threads):
+            for slot_thread in slot_threads:
+                slot_thread.join(timeout=1)
+        self.logger.info("Runner stopped.")
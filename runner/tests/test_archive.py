@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import io
+import os
+import zipfile
+import email.parser
+import email.policy
+import pytest
+from predicTCR_runner.archive import FolderZipper, multipart_body
+
+
+@pytest.fixture
+def result_folder(tmp_path):
+    folder = tmp_path / "results"
+    (folder / "plots").mkdir(parents=True)
+    (folder / "summary.txt").write_text("summary\n" * 1000)
+    (folder / "plots" / "plot.png").write_bytes(os.urandom(1000))
+    (folder / "data.h5").write_bytes(b"h5" * 1000)
+    return folder
+
+
+def _zip_bytes(folder, compression_level=6, chunk_size=1024 * 1024) -> bytes:
+    zipper = FolderZipper(str(folder), compression_level, chunk_size=chunk_size)
+    return b"".join(zipper.start().chunks())
+
+
+@pytest.mark.parametrize("chunk_size", [7, 1024 * 1024])
+def test_folder_zipper(result_folder, chunk_size):
+    with zipfile.ZipFile(io.BytesIO(_zip_bytes(result_folder, 6, chunk_size))) as z:
+        assert z.testzip() is None
+        assert sorted(z.namelist()) == [
+            "data.h5",
+            "plots/",
+            "plots/plot.png",
+            "summary.txt",
+        ]
+        assert z.read("summary.txt") == (result_folder / "summary.txt").read_bytes()
+        compress_types = {info.filename: info.compress_type for info in z.infolist()}
+    assert compress_types["summary.txt"] == zipfile.ZIP_DEFLATED
+    # already compressed files are not compressed again
+    assert compress_types["plots/plot.png"] == zipfile.ZIP_STORED
+    assert compress_types["data.h5"] == zipfile.ZIP_STORED
+
+
+def test_folder_zipper_no_compression(result_folder):
+    with zipfile.ZipFile(io.BytesIO(_zip_bytes(result_folder, 0))) as z:
+        assert {info.compress_type for info in z.infolist()} == {zipfile.ZIP_STORED}
+
+
+def test_folder_zipper_cancel(result_folder):
+    (result_folder / "big.bin").write_bytes(os.urandom(1024 * 1024))
+    zipper = FolderZipper(
+        str(result_folder), 0, chunk_size=1024, max_buffered_chunks=2
+    ).start()
+    next(zipper.chunks())
+    # the thread is waiting for chunks to be read: cancelling stops it
+    zipper.cancel()
+    assert not zipper._thread.is_alive()
+
+
+def test_folder_zipper_error(tmp_path):
+    zipper = FolderZipper(str(tmp_path / "missing"))
+    with zipfile.ZipFile(io.BytesIO(b"".join(zipper.start().chunks()))) as z:
+        assert z.namelist() == []
+    (tmp_path / "folder").mkdir()
+    os.symlink(tmp_path / "missing_file", tmp_path / "folder" / "broken_link")
+    zipper = FolderZipper(str(tmp_path / "folder"))
+    with pytest.raises(OSError):
+        b"".join(zipper.start().chunks())
+
+
+def test_multipart_body(result_folder, tmp_path):
+    (tmp_path / "empty").mkdir()
+    body = b"".join(
+        multipart_body(
+            "abc123",
+            {"job_id": 1, "success": True},
+            {
+                "user_results": str(result_folder),
+                "admin_results": str(tmp_path / "empty"),
+            },
+        )
+    )
+    message = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+        b'Content-Type: multipart/form-data; boundary="abc123"\r\n\r\n' + body
+    )
+    parts = {
+        part.get_param("name", header="content-disposition"): part
+        for part in message.iter_parts()
+    }
+    assert parts["job_id"].get_content() == "1"
+    assert parts["success"].get_content() == "True"
+    assert parts["user_results"].get_filename() == "user_results.zip"
+    with zipfile.ZipFile(io.BytesIO(parts["user_results"].get_content())) as z:
+        assert "summary.txt" in z.namelist()
+    with zipfile.ZipFile(io.BytesIO(parts["admin_results"].get_content())) as z:
+        assert z.namelist() == []
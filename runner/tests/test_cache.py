@@ -0,0 +1,41 @@
+import hashlib
+import os
+import time
+import pytest
+from predicTCR_runner.cache import InputFileCache
+
+
+def _write_file(path, content: bytes) -> str:
+    path.write_bytes(content)
+    return hashlib.sha256(content).hexdigest()
+
+
+def test_input_file_cache(tmp_path):
+    cache = InputFileCache(str(tmp_path / "cache"), max_bytes=25)
+    files = []
+    for name in ["a", "b"]:
+        path = tmp_path / name
+        sha256 = _write_file(path, name.encode() * 10)
+        files.append((sha256, path))
+    assert cache.get(files[0][0]) is None
+    cache.put(*files[0])
+    cache.put(*files[1])
+    for sha256, path in files:
+        assert cache.get(sha256).read_bytes() == path.read_bytes()
+    # make sure mtimes differ, then use "a" so that "b" is least recently used
+    time.sleep(0.01)
+    cache.get(files[0][0])
+    # adding "c" exceeds the size limit: "b" is evicted
+    path = tmp_path / "c"
+    sha256 = _write_file(path, b"c" * 10)
+    cache.put(sha256, path)
+    assert cache.get(files[0][0]) is not None
+    assert cache.get(files[1][0]) is None
+    assert cache.get(sha256) is not None
+    assert sorted(os.listdir(tmp_path / "cache")) == sorted([files[0][0], sha256])
+
+
+def test_input_file_cache_invalid_key(tmp_path):
+    cache = InputFileCache(str(tmp_path / "cache"), max_bytes=25)
+    with pytest.raises(ValueError):
+        cache.get("../../etc/passwd")
@@ -1,11 +1,305 @@
-from predicTCR_runner.runner import Runner
+import os
+import hashlib
+import time
+import threading
+import subprocess
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from predicTCR_runner.runner import Runner, Job
 
 
 def test_runner_request_job(requests_mock):
     requests_mock.post("http://api/runner/request_job", status_code=204)
     runner = Runner(api_url="http://api", jwt_token="abc")
-    assert runner._request_job() is False
+    assert runner._request_job() is None
     requests_mock.post(
         "http://api/runner/request_job", json={"job_id": 22, "sample_id": 44}
     )
-    assert runner._request_job() is True
+    job = runner._request_job()
+    assert job is not None
+    assert job.job_id == 22
+    assert job.sample_id == 44
+    assert job.request_job_response == {"job_id": 22, "sample_id": 44}
+
+
+def test_runner_request_job_long_poll(requests_mock):
+    requests_mock.post("http://api/runner/request_job", status_code=204)
+    runner = Runner(api_url="http://api", jwt_token="abc", long_poll_wait_secs=20)
+    assert runner._request_job() is None
+    assert requests_mock.last_request.json() == {
+        "runner_hostname": runner.runner_hostname,
+        "capabilities": runner.capabilities,
+        "wait_secs": 20,
+    }
+    # server replied without waiting for a job: back off before polling again
+    assert runner.poll_intervals[0] == 2
+
+    def _wait_then_reply(request, context):
+        time.sleep(0.6)
+        return b""
+
+    requests_mock.post(
+        "http://api/runner/request_job", status_code=204, content=_wait_then_reply
+    )
+    runner = Runner(api_url="http://api", jwt_token="abc", long_poll_wait_secs=1)
+    assert runner._request_job() is None
+    # server already waited for a job: no need to wait before polling again
+    assert runner.poll_intervals[0] == 0
+
+
+def test_runner_capabilities(requests_mock):
+    requests_mock.post("http://api/runner/request_job", status_code=204)
+    runner = Runner(
+        api_url="http://api",
+        jwt_token="abc",
+        slots=2,
+        slot_cpus=3,
+        slot_memory_mb=4096,
+        platforms=["Illumina"],
+        max_input_mb=100,
+    )
+    assert runner._request_job() is None
+    assert requests_mock.last_request.json()["capabilities"] == {
+        "memory_mb": 4096,
+        "cores": 3,
+        "platforms": ["Illumina"],
+        "max_input_mb": 100,
+    }
+    # without per-job limits each job is assumed to get its share of the host
+    runner = Runner(api_url="http://api", jwt_token="abc", slots=2)
+    assert runner.capabilities["memory_mb"] > 0
+    assert runner.capabilities["cores"] >= 1
+    assert runner.capabilities["platforms"] == []
+    assert runner.capabilities["max_input_mb"] == 0
+
+
+def test_runner_slot_cpu_set():
+    n_cpus = len(os.sched_getaffinity(0))
+    runner = Runner(api_url="http://api", jwt_token="abc", slots=4)
+    assert runner._slot_cpu_set(0) == set()
+    runner.slot_cpus = 1
+    assert len(runner._slot_cpu_set(0)) == 1
+    if n_cpus > 1:
+        assert runner._slot_cpu_set(0) != runner._slot_cpu_set(1)
+
+
+def test_runner_slot_command(tmp_path):
+    runner = Runner(api_url="http://api", jwt_token="abc", slots=2)
+    assert runner._slot_command(1) == ["./script.sh"]
+    runner = Runner(
+        api_url="http://api", jwt_token="abc", slots=2, slot_cpus=1, slot_memory_mb=512
+    )
+    command = runner._slot_command(1)
+    assert command[-1] == "./script.sh"
+    # limits are already set when the script starts, and inherited by its child processes
+    script = tmp_path / "script.sh"
+    script.write_text(
+        "#!/bin/bash\nsh -c 'ulimit -v; grep Cpus_allowed_list /proc/self/status'\n"
+    )
+    script.chmod(0o755)
+    output = subprocess.run(
+        command, cwd=tmp_path, capture_output=True, text=True, check=True
+    ).stdout.splitlines()
+    assert output[0] == str(512 * 1024)
+    (cpu,) = runner._slot_cpu_set(1)
+    assert output[1].split()[-1] == str(cpu)
+
+
+def test_runner_poll_intervals_per_slot(requests_mock):
+    requests_mock.post("http://api/runner/request_job", status_code=204)
+    runner = Runner(api_url="http://api", jwt_token="abc", slots=2)
+    assert runner._request_job(0) is None
+    assert runner._request_job(0) is None
+    assert runner.poll_intervals == [4, 1]
+    assert runner._request_job(1) is None
+    assert runner.poll_intervals == [4, 2]
+
+
+def test_runner_stop(requests_mock):
+    requests_mock.post("http://api/runner/request_job", status_code=204)
+    runner = Runner(api_url="http://api", jwt_token="abc", slots=3)
+    runner_thread = threading.Thread(target=runner.start)
+    runner_thread.start()
+    runner.stop()
+    runner_thread.join(timeout=10)
+    assert not runner_thread.is_alive()
+
+
+@pytest.fixture
+def script_folder(tmp_path):
+    script_folder = tmp_path / "script"
+    script_folder.mkdir()
+    script = script_folder / "script.sh"
+    script.write_text(
+        "#!/bin/sh\n"
+        "echo started > started.txt\n"
+        "sleep ${PREDICTCR_TEST_SLEEP:-0}\n"
+        "echo done > user_results/done.txt\n"
+    )
+    script.chmod(0o755)
+    return str(script_folder)
+
+
+def _mock_input_files(requests_mock):
+    for input_file_type in ["h5", "csv"]:
+        requests_mock.post(
+            f"http://api/input_{input_file_type}_file",
+            content=input_file_type.encode(),
+        )
+
+
+def test_runner_run_job(requests_mock, script_folder):
+    _mock_input_files(requests_mock)
+    requests_mock.post("http://api/runner/result")
+    runner = Runner(api_url="http://api", jwt_token="abc", script_folder=script_folder)
+    runner._run_job(Job(1, 2, {"job_id": 1, "sample_id": 2}))
+    result_request = requests_mock.last_request
+    assert result_request.url == "http://api/runner/result"
+    # result zip files are streamed in the request body
+    body = b"".join(result_request.body)
+    assert b'name="success"\r\n\r\nTrue' in body
+    assert b'filename="user_results.zip"' in body
+    assert b"user_results/done.txt" not in body
+    assert b"done.txt" in body
+    # the server may take a while to store a large upload before replying
+    assert result_request.timeout == (30, 600)
+
+
+def test_runner_run_job_released_on_shutdown(requests_mock, script_folder, monkeypatch):
+    monkeypatch.setenv("PREDICTCR_TEST_SLEEP", "60")
+    _mock_input_files(requests_mock)
+    requests_mock.post("http://api/runner/release_job")
+    runner = Runner(
+        api_url="http://api",
+        jwt_token="abc",
+        shutdown_timeout=0,
+        script_folder=script_folder,
+    )
+    job = Job(1, 2, {"job_id": 1, "sample_id": 2})
+    job_thread = threading.Thread(target=runner._run_job, args=(job,))
+    job_thread.start()
+    runner.stop()
+    job_thread.join(timeout=30)
+    assert not job_thread.is_alive()
+    assert job.released.is_set()
+    assert requests_mock.last_request.url == "http://api/runner/release_job"
+    assert requests_mock.last_request.json()["job_id"] == 1
+
+
+def test_runner_download_input_file(requests_mock, tmp_path):
+    content = os.urandom(3 * 1024 * 1024 + 17)
+    requests_mock.post("http://api/input_h5_file", content=content)
+    runner = Runner(api_url="http://api", jwt_token="abc")
+    job = Job(1, 2, {"input_h5_size_bytes": len(content)})
+    assert runner._download_input_file(job, "h5", str(tmp_path)) is None
+    assert (tmp_path / "input.h5").read_bytes() == content
+    assert requests_mock.last_request.json() == {"sample_id": 2}
+    # size doesn't match the one from the server
+    job = Job(1, 2, {"input_h5_size_bytes": len(content) + 1})
+    assert "Incomplete" in runner._download_input_file(job, "h5", str(tmp_path))
+    # server error
+    requests_mock.post("http://api/input_h5_file", status_code=400)
+    assert "Failed" in runner._download_input_file(job, "h5", str(tmp_path))
+
+
+def test_runner_run_job_download_failed(requests_mock, script_folder):
+    requests_mock.post("http://api/input_h5_file", content=b"h5")
+    requests_mock.post("http://api/input_csv_file", status_code=500)
+    requests_mock.post("http://api/runner/result")
+    runner = Runner(api_url="http://api", jwt_token="abc", script_folder=script_folder)
+    runner._run_job(Job(1, 2, {"input_h5_size_bytes": 2}))
+    result_request = requests_mock.last_request
+    assert result_request.url == "http://api/runner/result"
+    assert "success=false" in result_request.text
+    assert "Failed+to+download+csv" in result_request.text
+
+
+class _FlakyRequestJobHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    status_codes = []
+    client_ports = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.client_ports.append(self.client_address[1])
+        body = b'{"job_id": 1, "sample_id": 2}'
+        status_code = self.status_codes.pop(0) if self.status_codes else 200
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def flaky_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FlakyRequestJobHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+def test_runner_session_retries_and_keep_alive(flaky_server, tmp_path):
+    api_url = f"http://127.0.0.1:{flaky_server.server_port}/api"
+    runner = Runner(api_url=api_url, jwt_token="abc", retries=2, retry_backoff=0)
+    _FlakyRequestJobHandler.client_ports.clear()
+    _FlakyRequestJobHandler.status_codes[:] = [503, 502]
+    assert runner._download_input_file(Job(1, 2, {}), "h5", str(tmp_path)) is None
+    assert (tmp_path / "input.h5").read_bytes() == b'{"job_id": 1, "sample_id": 2}'
+    # two retries on the same keep-alive connection
+    assert len(_FlakyRequestJobHandler.client_ports) == 3
+    assert len(set(_FlakyRequestJobHandler.client_ports)) == 1
+    # too many errors: gives up
+    _FlakyRequestJobHandler.status_codes[:] = [503, 503, 503]
+    assert runner._download_input_file(Job(1, 2, {}), "h5", str(tmp_path)) is not None
+    # the server may already have claimed a job: request_job is not retried
+    _FlakyRequestJobHandler.client_ports.clear()
+    _FlakyRequestJobHandler.status_codes[:] = [504]
+    assert runner._request_job() is None
+    assert len(_FlakyRequestJobHandler.client_ports) == 1
+    job = runner._request_job()
+    assert job is not None
+    assert job.job_id == 1
+
+
+def test_runner_download_input_file_cached(requests_mock, tmp_path):
+    content = b"h5 file contents"
+    sha256 = hashlib.sha256(content).hexdigest()
+    requests_mock.post("http://api/input_h5_file", content=content)
+    runner = Runner(
+        api_url="http://api", jwt_token="abc", cache_dir=str(tmp_path / "cache")
+    )
+    job = Job(1, 2, {"input_h5_sha256": sha256})
+    # not in cache: downloaded & added to cache
+    assert runner._download_input_file(job, "h5", str(tmp_path)) is None
+    assert "If-None-Match" not in requests_mock.last_request.headers
+    assert runner.cache.get(sha256).read_bytes() == content
+    # in cache: server confirms it's unchanged, so no download
+    requests_mock.post("http://api/input_h5_file", status_code=304)
+    (tmp_path / "input.h5").unlink()
+    assert runner._download_input_file(job, "h5", str(tmp_path)) is None
+    assert requests_mock.last_request.headers["If-None-Match"] == f'"{sha256}"'
+    assert (tmp_path / "input.h5").read_bytes() == content
+
+    # evicted from the cache by another slot before the server replies: downloaded again
+    def _evict_then_reply(request, context):
+        runner.cache.path.joinpath(sha256).unlink()
+        context.status_code = 304
+        return b""
+
+    requests_mock.post(
+        "http://api/input_h5_file",
+        [{"content": _evict_then_reply}, {"content": content}],
+    )
+    (tmp_path / "input.h5").unlink()
+    assert runner._download_input_file(job, "h5", str(tmp_path)) is None
+    assert "If-None-Match" not in requests_mock.last_request.headers
+    assert (tmp_path / "input.h5").read_bytes() == content
+    assert runner.cache.get(sha256).read_bytes() == content
+    # download doesn't match the sha256 from the server
+    requests_mock.post("http://api/input_h5_file", content=b"corrupted")
+    job = Job(1, 2, {"input_h5_sha256": hashlib.sha256(b"other").hexdigest()})
+    assert "Corrupted" in runner._download_input_file(job, "h5", str(tmp_path))